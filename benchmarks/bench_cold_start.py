@@ -0,0 +1,140 @@
+"""Cold start benchmark for the ingestion, processing and loading lambdas.
+
+Every lambda module is imported in a fresh interpreter under moto, with the
+totesys secret created in the mocked secrets manager. pg8000.connect is
+replaced by a local Postgres stand-in that sleeps for --handshake-ms to
+simulate the TCP+TLS+SCRAM handshake, unless --pg-host points at a real
+local Postgres. For each lambda it reports the import (init) time, the
+Postgres connections and secrets manager calls made while importing, and
+the time of the first and of a warm connect_to_db/connect_to_dw call.
+
+Run from the project root:
+    PYTHONPATH=. python benchmarks/bench_cold_start.py
+"""
+
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+from unittest.mock import MagicMock, patch
+
+LAMBDAS = {
+    "src.ingestion_lambda": "connect_to_db",
+    "src.processing_lambda": "connect_to_db",
+    "src.loading_lambda": "connect_to_dw",
+}
+
+
+def measure_lambda(module_name, args):
+    """Runs inside the child interpreter and returns the measurements."""
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-2")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+    import boto3
+    from moto import mock_aws
+
+    mock = mock_aws()
+    mock.start()
+    boto3.client("secretsmanager").create_secret(
+        Name="totesys_environment",
+        SecretString=json.dumps(
+            {
+                "host": args.pg_host or "localhost",
+                "port": args.pg_port,
+                "dbname": args.pg_database,
+                "username": args.pg_user,
+                "password": args.pg_password,
+            }
+        ),
+    )
+
+    counts = {"connections": 0, "secret_calls": 0}
+
+    def count_secret_call(**kwargs):
+        counts["secret_calls"] += 1
+
+    boto3.setup_default_session()
+    boto3.DEFAULT_SESSION.events.register(
+        "before-call.secrets-manager.GetSecretValue", count_secret_call
+    )
+
+    import pg8000
+
+    real_connect = pg8000.connect
+
+    def stand_in_connect(**kwargs):
+        counts["connections"] += 1
+        if args.pg_host:
+            return real_connect(**kwargs)
+        time.sleep(args.handshake_ms / 1000)
+        return MagicMock()
+
+    with patch("pg8000.connect", side_effect=stand_in_connect):
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        import_seconds = time.perf_counter() - started
+        at_import = dict(counts)
+
+        connect = getattr(module, LAMBDAS[module_name])
+        started = time.perf_counter()
+        connect().close()
+        first_connect_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        connect().close()
+        warm_connect_seconds = time.perf_counter() - started
+
+    mock.stop()
+    return {
+        "lambda": module_name,
+        "import_seconds": import_seconds,
+        "connections_at_import": at_import["connections"],
+        "secret_calls_at_import": at_import["secret_calls"],
+        "first_connect_seconds": first_connect_seconds,
+        "warm_connect_seconds": warm_connect_seconds,
+        "secret_calls_total": counts["secret_calls"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--handshake-ms", type=float, default=40.0)
+    parser.add_argument("--pg-host", default=None)
+    parser.add_argument("--pg-port", type=int, default=5432)
+    parser.add_argument("--pg-database", default="postgres")
+    parser.add_argument("--pg-user", default="postgres")
+    parser.add_argument("--pg-password", default="postgres")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_lambda(args.child, args)))
+        return
+
+    child_args = sys.argv[1:]
+    print(
+        f"{'lambda':<22}{'import s':>10}{'conns':>7}{'secrets':>9}"
+        f"{'1st connect s':>15}{'warm connect s':>16}{'secrets total':>15}"
+    )
+    for module_name in LAMBDAS:
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", module_name, *child_args],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{module_name:<22}{result['import_seconds']:>10.3f}"
+            f"{result['connections_at_import']:>7}"
+            f"{result['secret_calls_at_import']:>9}"
+            f"{result['first_connect_seconds']:>15.3f}"
+            f"{result['warm_connect_seconds']:>16.3f}"
+            f"{result['secret_calls_total']:>15}"
+        )
+
+
+if __name__ == "__main__":
+    main()
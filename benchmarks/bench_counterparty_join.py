@@ -0,0 +1,89 @@
+"""Benchmark of the legal address join used by process_dim_counterparty.
+
+Joins synthetic counterparties to synthetic addresses with join_legal_addresses()
+and with the nested loop it replaced. The nested loop is quadratic, so at the
+full size it is only timed on --nested-loop-rows counterparties and the
+full-size time is extrapolated from that sample.
+
+Run from the project root:
+    PYTHONPATH=. python benchmarks/bench_counterparty_join.py --rows 100000
+"""
+
+import argparse
+import copy
+import random
+import time
+
+from src.processing_lambda import (
+    COUNTERPARTY_LEGAL_ADDRESS_COLUMNS,
+    join_legal_addresses,
+)
+
+
+def make_tables(number_of_rows, seed=0):
+    """Builds counterparties and addresses, about 1% without a matching address."""
+    rng = random.Random(seed)
+    addresses = [
+        {
+            "address_id": address_id,
+            "address_line_1": f"{address_id} Example Road",
+            "address_line_2": None,
+            "district": "District",
+            "city": "City",
+            "postal_code": f"AB{address_id % 100} 1CD",
+            "country": "Country",
+            "phone": f"0{address_id:010d}",
+        }
+        for address_id in range(1, number_of_rows + 1)
+    ]
+    counterparties = [
+        {
+            "counterparty_id": counterparty_id,
+            "counterparty_legal_name": f"Counterparty {counterparty_id}",
+            "legal_address_id": rng.randrange(1, int(number_of_rows * 1.01) + 1),
+        }
+        for counterparty_id in range(1, number_of_rows + 1)
+    ]
+    return counterparties, addresses
+
+
+def nested_loop_join(counterparty_list, address_list):
+    """The join process_dim_counterparty used before join_legal_addresses()."""
+    for counterparty_dict in counterparty_list:
+        for address_dict in address_list:
+            if address_dict["address_id"] == counterparty_dict["legal_address_id"]:
+                for column, legal_column in COUNTERPARTY_LEGAL_ADDRESS_COLUMNS.items():
+                    counterparty_dict[legal_column] = address_dict[column]
+    return counterparty_list
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--nested-loop-rows", type=int, default=1_000)
+    args = parser.parse_args()
+
+    counterparties, addresses = make_tables(args.rows)
+    print(f"counterparties x addresses: {args.rows:,} x {len(addresses):,}")
+
+    joined = copy.deepcopy(counterparties)
+    started = time.perf_counter()
+    join_legal_addresses(joined, addresses)
+    indexed_seconds = time.perf_counter() - started
+    print(f"{'join_legal_addresses':>22}: {indexed_seconds:9.3f}s")
+
+    sample_size = min(args.nested_loop_rows, args.rows)
+    sample = copy.deepcopy(counterparties[:sample_size])
+    started = time.perf_counter()
+    nested_loop_join(sample, addresses)
+    sample_seconds = time.perf_counter() - started
+    nested_seconds = sample_seconds * args.rows / sample_size
+    estimated = "" if sample_size == args.rows else " (extrapolated)"
+    print(f"{'nested loop':>22}: {nested_seconds:9.3f}s{estimated}")
+    print(f"{'speed up':>22}: {nested_seconds / indexed_seconds:9.0f}x")
+
+    assert joined[:sample_size] == sample, "joins disagree"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Benchmark of full dimension reloads against merge_into_data_warehouse.
+
+Fills a temporary dim_staff-shaped table on a local Postgres with --rows rows.
+For each change rate it then times a full reload (TRUNCATE and COPY every
+row, a baseline the loader itself never runs) against a merge of only the changed rows through a staging table and
+INSERT ... ON CONFLICT. Each is committed, so the timings include the commit.
+Needs a real Postgres, as the merge work happens in the server.
+
+Run from the project root:
+    PYTHONPATH=. python benchmarks/bench_dimension_merge.py --pg-host localhost
+"""
+
+import argparse
+import random
+import time
+
+import pg8000
+import pyarrow as pa
+
+from src.loading_lambda import (
+    get_copy_query,
+    iter_csv_batches,
+    merge_into_data_warehouse,
+)
+
+CHANGE_RATES = [0.01, 0.1, 1.0]
+
+CREATE_TEMP_TABLE = """CREATE TEMPORARY TABLE dim_staff (
+    staff_id INT PRIMARY KEY,
+    first_name VARCHAR NOT NULL,
+    last_name VARCHAR NOT NULL,
+    department_name VARCHAR NOT NULL,
+    location VARCHAR NOT NULL,
+    email_address VARCHAR NOT NULL
+)"""
+
+
+def make_dim_staff(staff_ids, version):
+    """Builds dim_staff rows for the given ids, their names vary with version."""
+    return pa.table(
+        {
+            "staff_id": pa.array(staff_ids, pa.int32()),
+            "first_name": [f"First{staff_id}v{version}" for staff_id in staff_ids],
+            "last_name": [f"Last{staff_id}" for staff_id in staff_ids],
+            "department_name": ["Sales"] * len(staff_ids),
+            "location": ["Manchester"] * len(staff_ids),
+            "email_address": [f"staff{staff_id}@example.com" for staff_id in staff_ids],
+        }
+    )
+
+
+def full_reload(conn, table_data):
+    cursor = conn.cursor()
+    cursor.execute("TRUNCATE dim_staff")
+    cursor.execute(
+        get_copy_query(table_data, "dim_staff"), stream=iter_csv_batches(table_data)
+    )
+    conn.commit()
+
+
+def merge(conn, table_data):
+    merge_into_data_warehouse(table_data, "dim_staff", "staff_id", conn)
+    conn.commit()
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--pg-host", required=True)
+    parser.add_argument("--pg-port", type=int, default=5432)
+    parser.add_argument("--pg-database", default="postgres")
+    parser.add_argument("--pg-user", default="postgres")
+    parser.add_argument("--pg-password", default="postgres")
+    args = parser.parse_args()
+
+    conn = pg8000.connect(
+        host=args.pg_host,
+        port=args.pg_port,
+        database=args.pg_database,
+        user=args.pg_user,
+        password=args.pg_password,
+    )
+    conn.cursor().execute(CREATE_TEMP_TABLE)
+    conn.commit()
+    staff_ids = list(range(1, args.rows + 1))
+    full_reload(conn, make_dim_staff(staff_ids, 0))
+
+    rng = random.Random(0)
+    print(f"dim_staff rows: {args.rows:,}")
+    print(f"{'changed':>8}{'full reload s':>15}{'merge s':>10}{'speed up':>10}")
+    for version, change_rate in enumerate(CHANGE_RATES, start=1):
+        changed_ids = sorted(rng.sample(staff_ids, int(args.rows * change_rate)))
+        changed = set(changed_ids)
+        reload_seconds = timed(
+            full_reload,
+            conn,
+            pa.concat_tables(
+                [
+                    make_dim_staff(
+                        [staff_id for staff_id in staff_ids if staff_id not in changed],
+                        version - 1,
+                    ),
+                    make_dim_staff(changed_ids, version),
+                ]
+            ),
+        )
+        merge_seconds = timed(merge, conn, make_dim_staff(changed_ids, version + 1))
+        print(
+            f"{change_rate:>8.0%}{reload_seconds:>15.3f}{merge_seconds:>10.3f}"
+            f"{reload_seconds / merge_seconds:>9.1f}x"
+        )
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Micro-benchmark of the ingestion serialisation of a synthetic sales_order table.
+
+Compares the previous DataFrame -> to_json -> json.loads -> json.dumps path
+with serialise_rows() on rows shaped like the ones pg8000 returns.
+
+Run from the project root:
+    PYTHONPATH=. python benchmarks/bench_ingestion_serialisation.py --rows 1000000
+"""
+
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pandas as pd
+
+from src.ingestion_lambda import serialise_rows
+
+COL_NAMES = [
+    "sales_order_id",
+    "created_at",
+    "last_updated",
+    "design_id",
+    "staff_id",
+    "counterparty_id",
+    "units_sold",
+    "unit_price",
+    "currency_id",
+    "agreed_delivery_date",
+    "agreed_payment_date",
+    "agreed_delivery_location_id",
+]
+
+
+def make_sales_order_rows(number_of_rows, seed=0):
+    """Builds synthetic sales_order rows with the python types pg8000 returns."""
+    rng = random.Random(seed)
+    start = datetime(2022, 11, 3, 14, 20, 49, 962000)
+    rows = []
+    for i in range(1, number_of_rows + 1):
+        created_at = start + timedelta(milliseconds=rng.randrange(10**10))
+        rows.append(
+            [
+                i,
+                created_at,
+                created_at + timedelta(minutes=rng.randrange(1000)),
+                rng.randrange(1, 500),
+                rng.randrange(1, 20),
+                rng.randrange(1, 20),
+                rng.randrange(1, 100000),
+                Decimal(rng.randrange(200, 400)) / 100,
+                rng.randrange(1, 4),
+                "2022-11-10",
+                "2022-11-08",
+                rng.randrange(1, 30),
+            ]
+        )
+    return rows
+
+
+def dataframe_serialise_rows(rows, col_names):
+    """The serialisation used before serialise_rows()."""
+    df = pd.DataFrame(rows, columns=col_names)
+    json_data = df.to_json(orient="records")
+    return json.dumps(json.loads(json_data))
+
+
+def measure(serialiser, rows, trace_memory):
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    output = serialiser(rows, COL_NAMES)
+    elapsed = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return output, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="also report peak python allocations (much slower)",
+    )
+    args = parser.parse_args()
+
+    rows = make_sales_order_rows(args.rows)
+    print(f"sales_order rows: {args.rows:,}")
+    results = {}
+    for name, serialiser in [
+        ("dataframe round trip", dataframe_serialise_rows),
+        ("serialise_rows", serialise_rows),
+    ]:
+        output, elapsed, peak = measure(serialiser, rows, args.memory)
+        results[name] = output
+        line = (
+            f"{name:>22}: {elapsed:7.2f}s  {args.rows / elapsed:12,.0f} rows/s  "
+            f"{len(output) / 2**20:8.1f} MiB written"
+        )
+        if peak is not None:
+            line += f"  {peak / 2**20:8.1f} MiB peak"
+        print(line)
+
+    sample = slice(0, 1000)
+    assert (
+        json.loads(results["dataframe round trip"])[sample]
+        == json.loads(results["serialise_rows"])[sample]
+    ), "serialisers disagree"
+
+
+if __name__ == "__main__":
+    main()
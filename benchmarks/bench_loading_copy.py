@@ -0,0 +1,138 @@
+"""Throughput benchmark of the COPY path used by load_to_data_warehouse.
+
+Streams a synthetic fact_sales_order pyarrow table through the same COPY
+statement and CSV batches load_to_data_warehouse uses, and reports rows/s.
+Without --pg-host the cursor is a local Postgres stand-in that only consumes
+the stream, which measures the encoding side. With --pg-host the table is
+copied into a temporary table on a real local Postgres.
+
+Run from the project root:
+    PYTHONPATH=. python benchmarks/bench_loading_copy.py --rows 1000000
+    PYTHONPATH=. python benchmarks/bench_loading_copy.py --pg-host localhost
+"""
+
+import argparse
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pyarrow as pa
+
+from src.loading_lambda import COPY_BATCH_SIZE, get_copy_query, iter_csv_batches
+
+CREATE_TEMP_TABLE = """CREATE TEMPORARY TABLE fact_sales_order (
+    sales_record_id SERIAL PRIMARY KEY,
+    sales_order_id INT NOT NULL,
+    created_date DATE NOT NULL,
+    created_time TIME NOT NULL,
+    last_updated_date DATE NOT NULL,
+    last_updated_time TIME NOT NULL,
+    sales_staff_id INT NOT NULL,
+    counterparty_id INT NOT NULL,
+    units_sold INT NOT NULL,
+    unit_price NUMERIC(10, 2) NOT NULL,
+    currency_id INT NOT NULL,
+    design_id INT NOT NULL,
+    agreed_payment_date DATE NOT NULL,
+    agreed_delivery_date DATE NOT NULL,
+    agreed_delivery_location_id INT NOT NULL
+)"""
+
+
+def make_fact_sales_order(number_of_rows, seed=0):
+    """Builds a pyarrow table shaped like the processed fact_sales_order."""
+    rng = random.Random(seed)
+    start = datetime(2022, 11, 3, 14, 20, 49, 962000)
+    created = [
+        start + timedelta(milliseconds=rng.randrange(10**10))
+        for _ in range(number_of_rows)
+    ]
+    return pa.table(
+        {
+            "sales_order_id": pa.array(range(1, number_of_rows + 1), pa.int64()),
+            "created_date": [value.date() for value in created],
+            "created_time": [value.time() for value in created],
+            "last_updated_date": [value.date() for value in created],
+            "last_updated_time": [value.time() for value in created],
+            "sales_staff_id": [rng.randrange(1, 20) for _ in created],
+            "counterparty_id": [rng.randrange(1, 20) for _ in created],
+            "units_sold": [rng.randrange(1, 100000) for _ in created],
+            "unit_price": pa.array(
+                [Decimal(rng.randrange(200, 400)) / 100 for _ in created],
+                pa.decimal128(10, 2),
+            ),
+            "currency_id": [rng.randrange(1, 4) for _ in created],
+            "design_id": [rng.randrange(1, 500) for _ in created],
+            "agreed_payment_date": [date(2022, 11, 8)] * number_of_rows,
+            "agreed_delivery_date": [date(2022, 11, 10)] * number_of_rows,
+            "agreed_delivery_location_id": [rng.randrange(1, 30) for _ in created],
+        }
+    )
+
+
+class StandInCursor:
+    """Consumes the COPY stream the way pg8000 does, without a server."""
+
+    def __init__(self):
+        self.bytes_streamed = 0
+
+    def execute(self, query, stream=None):
+        for chunk in stream:
+            self.bytes_streamed += len(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=COPY_BATCH_SIZE)
+    parser.add_argument("--target-rows-per-second", type=float, default=None)
+    parser.add_argument("--pg-host", default=None)
+    parser.add_argument("--pg-port", type=int, default=5432)
+    parser.add_argument("--pg-database", default="postgres")
+    parser.add_argument("--pg-user", default="postgres")
+    parser.add_argument("--pg-password", default="postgres")
+    args = parser.parse_args()
+
+    table_data = make_fact_sales_order(args.rows)
+    query = get_copy_query(table_data, "fact_sales_order")
+
+    conn = None
+    if args.pg_host:
+        import pg8000
+
+        conn = pg8000.connect(
+            host=args.pg_host,
+            port=args.pg_port,
+            database=args.pg_database,
+            user=args.pg_user,
+            password=args.pg_password,
+        )
+        cursor = conn.cursor()
+        cursor.execute(CREATE_TEMP_TABLE)
+    else:
+        cursor = StandInCursor()
+
+    started = time.perf_counter()
+    cursor.execute(query, stream=iter_csv_batches(table_data, args.batch_size))
+    if conn is not None:
+        conn.commit()
+    elapsed = time.perf_counter() - started
+
+    target = "postgres at " + args.pg_host if args.pg_host else "stand-in cursor"
+    rows_per_second = args.rows / elapsed
+    print(f"fact_sales_order rows: {args.rows:,} into {target}")
+    print(f"COPY csv: {elapsed:7.2f}s  {rows_per_second:12,.0f} rows/s")
+
+    if conn is not None:
+        cursor.execute("SELECT COUNT(*) FROM fact_sales_order")
+        assert cursor.fetchone()[0] == args.rows, "row count mismatch"
+        conn.close()
+    if args.target_rows_per_second and rows_per_second < args.target_rows_per_second:
+        print(f"below target of {args.target_rows_per_second:,.0f} rows/s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
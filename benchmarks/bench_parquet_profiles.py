@@ -0,0 +1,193 @@
+"""Benchmark of the parquet writer profiles of the processed tables.
+
+Builds synthetic fact_sales_order, dim_date, dim_location and dim_counterparty
+DataFrames shaped like the processing transforms output them. Each is written
+with the previous df.to_parquet() defaults, with its PARQUET_WRITER_PROFILES
+profile, and with that profile using snappy and zstd level 9 instead. For
+each it reports the bytes written, the write time and the read throughput of
+pq.read_table on the file (best of --repeats).
+
+Run from the project root:
+    PYTHONPATH=. python benchmarks/bench_parquet_profiles.py --rows 1000000
+"""
+
+import argparse
+import io
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.processing_lambda import get_writer_profile, write_parquet
+
+CITIES = [f"City {i}" for i in range(40)]
+COUNTRIES = [f"Country {i}" for i in range(25)]
+DISTRICTS = [f"District {i}" for i in range(15)] + [None]
+
+
+def make_fact_sales_order(number_of_rows, rng):
+    start = date(2022, 11, 3)
+    dates = np.array([start + timedelta(days=int(i)) for i in range(730)])
+    created = np.sort(rng.integers(0, 700, number_of_rows))
+    agreed = [d.isoformat() for d in dates]
+    return pd.DataFrame(
+        {
+            "sales_order_id": np.arange(1, number_of_rows + 1),
+            "design_id": rng.integers(1, 500, number_of_rows),
+            "counterparty_id": rng.integers(1, 20, number_of_rows),
+            "units_sold": rng.integers(1000, 100_000, number_of_rows),
+            "unit_price": rng.integers(200, 400, number_of_rows) / 100,
+            "currency_id": rng.integers(1, 4, number_of_rows),
+            "agreed_delivery_date": np.take(agreed, created + 7),
+            "agreed_payment_date": np.take(agreed, created + 5),
+            "agreed_delivery_location_id": rng.integers(1, 30, number_of_rows),
+            "sales_staff_id": rng.integers(1, 20, number_of_rows),
+            "created_date": dates[created],
+            "created_time": pd.to_datetime(
+                rng.integers(0, 86_400_000, number_of_rows), unit="ms"
+            ).time,
+            "last_updated_date": dates[created + rng.integers(0, 3, number_of_rows)],
+            "last_updated_time": pd.to_datetime(
+                rng.integers(0, 86_400_000, number_of_rows), unit="ms"
+            ).time,
+        }
+    )
+
+
+def make_dim_date(number_of_rows, rng):
+    dates = pd.date_range("2000-01-01", periods=number_of_rows, freq="D")
+    return pd.DataFrame(
+        {
+            "date_id": dates.date,
+            "year": dates.year,
+            "month": dates.month,
+            "day": dates.day,
+            "day_of_week": dates.dayofweek + 1,
+            "day_name": dates.day_name(),
+            "month_name": dates.month_name(),
+            "quarter": dates.quarter,
+        }
+    ).sample(frac=1, random_state=0)
+
+
+def make_dim_location(number_of_rows, rng):
+    return pd.DataFrame(
+        {
+            "location_id": rng.permutation(number_of_rows) + 1,
+            "address_line_1": [f"{i} Example Road" for i in range(number_of_rows)],
+            "address_line_2": None,
+            "district": rng.choice(DISTRICTS, number_of_rows),
+            "city": rng.choice(CITIES, number_of_rows),
+            "postal_code": [f"AB{i % 100} {i % 9}CD" for i in range(number_of_rows)],
+            "country": rng.choice(COUNTRIES, number_of_rows),
+            "phone": [f"0{i:010d}" for i in range(number_of_rows)],
+        }
+    )
+
+
+def make_dim_counterparty(number_of_rows, rng):
+    location = make_dim_location(number_of_rows, rng)
+    return pd.DataFrame(
+        {
+            "counterparty_id": rng.permutation(number_of_rows) + 1,
+            "counterparty_legal_name": [
+                f"Counterparty {i}" for i in range(number_of_rows)
+            ],
+            **{
+                f"counterparty_legal_{column}": location[column].values
+                for column in [
+                    "address_line_1",
+                    "address_line_2",
+                    "district",
+                    "city",
+                    "postal_code",
+                    "country",
+                ]
+            },
+            "counterparty_legal_phone_number": location["phone"].values,
+        }
+    )
+
+
+def pandas_defaults(df, key):
+    """The writer used before the profiles."""
+    out_buffer = io.BytesIO()
+    df.to_parquet(out_buffer, index=False)
+    return out_buffer.getvalue()
+
+
+def with_profile(**overrides):
+    def write(df, key):
+        profile = {**get_writer_profile(key), **overrides}
+        out_buffer = io.BytesIO()
+        write_parquet(
+            pa.Table.from_pandas(df, preserve_index=False), out_buffer, profile
+        )
+        return out_buffer.getvalue()
+
+    return write
+
+
+WRITERS = [
+    ("pandas defaults", pandas_defaults),
+    ("profile", with_profile()),
+    ("profile, snappy", with_profile(compression="snappy", compression_level=None)),
+    ("profile, zstd 9", with_profile(compression_level=9)),
+]
+
+
+def measure(writer, df, key, repeats):
+    started = time.perf_counter()
+    body = writer(df, key)
+    write_seconds = time.perf_counter() - started
+    read_seconds = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        table = pq.read_table(io.BytesIO(body))
+        read_seconds = min(read_seconds, time.perf_counter() - started)
+    assert table.num_rows == len(df)
+    return len(body), write_seconds, read_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dim-rows", type=int, default=20_000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    tables = [
+        (
+            "fact/sales_order-2024-05-24 14:35:22.parquet",
+            make_fact_sales_order,
+            args.rows,
+        ),
+        ("dimension/date-2024-05-24 14:35:22.parquet", make_dim_date, args.dim_rows),
+        (
+            "dimension/location-2024-05-24 14:35:22.parquet",
+            make_dim_location,
+            args.dim_rows,
+        ),
+        (
+            "dimension/counterparty-2024-05-24 14:35:22.parquet",
+            make_dim_counterparty,
+            args.dim_rows,
+        ),
+    ]
+    for key, make_table, number_of_rows in tables:
+        df = make_table(number_of_rows, rng)
+        print(f"{key.split('-')[0]} ({number_of_rows:,} rows)")
+        for name, writer in WRITERS:
+            size, write_seconds, read_seconds = measure(writer, df, key, args.repeats)
+            print(
+                f"{name:>18}: {size / 2**20:8.2f} MiB  write {write_seconds:6.3f}s  "
+                f"read {number_of_rows / read_seconds:13,.0f} rows/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
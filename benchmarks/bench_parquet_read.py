@@ -0,0 +1,156 @@
+"""Benchmark of reading a processed fact_sales_order parquet file from S3.
+
+Writes a synthetic fact_sales_order file with --rows rows, in row groups of
+--row-group-size rows and with --extra-columns columns the warehouse does not
+load, to a moto bucket. It is then read with the previous whole object GET and
+pq.read_table, and streamed with stream_parquet_from_s3(), which fetches the
+footer and then the projected column chunks with ranged GETs. For each it
+reports the time to the first record batch, the total time, the peak pyarrow
+memory and the bytes fetched from S3.
+
+Run from the project root:
+    PYTHONPATH=. python benchmarks/bench_parquet_read.py --rows 2000000
+"""
+
+import argparse
+import gc
+import io
+import os
+import time
+
+import boto3
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from moto import mock_aws
+
+BUCKET = "bench-processed"
+KEY = "fact/sales_order-2024-05-24 14:35:22.parquet"
+
+
+def make_fact_table(number_of_rows, extra_columns, seed=0):
+    """Builds a synthetic fact_sales_order table with extra unloaded columns."""
+    rng = np.random.default_rng(seed)
+    dates = pa.array(
+        np.datetime64("2022-11-03") + rng.integers(0, 700, number_of_rows),
+        type=pa.date32(),
+    )
+    columns = {
+        "sales_order_id": pa.array(np.arange(1, number_of_rows + 1)),
+        "created_date": dates,
+        "created_time": pa.array(
+            rng.integers(0, 86_400_000_000, number_of_rows), type=pa.time64("us")
+        ),
+        "last_updated_date": dates,
+        "last_updated_time": pa.array(
+            rng.integers(0, 86_400_000_000, number_of_rows), type=pa.time64("us")
+        ),
+        "sales_staff_id": pa.array(rng.integers(1, 20, number_of_rows)),
+        "counterparty_id": pa.array(rng.integers(1, 20, number_of_rows)),
+        "units_sold": pa.array(rng.integers(1, 100_000, number_of_rows)),
+        "unit_price": pa.array(rng.integers(200, 400, number_of_rows) / 100),
+        "currency_id": pa.array(rng.integers(1, 4, number_of_rows)),
+        "design_id": pa.array(rng.integers(1, 500, number_of_rows)),
+        "agreed_payment_date": dates,
+        "agreed_delivery_date": dates,
+        "agreed_delivery_location_id": pa.array(rng.integers(1, 30, number_of_rows)),
+    }
+    for i in range(extra_columns):
+        columns[f"extra_{i}"] = pa.array(rng.random(number_of_rows))
+    return pa.table(columns)
+
+
+def whole_object_read(s3_client):
+    """The read used before stream_parquet_from_s3()."""
+    response = s3_client.get_object(Bucket=BUCKET, Key=KEY)
+    table = pq.read_table(io.BytesIO(response["Body"].read()))
+    return table.to_batches()
+
+
+def count_fetched_bytes(counter):
+    def count(**kwargs):
+        counter["bytes"] += int(kwargs["parsed"].get("ContentLength", 0))
+
+    return count
+
+
+def measure(read_batches):
+    gc.collect()
+    pool = pa.default_memory_pool()
+    pool.release_unused()
+    baseline = pool.bytes_allocated()
+    peak = 0
+    rows = 0
+    started = time.perf_counter()
+    first_batch_seconds = None
+    for batch in read_batches():
+        if first_batch_seconds is None:
+            first_batch_seconds = time.perf_counter() - started
+        rows += batch.num_rows
+        peak = max(peak, pool.bytes_allocated() - baseline)
+        del batch
+    return rows, first_batch_seconds, time.perf_counter() - started, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--row-group-size", type=int, default=100_000)
+    parser.add_argument("--extra-columns", type=int, default=8)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-2")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+    with mock_aws():
+        from src import loading_lambda
+
+        s3_client = boto3.client("s3", region_name="eu-west-2")
+        s3_client.create_bucket(
+            Bucket=BUCKET,
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        sink = io.BytesIO()
+        pq.write_table(
+            make_fact_table(args.rows, args.extra_columns),
+            sink,
+            row_group_size=args.row_group_size,
+        )
+        s3_client.put_object(Bucket=BUCKET, Key=KEY, Body=sink.getvalue())
+        print(
+            f"fact_sales_order rows: {args.rows:,}  "
+            f"object: {sink.tell() / 2**20:.1f} MiB"
+        )
+        del sink
+
+        counter = {"bytes": 0}
+        loading_lambda.s3_client = s3_client
+        s3_client.meta.events.register(
+            "after-call.s3.GetObject", count_fetched_bytes(counter)
+        )
+
+        def streamed_read():
+            batches, _ = loading_lambda.stream_parquet_from_s3(
+                KEY, bucket=BUCKET, table_name="fact_sales_order"
+            )
+            return batches
+
+        results = {}
+        for name, read_batches in [
+            ("whole object read", lambda: whole_object_read(s3_client)),
+            ("stream_parquet_from_s3", streamed_read),
+        ]:
+            counter["bytes"] = 0
+            rows, first_batch, total, peak = measure(read_batches)
+            results[name] = rows
+            print(
+                f"{name:>24}: first batch {first_batch:7.3f}s  total {total:7.3f}s  "
+                f"peak {peak / 2**20:8.1f} MiB  "
+                f"fetched {counter['bytes'] / 2**20:8.1f} MiB"
+            )
+
+    assert len(set(results.values())) == 1, "readers disagree on row count"
+
+
+if __name__ == "__main__":
+    main()
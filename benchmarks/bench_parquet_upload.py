@@ -0,0 +1,110 @@
+"""Benchmark of the memory used to upload a processed fact_sales_order file.
+
+Writes a synthetic fact_sales_order DataFrame with --rows rows to a stand-in
+s3 client that only counts the bytes it is sent, once with the previous
+BytesIO + put_object(getvalue()) upload and once with
+convert_to_parquet_put_in_s3(), which streams the file through an
+S3MultipartWriter. For each it reports the bytes uploaded, the requests made
+and the peak python allocations during the upload, which is where the
+buffered file lives (the DataFrame and its arrow table are built first).
+
+Run from the project root:
+    PYTHONPATH=. python benchmarks/bench_parquet_upload.py --rows 2000000
+"""
+
+import argparse
+import io
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from src.processing_lambda import convert_to_parquet_put_in_s3
+
+KEY = "fact/sales_order-2024-05-24 14:35:22.parquet"
+
+
+class CountingS3Client:
+    """Accepts the s3 calls of both uploads and keeps only the sizes sent."""
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes_sent = 0
+
+    def put_object(self, Bucket, Key, Body):
+        self.requests += 1
+        self.bytes_sent += len(Body)
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.requests += 1
+        return {"UploadId": "upload"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.requests += 1
+        self.bytes_sent += len(Body)
+        return {"ETag": f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.requests += 1
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.requests += 1
+
+
+def make_fact_sales_order(number_of_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "sales_order_id": np.arange(1, number_of_rows + 1),
+            "design_id": rng.integers(1, 500, number_of_rows),
+            "counterparty_id": rng.integers(1, 20, number_of_rows),
+            "units_sold": rng.integers(1000, 100_000, number_of_rows),
+            "unit_price": rng.integers(200, 400, number_of_rows) / 100,
+            "currency_id": rng.integers(1, 4, number_of_rows),
+            "agreed_delivery_location_id": rng.integers(1, 30, number_of_rows),
+            "sales_staff_id": rng.integers(1, 20, number_of_rows),
+            "created_ms": rng.integers(0, 86_400_000, number_of_rows),
+            "last_updated_ms": rng.integers(0, 86_400_000, number_of_rows),
+        }
+    )
+
+
+def bytesio_upload(s3, df, key):
+    """The upload used before S3MultipartWriter."""
+    out_buffer = io.BytesIO()
+    df.to_parquet(out_buffer, index=False)
+    s3.put_object(Bucket="bench", Key=key, Body=out_buffer.getvalue())
+
+
+def multipart_upload(s3, df, key):
+    convert_to_parquet_put_in_s3(s3, df, key, bucket="bench")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    df = make_fact_sales_order(args.rows)
+    print(f"fact_sales_order rows: {args.rows:,}")
+    for name, upload in [
+        ("BytesIO + put_object", bytesio_upload),
+        ("S3MultipartWriter", multipart_upload),
+    ]:
+        s3 = CountingS3Client()
+        tracemalloc.start()
+        started = time.perf_counter()
+        upload(s3, df, KEY)
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(
+            f"{name:>22}: {s3.bytes_sent / 2**20:8.1f} MiB sent in "
+            f"{s3.requests:3} requests  {elapsed:6.2f}s  "
+            f"peak {peak / 2**20:8.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
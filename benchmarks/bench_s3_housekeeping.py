@@ -0,0 +1,90 @@
+"""Benchmark of the processing housekeeping of updated/ after a large backfill.
+
+Moves --objects ingestion files from updated/ to processed_updated/ and
+deletes them from updated/ through a stand-in s3 client that sleeps for
+--latency-ms on every request, once with the previous one copy_object and
+one delete_object request per key in a serial loop and once with
+copy_object_keys() and delete_object_keys(). For each it reports the
+requests made and the time taken.
+
+Run from the project root:
+    PYTHONPATH=. python benchmarks/bench_s3_housekeeping.py --objects 5000
+"""
+
+import argparse
+import threading
+import time
+
+from src.processing_lambda import copy_object_keys, delete_object_keys
+
+
+class LatencyS3Client:
+    """Accepts the s3 calls of both housekeepings and only counts the requests."""
+
+    def __init__(self, latency_seconds):
+        self.latency_seconds = latency_seconds
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def request(self):
+        with self.lock:
+            self.requests += 1
+        time.sleep(self.latency_seconds)
+
+    def copy_object(self, Bucket, CopySource, Key):
+        self.request()
+
+    def delete_object(self, Bucket, Key):
+        self.request()
+
+    def delete_objects(self, Bucket, Delete):
+        self.request()
+        return {}
+
+
+def serial_housekeeping(s3, keys):
+    """The housekeeping used before copy_object_keys() and delete_object_keys()."""
+    for key in keys:
+        s3.copy_object(
+            Bucket="bench",
+            CopySource={"Bucket": "bench", "Key": key},
+            Key=f"processed_updated/{key[8:]}",
+        )
+    for key in keys:
+        s3.delete_object(Bucket="bench", Key=key)
+
+
+def bulk_housekeeping(s3, keys):
+    copy_object_keys(
+        s3, [(key, f"processed_updated/{key[8:]}") for key in keys], bucket="bench"
+    )
+    delete_object_keys(s3, keys, bucket="bench")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--objects", type=int, default=5000)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    keys = [
+        f"updated/sales_order-2024-05-21 14:40:09.{i:06}.json"
+        for i in range(args.objects)
+    ]
+    print(f"objects: {args.objects:,}  latency: {args.latency_ms:.0f} ms/request")
+    for name, housekeeping in [
+        ("serial copy + delete", serial_housekeeping),
+        ("bulk copy + delete", bulk_housekeeping),
+    ]:
+        s3 = LatencyS3Client(args.latency_ms / 1000)
+        started = time.perf_counter()
+        housekeeping(s3, keys)
+        elapsed = time.perf_counter() - started
+        print(
+            f"{name:>22}: {s3.requests:6} requests  {elapsed:8.2f}s  "
+            f"{args.objects / elapsed:8.0f} objects/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,63 @@
-import pandas as pd
 from botocore.exceptions import ClientError
-from datetime import datetime
+from datetime import datetime, date, time, timezone
+from decimal import Decimal
 import pg8000.exceptions
 import pg8000.native
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from itertools import islice
+from time import perf_counter
+import threading
 import logging
 import json
 import boto3
+import hashlib
+import os
 
-# timestamp for now
-current_time = datetime.now()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 # S3 ingestion bucket
 S3_BUCKET_NAME = "de-team-orchid-totesys-ingestion"
+# S3 key of the per-table high-water marks used for incremental extraction
+WATERMARK_STATE_KEY = "state/watermarks.json"
+# timestamps are written as milliseconds since this epoch, as processing expects
+EPOCH = datetime(1970, 1, 1)
+# rows turned into dictionaries and encoded together by serialise_rows
+SERIALISE_CHUNK_SIZE = 1000
+# rows read per query when streaming the baseline in chunks
+BASELINE_BATCH_SIZE = 10000
+# the whole baseline is read in one snapshot of the database, so the pages of a table
+# cannot skip or repeat rows changed while it is paged through, and its high-water
+# mark is that of the rows read
+BASELINE_TRANSACTION_QUERY = (
+    "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY;"
+)
 # S3 client
 s3 = boto3.client("s3")
-# secret manager client
-secret_manager_client = boto3.client("secretsmanager")
+# connection kept open between invocations of a warm lambda container
+_db_connection = None
+# how the warm connection was used, logged by the handler
+connection_stats = {"handshakes": 0, "handshakes_avoided": 0, "reconnects": 0}
+# tables extracted at once by extract_tables_concurrently, each worker holds one connection
+MAX_EXTRACTION_WORKERS = int(os.environ.get("MAX_EXTRACTION_WORKERS", "4"))
+# objects copied at once by copy_object_keys, the copies are made server side
+MAX_COPY_WORKERS = int(os.environ.get("MAX_COPY_WORKERS", "16"))
+# most keys s3 accepts in one delete_objects request
+DELETE_OBJECTS_BATCH_SIZE = 1000
+# idle worker connections kept between invocations of a warm lambda container
+_idle_worker_connections = []
+_worker_connections_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_secret_manager_client():
+    """Creates the secrets manager client on first use and reuses it
+    for the lifetime of the lambda container.
+
+    Returns:
+        (boto3.client): secrets manager client.
+    """
+    return boto3.client("secretsmanager")
 
 
 def retrieve_secret_credentials(secret_name="totesys_environment"):
@@ -31,7 +72,7 @@ def retrieve_secret_credentials(secret_name="totesys_environment"):
                       DB_HOST, DB_PASSWORD, DB_NAME, DB_PORT, DB_USER (Tuple): Credentials needed for AWS.
 
     """
-    response = secret_manager_client.get_secret_value(
+    response = get_secret_manager_client().get_secret_value(
         SecretId=secret_name,
     )
 
@@ -44,8 +85,24 @@ def retrieve_secret_credentials(secret_name="totesys_environment"):
     return DB_HOST, DB_PASSWORD, DB_NAME, DB_PORT, DB_USER
 
 
-def connect_to_db(credentials=retrieve_secret_credentials()):
-    """Retrieves credentials from retrieve_secret_credentials(),
+@lru_cache(maxsize=None)
+def get_db_credentials(secret_name="totesys_environment"):
+    """Retrieves the database credentials with retrieve_secret_credentials()
+    on first use and reuses them for the lifetime of the lambda container,
+    so warm invocations make no secrets manager calls.
+
+      Parameters:
+              secret_name (str):
+                  keyword argument with the database environment as a default value.
+
+      Returns:
+                      DB_HOST, DB_PASSWORD, DB_NAME, DB_PORT, DB_USER (Tuple): Credentials needed for AWS.
+    """
+    return retrieve_secret_credentials(secret_name=secret_name)
+
+
+def connect_to_db(credentials=None):
+    """Retrieves credentials from get_db_credentials() unless they are given,
     stores as new constants with the same variable names as within retrieve_secret_credentials(),
     connects to the database,
     logs the outcome of connection to the database when successfully or unsuccessfully connected.
@@ -57,6 +114,8 @@ def connect_to_db(credentials=retrieve_secret_credentials()):
                         DatabaseError: pg8000 specific error which is related to the database itself, such as incorrect SQL or constraint violations. Logs failure in logger.
                         InterfaceError: pg8000 specific error when connection failure with the database occurs. Logs failure in logger.
     """
+    if credentials is None:
+        credentials = get_db_credentials()
     DB_HOST = credentials[0]
     DB_PORT = credentials[3]
     DB_NAME = credentials[2]
@@ -84,10 +143,117 @@ def connect_to_db(credentials=retrieve_secret_credentials()):
         raise
 
 
-def get_table_names():
-    """Opens a connection to the database and runs an SQL query to get all relevant table names,
+def is_connection_healthy(conn):
+    """Cheaply checks a connection kept from a previous invocation:
+    rolls back any transaction left open, then runs SELECT 1 outside a transaction.
+
+    Parameters:
+        conn (Connection): connection to check.
+
+    Returns:
+        (bool): True if the connection can be reused.
+    """
+    try:
+        conn.rollback()
+        conn.execute_simple("SELECT 1")
+        return True
+    except (pg8000.exceptions.InterfaceError, pg8000.exceptions.DatabaseError) as e:
+        logger.info(f"Discarding unusable database connection: {e}")
+        return False
+
+
+def get_db_connection():
+    """Returns the connection kept by this lambda container,
+    validating it with is_connection_healthy() before reuse and
+    reconnecting with connect_to_db() if it is missing or broken.
+    Counts handshakes made and avoided in connection_stats.
+
+    Returns:
+        conn (Connection): Connection to the database.
+    """
+    global _db_connection
+    if _db_connection is not None:
+        if is_connection_healthy(_db_connection):
+            connection_stats["handshakes_avoided"] += 1
+            return _db_connection
+        connection_stats["reconnects"] += 1
+        close_db_connection()
+    _db_connection = connect_to_db()
+    connection_stats["handshakes"] += 1
+    return _db_connection
+
+
+def close_db_connection():
+    """Closes and forgets the connection kept by this lambda container,
+    ignoring errors from a connection that is already broken.
+    """
+    global _db_connection
+    if _db_connection is None:
+        return
+    try:
+        _db_connection.close()
+    except (pg8000.exceptions.InterfaceError, pg8000.exceptions.DatabaseError):
+        pass
+    _db_connection = None
+
+
+def acquire_worker_connection():
+    """Takes an idle worker connection kept by this lambda container,
+    validating it with is_connection_healthy() before reuse,
+    or opens a new one with connect_to_db(). Safe to call from worker threads.
+    Counts handshakes made and avoided in connection_stats.
+
+    Returns:
+        conn (Connection): Connection to the database, to be handed back with release_worker_connection().
+    """
+    with _worker_connections_lock:
+        conn = _idle_worker_connections.pop() if _idle_worker_connections else None
+    if conn is not None:
+        if is_connection_healthy(conn):
+            with _worker_connections_lock:
+                connection_stats["handshakes_avoided"] += 1
+            return conn
+        with _worker_connections_lock:
+            connection_stats["reconnects"] += 1
+        discard_worker_connection(conn)
+    conn = connect_to_db()
+    with _worker_connections_lock:
+        connection_stats["handshakes"] += 1
+    return conn
+
+
+def release_worker_connection(conn):
+    """Hands a worker connection back so the next table or invocation can reuse it."""
+    with _worker_connections_lock:
+        _idle_worker_connections.append(conn)
+
+
+def discard_worker_connection(conn):
+    """Closes a worker connection that must not be reused,
+    ignoring errors from a connection that is already broken.
+    """
+    try:
+        conn.close()
+    except (pg8000.exceptions.InterfaceError, pg8000.exceptions.DatabaseError):
+        pass
+
+
+def close_worker_connections():
+    """Closes and forgets every idle worker connection kept by this lambda container."""
+    with _worker_connections_lock:
+        connections = list(_idle_worker_connections)
+        _idle_worker_connections.clear()
+    for conn in connections:
+        discard_worker_connection(conn)
+
+
+def get_table_names(db=None):
+    """Opens a connection to the database unless one is given and runs an SQL query to get all relevant table names,
     list them and then sort them alphabetically.
-    Ensures that a connection to the database is closed.
+    Ensures that a connection it opened to the database is closed.
+
+    Parameters:
+                    db (Connection): keyword argument - connection to the database, opened here if None.
 
     Returns:
                     table_names (list): Sorted list of table names from database.
@@ -96,9 +262,10 @@ def get_table_names():
                     DatabaseError: pg8000 specific error which is related to the database itself, such as incorrect SQL or constraint violations. Logs failure in logger.
                     InterfaceError: pg8000 specific error when connection failure with the database occurs. Logs failure in logger.
     """
-    db = None
+    opened_db = None
     try:
-        db = connect_to_db()
+        if db is None:
+            db = opened_db = connect_to_db()
         table_names = db.run(
             """SELECT table_name
         FROM INFORMATION_SCHEMA.TABLES
@@ -116,15 +283,288 @@ def get_table_names():
     except pg8000.exceptions.InterfaceError as e:
         logger.error(f"Error connecting to the database: {e}")
     finally:
-        if db:
-            db.close()
+        if opened_db:
+            opened_db.close()
+
+
+def get_primary_key(table_name):
+    """Returns the primary key column of a totesys table,
+    every table is keyed on <table_name>_id.
+
+    Parameters:
+        table_name (str): name of the table.
+
+    Returns:
+        (str): name of the primary key column.
+    """
+    return f"{table_name}_id"
+
+
+def watermark_sort_key(col_names, table_name):
+    """Returns a key function ordering rows of a table by last_updated,
+    then by primary key, the same order the high-water mark is compared in.
+
+    Parameters:
+        col_names (list): column names in the order of cursor.description.
+        table_name (str): name of the table the rows belong to.
+
+    Returns:
+        (function): key function for max() and sorted().
+    """
+    last_updated_index = col_names.index("last_updated")
+    primary_key_index = col_names.index(get_primary_key(table_name))
+    return lambda row: (row[last_updated_index], row[primary_key_index])
+
+
+def get_watermark(row, col_names, table_name):
+    """Builds the high-water mark of a table from the last row extracted.
+
+    Parameters:
+        row (list): the row with the greatest last_updated and primary key.
+        col_names (list): column names in the order of cursor.description.
+        table_name (str): name of the table the row belongs to.
+
+    Returns:
+        (dict): last_updated as an ISO formatted string and the primary key as id.
+    """
+    last_updated = row[col_names.index("last_updated")]
+    return {
+        "last_updated": last_updated.isoformat(),
+        "id": row[col_names.index(get_primary_key(table_name))],
+    }
+
+
+def read_watermarks(bucket_name=S3_BUCKET_NAME):
+    """Reads the per-table high-water marks from the state object in s3.
+
+    Parameters:
+        bucket_name (str):
+            keyword argument - s3 bucket name.
+
+    Returns:
+        watermarks (dict): high-water mark per table name,
+        empty if no state has been written yet.
+
+    Errors:
+        ClientError:
+            any error other than a missing state object is raised.
+    """
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=WATERMARK_STATE_KEY)
+    except ClientError as ex:
+        if ex.response["Error"]["Code"] == "NoSuchKey":
+            logger.info("No watermark state found")
+            return {}
+        raise
+    return json.loads(response["Body"].read().decode("utf-8"))
+
+
+def write_watermarks(watermarks, bucket_name=S3_BUCKET_NAME):
+    """Writes the per-table high-water marks to the state object in s3.
+
+    Parameters:
+        watermarks (dict): high-water mark per table name.
+        bucket_name (str):
+            keyword argument - s3 bucket name.
+    """
+    s3.put_object(
+        Body=json.dumps(watermarks), Bucket=bucket_name, Key=WATERMARK_STATE_KEY
+    )
+    logger.info(f"Updated watermarks for {len(watermarks)} tables")
+
+
+def put_serialised_rows(data, key, bucket_name=S3_BUCKET_NAME):
+    """Uploads rows from serialise_rows() to s3 with the sha256 digest of the body
+    in the object metadata. processing compares it to find duplicate files
+    when the ETag of an object is not the MD5 of its body.
+
+    Parameters:
+        data (str): json from serialise_rows().
+        key (str): key of the object.
+        bucket_name (str):
+            keyword argument - s3 bucket name.
+    """
+    body = data.encode("utf-8")
+    s3.put_object(
+        Body=body,
+        Bucket=bucket_name,
+        Key=key,
+        Metadata={"sha256": hashlib.sha256(body).hexdigest()},
+    )
+
+
+def timestamp_to_epoch_millis(value):
+    """Converts a naive timestamp, taken as UTC, to milliseconds since the epoch.
+
+    Parameters:
+        value (datetime): timestamp without a timezone.
+
+    Returns:
+        (int): milliseconds since the epoch, sub-millisecond digits truncated.
+    """
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+
+def to_json_value(value):
+    """Converts the values pg8000 returns that json cannot encode:
+
+    timestamps and dates become milliseconds since the epoch (naive timestamps
+    are taken as UTC), numeric columns become floats and times become strings,
+    matching what the previous pandas to_json() output gave processing_lambda.
+
+    Parameters:
+        value: a single value from a row.
+
+    Returns:
+        the json encodable value.
+
+    Errors:
+        TypeError: the value has no json representation.
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return timestamp_to_epoch_millis(value)
+    if isinstance(value, date):
+        return (value - EPOCH.date()).days * 86400000
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, time):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def get_column_converter(sample):
+    """Picks the cheapest conversion for a column from one of its values.
+
+    Parameters:
+        sample: the first value in the column that is not None.
+
+    Returns:
+        (function): converter for every value of the column,
+        None when json can encode the column as it is.
+    """
+    if isinstance(sample, (str, int, float)):
+        return None
+    if isinstance(sample, datetime) and sample.tzinfo is None:
+        return timestamp_to_epoch_millis
+    if isinstance(sample, Decimal):
+        return float
+    return to_json_value
+
+
+def serialise_rows(rows, col_names):
+    """Converts rows returned by a cursor straight into the json string
+    uploaded to s3, without building a DataFrame.
+
+    Columns holding timestamps, dates or numerics are converted once,
+    column by column, before encoding, using get_column_converter().
+    Rows are encoded SERIALISE_CHUNK_SIZE at a time so only one chunk of
+    row dictionaries exists alongside the output.
+
+    Parameters:
+        rows (list): rows returned by cursor.fetchall().
+        col_names (list): column names in the order of cursor.description.
+
+    Returns:
+        (str): compact json array with one object per row.
+    """
+    columns = list(zip(*rows))
+    for index, column in enumerate(columns):
+        sample = next((value for value in column if value is not None), None)
+        converter = get_column_converter(sample)
+        if converter is not None:
+            columns[index] = [
+                None if value is None else converter(value) for value in column
+            ]
+    converted_rows = zip(*columns)
+    encoded_chunks = []
+    while True:
+        chunk = [
+            dict(zip(col_names, row))
+            for row in islice(converted_rows, SERIALISE_CHUNK_SIZE)
+        ]
+        if not chunk:
+            break
+        encoded_chunk = json.dumps(chunk, default=to_json_value, separators=(",", ":"))
+        encoded_chunks.append(encoded_chunk[1:-1])
+    return "[" + ",".join(encoded_chunks) + "]"
+
+
+def stream_table_to_s3(cursor, table_name, bucket_name, batch_size, run_time=None):
+    """Uploads a whole table to baseline/ in chunks of batch_size rows:
+
+    Pages through the table in primary key order (keyset pagination),
+    each page is uploaded as its own part named
+    baseline/<table_name>-<time>-part-<number>.json,
+    so only one page of rows is held in memory at a time.
+    An empty table is uploaded as a single empty part.
+    The pages are only consistent with each other when the cursor is in a
+    REPEATABLE READ transaction, as select_all_tables_for_baseline() opens.
+
+    Parameters:
+        cursor (Cursor): cursor on the database connection.
+        table_name (str): name of the table to upload.
+        bucket_name (str): s3 bucket name.
+        batch_size (int): number of rows per part.
+        run_time (datetime): time of the invocation written into the keys, now if None.
+
+    Returns:
+        (dict): high-water mark of the table, None if the table is empty.
+    """
+    if run_time is None:
+        run_time = datetime.now()
+    primary_key = get_primary_key(table_name)
+    last_id = None
+    part_number = 0
+    latest_row = None
+    while True:
+        if last_id is None:
+            cursor.execute(
+                f"SELECT * FROM {table_name} ORDER BY {primary_key} LIMIT %s;",
+                (batch_size,),
+            )
+        else:
+            cursor.execute(
+                f"""SELECT * FROM {table_name} WHERE {primary_key} > %s
+                    ORDER BY {primary_key} LIMIT %s;""",
+                (last_id, batch_size),
+            )
+        result = cursor.fetchall()
+        col_names = [elt[0] for elt in cursor.description]
+        if result or part_number == 0:
+            s3_bucket_key = (
+                f"baseline/{table_name}-{run_time}-part-{part_number:05d}.json"
+            )
+            put_serialised_rows(
+                serialise_rows(result, col_names),
+                s3_bucket_key,
+                bucket_name=bucket_name,
+            )
+            logger.info(f"Uploaded file to {s3_bucket_key}")
+            part_number += 1
+        if not result:
+            break
+        sort_key = watermark_sort_key(col_names, table_name)
+        batch_latest_row = max(result, key=sort_key)
+        if latest_row is None or sort_key(batch_latest_row) > sort_key(latest_row):
+            latest_row = batch_latest_row
+        if len(result) < batch_size:
+            break
+        last_id = result[-1][col_names.index(primary_key)]
+    if latest_row is None:
+        return None
+    return get_watermark(latest_row, col_names, table_name)
 
 
 def select_all_tables_for_baseline(
     bucket_name=S3_BUCKET_NAME,
-    name_of_tables=get_table_names(),
-    db=connect_to_db(),
+    name_of_tables=None,
+    db=None,
     query_limit="",
+    batch_size=None,
+    run_time=None,
     **kwargs,
 ):
     """Sets up the baseline database and uploads to s3 bucket:
@@ -132,97 +572,384 @@ def select_all_tables_for_baseline(
     Tries to set up a cursor,
     if successful it loops through each table to extract all rows,
     extracts all columnn names,
-    creates a dataframe,
-    converts that to json string format,
+    converts the rows to json string format,
     names the key based on the table name and the time of upload and
     puts the json string into the s3 object,
-    logs result to the logger.
+    logs result to the logger,
+    records the high-water mark of every table so that the next
+    incremental run starts where the baseline finished.
+    When batch_size is given each table is streamed in chunks by
+    stream_table_to_s3() instead, so memory stays flat however large the table.
+    Every table is read in one REPEATABLE READ, READ ONLY transaction,
+    so all the pages come from the same snapshot of the database.
 
     Parameters:
         bucket_name (str):
             keyword argument - s3 bucket name.
                 name_of_tables (list):
-            keyword argument - list of the names of tables.
+            keyword argument - list of the names of tables, from get_table_names() if None.
                 db (Connection):
-            keyword argument - connection to the database.
+            keyword argument - connection to the database, opened and closed here if None.
                 query_limit (str):
             keyword argument - query limit for the query.
+                batch_size (int):
+            keyword argument - rows per uploaded part, None uploads one object per table.
+                run_time (datetime):
+            keyword argument - time of the invocation written into the keys, now if None.
 
     Errors:
         ClientError:
             returns error if no s3 bucket exists in the given name.
             Logs to the logger.
     """
+    if run_time is None:
+        run_time = datetime.now()
+    opened_db = None
+    if db is None:
+        db = opened_db = connect_to_db()
     try:
+        if name_of_tables is None:
+            name_of_tables = get_table_names(db=db)
         cursor = db.cursor()
+        db.commit()
+        cursor.execute(BASELINE_TRANSACTION_QUERY)
         if not query_limit == "":
             query_limit = "LIMIT 2"
+        watermarks = {}
         for table_name in name_of_tables:
+            if batch_size:
+                watermark = stream_table_to_s3(
+                    cursor, table_name[0], bucket_name, batch_size, run_time=run_time
+                )
+                if watermark:
+                    watermarks[table_name[0]] = watermark
+                continue
             cursor.execute(f"SELECT * FROM {table_name[0]} {query_limit};")
             result = cursor.fetchall()
             col_names = [elt[0] for elt in cursor.description]
-            df = pd.DataFrame(result, columns=col_names)
-            json_data = df.to_json(orient="records")
-            data = json.dumps(json.loads(json_data))
-            s3_bucket_key = f"baseline/{table_name[0]}-{current_time}.json"
-            s3.put_object(Body=data, Bucket=bucket_name, Key=s3_bucket_key)
+            data = serialise_rows(result, col_names)
+            s3_bucket_key = f"baseline/{table_name[0]}-{run_time}.json"
+            put_serialised_rows(data, s3_bucket_key, bucket_name=bucket_name)
             logger.info(f"Uploaded file to {s3_bucket_key}")
+            if result:
+                watermarks[table_name[0]] = get_watermark(
+                    max(result, key=watermark_sort_key(col_names, table_name[0])),
+                    col_names,
+                    table_name[0],
+                )
+        db.commit()
+        write_watermarks(watermarks, bucket_name=bucket_name)
     except ClientError as ex:
         if ex.response["Error"]["Code"] == "NoSuchBucket":
             logger.info("No bucket found")
             raise
+    finally:
+        if opened_db:
+            opened_db.close()
+
+
+def extract_updated_table(
+    cursor,
+    table_name,
+    watermark,
+    bucket_name=S3_BUCKET_NAME,
+    override_time_condition=False,
+    run_time=None,
+):
+    """Runs a query that selects every row of one table after its high-water mark
+    (last_updated, then primary key as a tiebreak) in that order,
+    a table without a high-water mark falls back to the last 20 minutes,
+    and writes any new rows to updated/.
+
+    Parameters:
+        cursor (Cursor): cursor of the connection to the database.
+        table_name (str): name of the table.
+        watermark (dict): high-water mark of the table from read_watermarks(), or None.
+        bucket_name (str):
+            keyword argument - name of the s3 bucket.
+        override_time_condition (bool):
+            keyword argument - select every row, ignoring the high-water mark.
+        run_time (datetime):
+            keyword argument - time of the invocation written into the key, now if None,
+            so every invocation writes its rows to a key of its own.
+
+    Returns:
+        (dict): new high-water mark of the table, or None if no new rows were found.
+    """
+    if run_time is None:
+        run_time = datetime.now()
+    primary_key = get_primary_key(table_name)
+    if override_time_condition:
+        cursor.execute(f"SELECT * FROM {table_name}")
+    elif watermark:
+        cursor.execute(
+            f"""SELECT * FROM {table_name}
+                WHERE (last_updated, {primary_key})
+                > (CAST(%s AS timestamp), %s)
+                ORDER BY last_updated, {primary_key};""",
+            (watermark["last_updated"], watermark["id"]),
+        )
+    else:
+        cursor.execute(
+            f"""SELECT * FROM {table_name} WHERE last_updated
+                > NOW() - interval '20 minutes'
+                ORDER BY last_updated, {primary_key};"""
+        )
+    result = cursor.fetchall()
+    if len(result) == 0:
+        logger.info("No new data found")
+        return None
+    col_names = [elt[0] for elt in cursor.description]
+    data = serialise_rows(result, col_names)
+    file_path = f"updated/{table_name}-{run_time}.json"
+    put_serialised_rows(data, file_path, bucket_name=bucket_name)
+    logger.info("New data added to updated")
+    return get_watermark(
+        max(result, key=watermark_sort_key(col_names, table_name)),
+        col_names,
+        table_name,
+    )
 
 
 def select_and_write_updated_data(
-    db=connect_to_db(),
-    name_of_tables=get_table_names(),
+    db=None,
+    name_of_tables=None,
     bucket_name=S3_BUCKET_NAME,
     override_time_condition=False,
+    run_time=None,
     **kwargs,
 ):
     """Tries to set up a cursor,
+    reads the stored high-water marks from read_watermarks(),
     if successful loops through every table,
-    runs a query that selects all entries in the last 20 minutes from time of execution,
-    same method as select_all_tables_for_baseline(),
-    *[could we abstract this away into a function rather than repeating code?],
+    extracts every row after the table's high-water mark with extract_updated_table(),
+    and then moves the high-water mark on
+    to the last row written, so each run extracts exactly the rows changed
+    since the last successful upload.
 
     Parameters:
         db (Connection):
-            keyword argument - connection to database.
+            keyword argument - connection to database, opened and closed here if None.
         name_of_tables (list):
-            keyword argument - list of tables.
+            keyword argument - list of tables, from get_table_names() if None.
         bucket_name (str):
             keyword argument - name of the s3 bucket.
+        override_time_condition (bool):
+            keyword argument - select every row, ignoring the high-water marks.
+        run_time (datetime):
+            keyword argument - time of the invocation written into the keys, now if None.
 
     Errors:
         ClientError:
             returns error if bucket doesnt exist.
             Logs to the logger.
     """
+    opened_db = None
+    if db is None:
+        db = opened_db = connect_to_db()
     try:
+        if name_of_tables is None:
+            name_of_tables = get_table_names(db=db)
         cursor = db.cursor()
+        watermarks = read_watermarks(bucket_name=bucket_name)
+        if run_time is None:
+            run_time = datetime.now()
         for table_name in name_of_tables:
-            if override_time_condition:
-                query = f"SELECT * FROM {table_name[0]}"
-            else:
-                query = f"""SELECT * FROM {table_name[0]} WHERE last_updated
-                            > NOW() - interval '20 minutes';"""
-            cursor.execute(query)
-            result = cursor.fetchall()
-            if len(result) == 0:
-                logger.info("No new data found")
-            else:
-                col_names = [elt[0] for elt in cursor.description]
-                df = pd.DataFrame(result, columns=col_names)
-                json_data = df.to_json(orient="records")
-                data = json.dumps(json.loads(json_data))
-                file_path = f"updated/{table_name[0]}-{current_time}.json"
-                s3.put_object(Body=data, Bucket=bucket_name, Key=file_path)
-                logger.info("New data added to updated")
+            watermark = extract_updated_table(
+                cursor,
+                table_name[0],
+                watermarks.get(table_name[0]),
+                bucket_name=bucket_name,
+                override_time_condition=override_time_condition,
+                run_time=run_time,
+            )
+            if watermark:
+                watermarks[table_name[0]] = watermark
+                write_watermarks(watermarks, bucket_name=bucket_name)
     except ClientError as ex:
         if ex.response["Error"]["Code"] == "NoSuchBucket":
             logger.info("No bucket found")
             raise
+    finally:
+        if opened_db:
+            opened_db.close()
+
+
+def extract_tables_concurrently(
+    name_of_tables,
+    bucket_name=S3_BUCKET_NAME,
+    max_workers=MAX_EXTRACTION_WORKERS,
+    override_time_condition=False,
+    run_time=None,
+):
+    """Reads the stored high-water marks from read_watermarks(),
+    runs extract_updated_table() for every table on a pool of at most max_workers threads,
+    each with its own connection from acquire_worker_connection(),
+    so queries, serialisation and uploads of different tables overlap.
+    High-water marks are only moved on, and written, from this thread as each table finishes;
+    a table that fails keeps its old high-water mark and is extracted again next run.
+    Logs the wall time of every table, slowest first.
+
+    Parameters:
+        name_of_tables (list):
+            list of tables from get_table_names().
+        bucket_name (str):
+            keyword argument - name of the s3 bucket.
+        max_workers (int):
+            keyword argument - most tables extracted, and connections open, at once.
+        override_time_condition (bool):
+            keyword argument - select every row, ignoring the high-water marks.
+        run_time (datetime):
+            keyword argument - time of the invocation written into the keys, now if None.
+
+    Returns:
+        table_seconds (dict): wall time of the extraction of each table in seconds.
+
+    Errors:
+        Exception:
+            the first error of a failed table is raised once every other table has finished.
+            Logs to the logger.
+    """
+    watermarks = read_watermarks(bucket_name=bucket_name)
+    if run_time is None:
+        run_time = datetime.now()
+
+    def extract(table_name):
+        started = perf_counter()
+        conn = acquire_worker_connection()
+        try:
+            watermark = extract_updated_table(
+                conn.cursor(),
+                table_name,
+                watermarks.get(table_name),
+                bucket_name=bucket_name,
+                override_time_condition=override_time_condition,
+                run_time=run_time,
+            )
+            conn.rollback()
+        except Exception:
+            discard_worker_connection(conn)
+            raise
+        release_worker_connection(conn)
+        return watermark, perf_counter() - started
+
+    table_seconds = {}
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(extract, table_name[0]): table_name[0]
+            for table_name in name_of_tables
+        }
+        for future in as_completed(futures):
+            table_name = futures[future]
+            try:
+                watermark, table_seconds[table_name] = future.result()
+            except Exception as e:
+                logger.error(f"Error extracting {table_name}: {e}")
+                errors.append(e)
+                continue
+            if watermark:
+                watermarks[table_name] = watermark
+                write_watermarks(watermarks, bucket_name=bucket_name)
+
+    for table_name, seconds in sorted(
+        table_seconds.items(), key=lambda item: item[1], reverse=True
+    ):
+        logger.info(f"Extracted {table_name} in {seconds:.3f}s")
+    if errors:
+        raise errors[0]
+    return table_seconds
+
+
+def list_object_summaries(bucket_name=S3_BUCKET_NAME, prefix=""):
+    """Lists every object under the prefix, following the pages of the listing.
+
+    Parameters:
+        bucket_name (str):
+            keyword argument - s3 bucket name.
+        prefix (str):
+            keyword argument - prefix of the keys, default value is no prefix.
+
+    Returns:
+        summaries (list): Contents entries of the listing, with the Key and Size
+            of each object, in the order s3 lists them.
+    """
+    summaries = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        summaries.extend(page.get("Contents", []))
+    return summaries
+
+
+def log_throughput(action, count, seconds):
+    """Logs how many objects an s3 bulk operation handled and how fast."""
+    rate = count / seconds if seconds else 0
+    logger.info(f"{action} {count} objects in {seconds:.2f}s ({rate:.0f} objects/s)")
+
+
+def delete_object_keys(keys, bucket_name=S3_BUCKET_NAME):
+    """Deletes objects with one delete_objects request per DELETE_OBJECTS_BATCH_SIZE
+    keys instead of one request per key, logs any key s3 failed to delete.
+
+    Parameters:
+        keys (list): keys of the objects to delete.
+        bucket_name (str):
+            keyword argument - s3 bucket name.
+
+    Returns:
+        deleted (int): number of objects deleted.
+    """
+    keys = list(keys)
+    started = perf_counter()
+    deleted = 0
+    for start in range(0, len(keys), DELETE_OBJECTS_BATCH_SIZE):
+        batch = keys[start : start + DELETE_OBJECTS_BATCH_SIZE]
+        response = s3.delete_objects(
+            Bucket=bucket_name,
+            Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+        )
+        errors = response.get("Errors", [])
+        for error in errors:
+            logger.error(f"Error deleting {error['Key']}: {error['Message']}")
+        deleted += len(batch) - len(errors)
+    log_throughput("Deleted", deleted, perf_counter() - started)
+    return deleted
+
+
+def copy_object_keys(
+    key_pairs, bucket_name=S3_BUCKET_NAME, max_workers=MAX_COPY_WORKERS
+):
+    """Copies objects within a bucket server side, at most max_workers at a time.
+
+    Parameters:
+        key_pairs (list): (source key, destination key) of each object to copy.
+        bucket_name (str):
+            keyword argument - s3 bucket name.
+        max_workers (int):
+            keyword argument - most copies made at once.
+
+    Returns:
+        copied (int): number of objects copied.
+
+    Errors:
+        ClientError:
+            the first error of a failed copy, after the other copies finish.
+    """
+    key_pairs = list(key_pairs)
+    started = perf_counter()
+
+    def copy(key_pair):
+        source_key, new_key = key_pair
+        s3.copy_object(
+            Bucket=bucket_name,
+            CopySource={"Bucket": bucket_name, "Key": source_key},
+            Key=new_key,
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(copy, key_pairs))
+    log_throughput("Copied", len(key_pairs), perf_counter() - started)
+    return len(key_pairs)
 
 
 def delete_empty_s3_files(bucket_name=S3_BUCKET_NAME):
@@ -244,14 +971,14 @@ def delete_empty_s3_files(bucket_name=S3_BUCKET_NAME):
             Logs to the logger.
     """
     try:
-        response = s3.list_objects_v2(Bucket=bucket_name, Prefix="updated/")
-        if "Contents" in response:
-            for obj in response["Contents"]:
-                obj_size = obj["Size"]
-                file_path = obj["Key"]
-                if obj_size <= 2:
-                    s3.delete_object(Bucket=bucket_name, Key=file_path)
-                    logger.info(f"Delete empty s3 file: {file_path}")
+        empty_keys = [
+            obj["Key"]
+            for obj in list_object_summaries(bucket_name=bucket_name, prefix="updated/")
+            if obj["Size"] <= 2
+        ]
+        if empty_keys:
+            delete_object_keys(empty_keys, bucket_name=bucket_name)
+            logger.info(f"Deleted {len(empty_keys)} empty s3 files")
     except ClientError as ex:
         if ex.response["Error"]["Code"] == "NoSuchBucket":
             logger.info("No bucket found")
@@ -259,9 +986,14 @@ def delete_empty_s3_files(bucket_name=S3_BUCKET_NAME):
 
 
 def lambda_handler(event, context):
-    """Checks truthy or falsy value from check_baseline_exists(),
+    """Gets the connection kept by the warm lambda container from get_db_connection(),
+    checks truthy or falsy value from check_baseline_exists(),
     logs result,
-    invokes select_and_write_updated_data()
+    invokes select_all_tables_for_baseline() with that connection
+    or extract_tables_concurrently() with the worker connections,
+    both writing their keys with the time of this invocation,
+    ends the read transaction but leaves the connection open for the next invocation,
+    if the invocation fails the connection is closed instead.
 
     Parameters:
         event: the trigger for the invocation of the lambda - in event.tf
@@ -271,23 +1003,32 @@ def lambda_handler(event, context):
         Exception:
             Error message upon failed execution of lambda_handler.
     """
+    run_time = datetime.now()
     try:
-        conn = connect_to_db()
+        conn = get_db_connection()
+        name_of_tables = get_table_names(db=conn)
         if not check_baseline_exists():
-            select_all_tables_for_baseline()
+            select_all_tables_for_baseline(
+                name_of_tables=name_of_tables,
+                db=conn,
+                batch_size=BASELINE_BATCH_SIZE,
+                run_time=run_time,
+            )
             logger.info("Baseline does not exist. Running baseline data extraction.")
         else:
             logger.info("Baseline exists. Running updated data extraction.")
-            select_and_write_updated_data()
+            extract_tables_concurrently(name_of_tables, run_time=run_time)
             delete_empty_s3_files()
+        conn.rollback()
 
     except Exception as e:
         # logger.error(f"Error in Lambda execution: {e}")
         logger.error("Error in Lambda execution")
+        close_db_connection()
+        close_worker_connections()
         raise
     finally:
-        if conn:
-            conn.close()
+        logger.info(f"Database connection stats: {connection_stats}")
 
 
 def check_baseline_exists():
@@ -297,10 +1038,12 @@ def check_baseline_exists():
 
 
 def copy_baseline_to_updated(bucket_name=S3_BUCKET_NAME):
-    response = s3.list_objects_v2(Bucket=bucket_name, Prefix="baseline/")
-    items_to_copy_list = []
-    for item in response["Contents"]:
-        items_to_copy_list.append(item["Key"])
-    for item_key in items_to_copy_list:
-        new_key = f"updated/{item_key[9:]}"
-        s3.copy_object(Bucket=bucket_name, CopySource=f"/{bucket_name}/{item_key}", Key=new_key)
+    """copies every object in baseline/ to updated/ with copy_object_keys()"""
+    items_to_copy_list = [
+        item["Key"]
+        for item in list_object_summaries(bucket_name=bucket_name, prefix="baseline/")
+    ]
+    copy_object_keys(
+        [(item_key, f"updated/{item_key[9:]}") for item_key in items_to_copy_list],
+        bucket_name=bucket_name,
+    )
@@ -1,14 +1,20 @@
 import pandas as pd
 from botocore.exceptions import ClientError
-from datetime import datetime
+from datetime import date, datetime
 import pg8000.exceptions
 import pg8000.native
 import logging
 import json
 import boto3
 import pyarrow.parquet as pq
+import pyarrow.csv as pa_csv
 import io
-from time import sleep
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from time import perf_counter
+import threading
+import os
 import pyarrow as pa
 
 
@@ -20,12 +26,120 @@ logger.setLevel(logging.INFO)
 S3_PROCESSED_BUCKET_NAME = "de-team-orchid-totesys-processed"
 # S3 client
 s3_client = boto3.client("s3")
-# secret manager client
-secret_manager_client = boto3.client("secretsmanager")
+# rows of the pyarrow table encoded into each CSV chunk streamed to COPY
+COPY_BATCH_SIZE = 10000
+# prefix of the pointers processing writes to the latest object of each table
+LATEST_POINTER_PREFIX = "_latest/"
+# timestamp str(datetime) writes into object keys
+KEY_TIMESTAMP_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(?:\.\d{6})?")
+# bytes fetched from the end of a parquet object by the first ranged GET (its footer)
+PARQUET_TAIL_READ_SIZE = 64 * 1024
+# columns of each warehouse table, processed files are read with only these columns
+WAREHOUSE_COLUMNS = {
+    "fact_sales_order": [
+        "sales_order_id",
+        "created_date",
+        "created_time",
+        "last_updated_date",
+        "last_updated_time",
+        "sales_staff_id",
+        "counterparty_id",
+        "units_sold",
+        "unit_price",
+        "currency_id",
+        "design_id",
+        "agreed_payment_date",
+        "agreed_delivery_date",
+        "agreed_delivery_location_id",
+    ],
+    "dim_date": [
+        "date_id",
+        "year",
+        "month",
+        "day",
+        "day_of_week",
+        "day_name",
+        "month_name",
+        "quarter",
+    ],
+    "dim_staff": [
+        "staff_id",
+        "first_name",
+        "last_name",
+        "department_name",
+        "location",
+        "email_address",
+    ],
+    "dim_counterparty": [
+        "counterparty_id",
+        "counterparty_legal_name",
+        "counterparty_legal_address_line_1",
+        "counterparty_legal_address_line_2",
+        "counterparty_legal_district",
+        "counterparty_legal_city",
+        "counterparty_legal_postal_code",
+        "counterparty_legal_country",
+        "counterparty_legal_phone_number",
+    ],
+    "dim_currency": ["currency_id", "currency_code", "currency_name"],
+    "dim_design": ["design_id", "design_name", "file_location", "file_name"],
+    "dim_location": [
+        "location_id",
+        "address_line_1",
+        "address_line_2",
+        "district",
+        "city",
+        "postal_code",
+        "country",
+        "phone",
+    ],
+}
+# created_date partition of a processed fact object, written by processing
+FACT_PARTITION_PATTERN = re.compile(r"/year=(\d{4})/month=(\d{2})/day=(\d{2})/")
+# data warehouse table recording every processed object already loaded
+LOAD_MANIFEST_TABLE = "load_manifest"
+CREATE_LOAD_MANIFEST_QUERY = f"""CREATE TABLE IF NOT EXISTS {LOAD_MANIFEST_TABLE} (
+    object_key VARCHAR PRIMARY KEY,
+    table_name VARCHAR NOT NULL,
+    rows_loaded INT NOT NULL,
+    loaded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+)"""
+# natural key of each dimension table, changed rows are merged on it
+DIMENSION_KEYS = {
+    "dim_date": "date_id",
+    "dim_staff": "staff_id",
+    "dim_counterparty": "counterparty_id",
+    "dim_currency": "currency_id",
+    "dim_design": "design_id",
+    "dim_location": "location_id",
+}
+# connection kept open between invocations of a warm lambda container
+_dw_connection = None
+# how the warm connection was used, logged by the handler
+connection_stats = {"handshakes": 0, "handshakes_avoided": 0, "reconnects": 0}
+# connections the dimension tables are merged on at once, 1 loads the whole star
+# schema in one transaction, more commits each dimension on its own
+MAX_LOAD_CONNECTIONS = int(os.environ.get("MAX_LOAD_CONNECTIONS", "1"))
+# parquet files downloaded and parsed at once
+MAX_DOWNLOAD_WORKERS = 6
+# idle extra connections kept for concurrent dimension loads between invocations
+_idle_load_connections = []
+_load_connections_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_secret_manager_client():
+    """Creates the secrets manager client on first use and reuses it
+    for the lifetime of the lambda container.
+
+    Returns:
+        (boto3.client): secrets manager client.
+    """
+    return boto3.client("secretsmanager")
 
 
 def retrieve_secret_credentials(secret_name="totesys_environment"):
-    response = secret_manager_client.get_secret_value(
+    response = get_secret_manager_client().get_secret_value(
         SecretId=secret_name,
     )
 
@@ -39,7 +153,25 @@ def retrieve_secret_credentials(secret_name="totesys_environment"):
     return DW_HOST, DW_PASSWORD, DW_NAME, DW_PORT, DW_USER
 
 
-def connect_to_dw(credentials=retrieve_secret_credentials()):
+@lru_cache(maxsize=None)
+def get_dw_credentials(secret_name="totesys_environment"):
+    """Retrieves the data warehouse credentials with retrieve_secret_credentials()
+    on first use and reuses them for the lifetime of the lambda container,
+    so warm invocations make no secrets manager calls.
+
+      Parameters:
+              secret_name (str):
+                  keyword argument with the database environment as a default value.
+
+      Returns:
+                      DW_HOST, DW_PASSWORD, DW_NAME, DW_PORT, DW_USER (Tuple): Credentials needed for AWS.
+    """
+    return retrieve_secret_credentials(secret_name=secret_name)
+
+
+def connect_to_dw(credentials=None):
+    if credentials is None:
+        credentials = get_dw_credentials()
     DW_HOST = credentials[0]
     DW_PORT = credentials[3]
     DW_NAME = credentials[2]
@@ -68,20 +200,162 @@ def connect_to_dw(credentials=retrieve_secret_credentials()):
         raise
 
 
+def is_connection_healthy(conn):
+    """
+    checks a connection kept from a previous invocation can be reused:
+    rolls back any transaction left open, then runs SELECT 1 outside a transaction.
+    """
+    try:
+        conn.rollback()
+        conn.execute_simple("SELECT 1")
+        return True
+    except (pg8000.exceptions.InterfaceError, pg8000.exceptions.DatabaseError) as e:
+        logger.info(f"Discarding unusable data warehouse connection: {e}")
+        return False
+
+
+def get_dw_connection():
+    """
+    returns the connection kept by this lambda container, reconnecting with
+    connect_to_dw() when it is missing or fails is_connection_healthy().
+    handshakes made and avoided are counted in connection_stats.
+    """
+    global _dw_connection
+    if _dw_connection is not None:
+        if is_connection_healthy(_dw_connection):
+            connection_stats["handshakes_avoided"] += 1
+            return _dw_connection
+        connection_stats["reconnects"] += 1
+        close_dw_connection()
+    _dw_connection = connect_to_dw()
+    connection_stats["handshakes"] += 1
+    return _dw_connection
+
+
+def close_dw_connection():
+    """
+    closes and forgets the connection kept by this lambda container.
+    """
+    global _dw_connection
+    if _dw_connection is None:
+        return
+    try:
+        _dw_connection.close()
+    except (pg8000.exceptions.InterfaceError, pg8000.exceptions.DatabaseError):
+        pass
+    _dw_connection = None
+
+
+def acquire_load_connection():
+    """
+    takes an idle extra connection kept for concurrent loads, checked with
+    is_connection_healthy(), or opens one with connect_to_dw(). thread safe.
+    hand it back with release_load_connection().
+    """
+    with _load_connections_lock:
+        conn = _idle_load_connections.pop() if _idle_load_connections else None
+    if conn is not None:
+        if is_connection_healthy(conn):
+            with _load_connections_lock:
+                connection_stats["handshakes_avoided"] += 1
+            return conn
+        with _load_connections_lock:
+            connection_stats["reconnects"] += 1
+        discard_load_connection(conn)
+    conn = connect_to_dw()
+    with _load_connections_lock:
+        connection_stats["handshakes"] += 1
+    return conn
+
+
+def release_load_connection(conn):
+    """
+    hands an extra connection back for the next load or invocation.
+    """
+    with _load_connections_lock:
+        _idle_load_connections.append(conn)
+
+
+def discard_load_connection(conn):
+    """
+    closes an extra connection that must not be reused.
+    """
+    try:
+        conn.close()
+    except (pg8000.exceptions.InterfaceError, pg8000.exceptions.DatabaseError):
+        pass
+
+
+def close_load_connections():
+    """
+    closes and forgets every idle extra connection kept for concurrent loads.
+    """
+    with _load_connections_lock:
+        connections = list(_idle_load_connections)
+        _idle_load_connections.clear()
+    for conn in connections:
+        discard_load_connection(conn)
+
+
+def key_timestamp(key):
+    """
+    the timestamp written into an object key, datetime.min if it has none.
+    """
+    match = KEY_TIMESTAMP_PATTERN.search(key)
+    if not match:
+        return datetime.min
+    return datetime.fromisoformat(match.group())
+
+
+def read_latest_pointer(s3_client, prefix, bucket=S3_PROCESSED_BUCKET_NAME):
+    """
+    the key the latest pointer written by processing for a prefix such as
+    dimension/staff points at, None if there is no pointer.
+    """
+    directory, _, table_name = prefix.rpartition("/")
+    if not directory or not table_name:
+        return None
+    try:
+        response = s3_client.get_object(
+            Bucket=bucket, Key=f"{LATEST_POINTER_PREFIX}{directory}/{table_name}.json"
+        )
+    except ClientError as ce:
+        if ce.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(response["Body"].read())["key"]
+
+
 def get_latest_parquet_file_key(prefix, bucket=S3_PROCESSED_BUCKET_NAME):
+    """
+    the latest parquet key for the prefix, from its latest pointer with one GET,
+    otherwise from every page of the listing by the timestamp in the keys.
+    """
     try:
         s3_client = boto3.client("s3")
-        response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-        if "Contents" not in response:
+        latest_key = read_latest_pointer(s3_client, prefix, bucket=bucket)
+        if latest_key:
+            return latest_key
+        process_content_keys_list = []
+        list_kwargs = {"Bucket": bucket, "Prefix": prefix}
+        while True:
+            response = s3_client.list_objects_v2(**list_kwargs)
+            for content in response.get("Contents", []):
+                if content["Key"].endswith(".parquet"):
+                    process_content_keys_list.append(content["Key"])
+            if not response.get("IsTruncated"):
+                break
+            list_kwargs = {
+                "Bucket": bucket,
+                "Prefix": prefix,
+                "ContinuationToken": response["NextContinuationToken"],
+            }
+        if not process_content_keys_list:
             raise FileNotFoundError(
                 f"No files have been found from {bucket} for prefix: {prefix}"
             )
-        else:
-            process_content_keys_list = []
-            for content in response["Contents"]:
-                if content["Key"].endswith(".parquet"):
-                    process_content_keys_list.append(content["Key"])
-        return process_content_keys_list[-1]
+        # sorted is stable, so keys without a timestamp keep their listing order
+        return sorted(process_content_keys_list, key=key_timestamp)[-1]
     except FileNotFoundError as fnfe:
         logger.error(
             f"No files have been found from {bucket} for prefix: {prefix}: {fnfe}"
@@ -94,17 +368,86 @@ def get_latest_parquet_file_key(prefix, bucket=S3_PROCESSED_BUCKET_NAME):
         raise
 
 
-def read_parquet_from_s3(key, bucket=S3_PROCESSED_BUCKET_NAME):
+class S3ObjectReader(io.RawIOBase):
+    """
+    read only, seekable file over an s3 object that fetches only the byte ranges
+    read from it with ranged GETs. the first GET fetches the tail of the object,
+    where parquet keeps its footer, and gives the size of the object.
+    """
+
+    def __init__(
+        self, key, bucket=S3_PROCESSED_BUCKET_NAME, tail_size=PARQUET_TAIL_READ_SIZE
+    ):
+        super().__init__()
+        self.key = key
+        self.bucket = bucket
+        response = s3_client.get_object(
+            Bucket=bucket, Key=key, Range=f"bytes=-{tail_size}"
+        )
+        self.tail = response["Body"].read()
+        self.size = int(response["ContentRange"].split("/")[-1])
+        self.tail_start = self.size - len(self.tail)
+        self.position = 0
+        self.ranged_gets = 1
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else self.position + size
+        end = min(end, self.size)
+        if end <= self.position:
+            return b""
+        if self.position >= self.tail_start:
+            data = self.tail[self.position - self.tail_start : end - self.tail_start]
+        else:
+            response = s3_client.get_object(
+                Bucket=self.bucket,
+                Key=self.key,
+                Range=f"bytes={self.position}-{end - 1}",
+            )
+            data = response["Body"].read()
+            self.ranged_gets += 1
+        self.position += len(data)
+        return data
+
+
+def get_projected_columns(parquet_file, table_name):
+    """
+    the columns of the warehouse table found in the parquet file, all of them if the
+    table is not in WAREHOUSE_COLUMNS.
+    """
+    file_columns = parquet_file.schema_arrow.names
+    if table_name not in WAREHOUSE_COLUMNS:
+        return file_columns
+    return [name for name in WAREHOUSE_COLUMNS[table_name] if name in file_columns]
+
+
+def open_parquet_from_s3(key, bucket=S3_PROCESSED_BUCKET_NAME):
+    """
+    opens a parquet object with S3ObjectReader, reading only its footer so far.
+    """
     try:
-        response = s3_client.get_object(Bucket=bucket, Key=key)
-        # read into bytesio object first .
-        body_io = io.BytesIO(response["Body"].read())
-        p_table = pq.read_table(body_io)
-        return p_table
+        return pq.ParquetFile(S3ObjectReader(key, bucket=bucket), pre_buffer=True)
     except ClientError as ce:
-        if ce.response["Error"]["Code"] == "NoSuchKey":
+        if ce.response["Error"]["Code"] in ("NoSuchKey", "404"):
             logger.error(f"Key: {key} does not exist: {ce}")
-            raise
+        raise
     except Exception as e:
         logger.error(
             f"Error reading parquet file from bucket {bucket} with key {key}: {e}"
@@ -112,6 +455,37 @@ def read_parquet_from_s3(key, bucket=S3_PROCESSED_BUCKET_NAME):
         raise
 
 
+def read_parquet_from_s3(key, bucket=S3_PROCESSED_BUCKET_NAME, table_name=None):
+    """
+    reads a parquet object into a pyarrow table with ranged GETs,
+    with only the columns of the warehouse table if table_name is given.
+    """
+    parquet_file = open_parquet_from_s3(key, bucket=bucket)
+    columns = None
+    if table_name is not None:
+        columns = get_projected_columns(parquet_file, table_name)
+    return parquet_file.read(columns=columns)
+
+
+def stream_parquet_from_s3(
+    key, bucket=S3_PROCESSED_BUCKET_NAME, table_name=None, batch_size=COPY_BATCH_SIZE
+):
+    """
+    reads a parquet object as record batches of up to batch_size rows, fetching
+    one row group's projected column chunks at a time, so memory stays bounded
+    by the row group and not the file.
+    returns the pyarrow RecordBatchReader and the number of rows from the footer.
+    """
+    parquet_file = open_parquet_from_s3(key, bucket=bucket)
+    columns = get_projected_columns(parquet_file, table_name)
+    schema = pa.schema([parquet_file.schema_arrow.field(name) for name in columns])
+    batches = parquet_file.iter_batches(batch_size=batch_size, columns=columns)
+    return (
+        pa.RecordBatchReader.from_batches(schema, batches),
+        parquet_file.metadata.num_rows,
+    )
+
+
 """pseudocode for def load_dim_tables(): Accepts an argument, bucket, default value is the processing s3 bucket
    
     create a list called dim_tables with names: dim_date, dim_staff, dim_counterparty, dim_currency, dim_design, dim_location.
@@ -122,8 +496,28 @@ def read_parquet_from_s3(key, bucket=S3_PROCESSED_BUCKET_NAME):
         'Load the p_dim_table into the data warehouse', called with  and p_table data and 2nd arg table_name"""
 
 
-def load_dim_tables(bucket=S3_PROCESSED_BUCKET_NAME):
+def timed_call(function, *args, **kwargs):
+    """
+    calls the function, returning its result with the perf_counter() it started and finished at.
+    """
+    started = perf_counter()
+    result = function(*args, **kwargs)
+    return result, started, perf_counter()
+
 
+def load_dim_tables(bucket=S3_PROCESSED_BUCKET_NAME, conn=None, max_connections=1):
+    """
+    upserts every dimension file not yet in the load manifest into its table with
+    merge_dimension_files(), in the order they were written, and commits all six
+    tables in one transaction.
+    the files are downloaded and parsed at once, each table is merged as soon as
+    all its files are ready.
+    - conn: connection of a load session from load_star_schema(), the tables are
+      merged in its transaction and left for the session to commit.
+    - max_connections: more than 1 merges the tables at once on up to that many
+      extra connections, each table committed on its own.
+    returns the perf_counter() times each table was downloaded and loaded.
+    """
     dimension_tables = [
         "dim_date",
         "dim_staff",
@@ -133,22 +527,382 @@ def load_dim_tables(bucket=S3_PROCESSED_BUCKET_NAME):
         "dim_location",
     ]
 
-    for dim_table_name in dimension_tables:
-        dim_prefix = (
-            # confirm s3 processing bucket keys
-            f"dimension/{dim_table_name[4:]}"
+    concurrent_merge = max_connections > 1
+    own_transaction = conn is None and not concurrent_merge
+    if own_transaction:
+        conn = get_dw_connection()
+    timings = {}
+    try:
+        dim_keys = get_dimension_keys(dimension_tables, bucket, conn, concurrent_merge)
+        with ThreadPoolExecutor(
+            max_workers=MAX_DOWNLOAD_WORKERS
+        ) as downloads, ThreadPoolExecutor(max_workers=max_connections) as loads:
+            download_futures = {
+                downloads.submit(
+                    timed_call,
+                    read_parquet_from_s3,
+                    dim_key,
+                    bucket=bucket,
+                    table_name=dim_table_name,
+                ): (dim_table_name, dim_key)
+                for dim_table_name, keys in dim_keys.items()
+                for dim_key in keys
+            }
+            downloaded = {dim_table_name: {} for dim_table_name in dim_keys}
+            load_futures = {}
+            for download_future in as_completed(download_futures):
+                dim_table_name, dim_key = download_futures[download_future]
+                p_dim_table_data, started, finished = download_future.result()
+                downloaded[dim_table_name][dim_key] = p_dim_table_data
+                download_times = timings.setdefault(
+                    dim_table_name, {"download": [started, finished]}
+                )["download"]
+                download_times[:] = [
+                    min(download_times[0], started),
+                    max(download_times[1], finished),
+                ]
+                if len(downloaded[dim_table_name]) < len(dim_keys[dim_table_name]):
+                    continue
+                dim_files = [
+                    (key, downloaded[dim_table_name][key])
+                    for key in dim_keys[dim_table_name]
+                ]
+                if concurrent_merge:
+                    load_future = loads.submit(
+                        timed_call,
+                        merge_on_load_connection,
+                        dim_files,
+                        dim_table_name,
+                    )
+                    load_futures[load_future] = dim_table_name
+                    continue
+                started = perf_counter()
+                merge_dimension_files(dim_files, dim_table_name, conn)
+                timings[dim_table_name]["load"] = [started, perf_counter()]
+            errors = []
+            for load_future in as_completed(load_futures):
+                try:
+                    _, *load_times = load_future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                timings[load_futures[load_future]]["load"] = load_times
+            if errors:
+                raise errors[0]
+        if own_transaction:
+            conn.commit()
+            logger.info("Successfully merged data into the dimension tables")
+    except Exception as e:
+        if own_transaction:
+            logger.error(f"Error merging dimension tables: {e}")
+            conn.rollback()
+        raise
+    return timings
+
+
+def get_dimension_keys(dimension_tables, bucket, conn, concurrent_merge):
+    """
+    keys of the parquet files to merge into each dimension table: every file not
+    yet in the load manifest, oldest first, as each file only holds the rows
+    changed since the one before. tables without any are left out.
+    - conn: connection the load manifest is read on, in its transaction.
+      with concurrent_merge it is read on an extra connection instead.
+    """
+    dim_keys = {}
+    manifest_conn = acquire_load_connection() if concurrent_merge else conn
+    try:
+        for dim_table_name in dimension_tables:
+            loaded_keys = get_loaded_keys(manifest_conn, dim_table_name, commit=False)
+            dim_prefix = f"dimension/{dim_table_name[4:]}-"
+            new_keys = [
+                key
+                for key in list_parquet_keys(dim_prefix, bucket=bucket)
+                if key not in loaded_keys
+            ]
+            if not new_keys:
+                logger.info(f"No new files to load into {dim_table_name}")
+                continue
+            dim_keys[dim_table_name] = new_keys
+    except Exception:
+        if concurrent_merge:
+            discard_load_connection(manifest_conn)
+        raise
+    if concurrent_merge:
+        manifest_conn.commit()
+        release_load_connection(manifest_conn)
+    return dim_keys
+
+
+def record_loaded_key(cursor, object_key, table_name, rows_loaded):
+    """
+    records a processed object in the load manifest, without committing,
+    so it is recorded in the transaction it is loaded in.
+    """
+    cursor.execute(
+        f"INSERT INTO {LOAD_MANIFEST_TABLE} "
+        "(object_key, table_name, rows_loaded) VALUES (%s, %s, %s)",
+        (object_key, table_name, rows_loaded),
+    )
+
+
+def merge_dimension_files(dim_files, dim_table_name, conn):
+    """
+    merges the files of a dimension table one after the other, oldest first,
+    so the latest change of a row wins, recording each in the load manifest with
+    record_loaded_key(). does not commit.
+    - dim_files: (key, pyarrow table) of every file to merge, oldest first.
+    """
+    for dim_key, table_data in dim_files:
+        merge_into_data_warehouse(
+            table_data, dim_table_name, DIMENSION_KEYS[dim_table_name], conn
+        )
+        cursor = conn.cursor()
+        try:
+            record_loaded_key(cursor, dim_key, dim_table_name, table_data.num_rows)
+        finally:
+            cursor.close()
+
+
+def merge_on_load_connection(dim_files, dim_table_name):
+    """
+    merges the files of one dimension table with merge_dimension_files() on an
+    extra connection from acquire_load_connection() and commits it, for concurrent
+    dimension loads.
+    """
+    conn = acquire_load_connection()
+    try:
+        merge_dimension_files(dim_files, dim_table_name, conn)
+        conn.commit()
+    except Exception:
+        discard_load_connection(conn)
+        raise
+    release_load_connection(conn)
+
+
+def log_critical_path(timings, run_started):
+    """
+    logs the download and load time of every table and the chain of steps that
+    decided how long the load took: the dimension finishing last, then the fact table.
+    """
+    for table_name, table_timings in timings.items():
+        steps = ", ".join(
+            f"{step} {finished - started:.3f}s"
+            for step, (started, finished) in table_timings.items()
+        )
+        logger.info(f"Load timing {table_name}: {steps}")
+    dim_timings = {
+        table_name: table_timings
+        for table_name, table_timings in timings.items()
+        if table_name in DIMENSION_KEYS and "load" in table_timings
+    }
+    if not dim_timings:
+        return
+    last_dim = max(dim_timings, key=lambda name: dim_timings[name]["load"][1])
+    download = dim_timings[last_dim]["download"]
+    load = dim_timings[last_dim]["load"]
+    path = [
+        f"{last_dim} download {download[1] - download[0]:.3f}s",
+        f"wait {load[0] - download[1]:.3f}s",
+        f"{last_dim} load {load[1] - load[0]:.3f}s",
+    ]
+    finished = load[1]
+    fact_load = timings.get("fact_sales_order", {}).get("load")
+    if fact_load:
+        path.append(f"fact_sales_order load {fact_load[1] - fact_load[0]:.3f}s")
+        finished = fact_load[1]
+    logger.info(
+        f"Load critical path: {' -> '.join(path)}, "
+        f"total {finished - run_started:.3f}s"
+    )
+
+
+def list_parquet_keys(prefix, bucket=S3_PROCESSED_BUCKET_NAME):
+    """
+    every parquet key under the prefix, following the pages of the listing,
+    in the order they were written by the timestamp in the keys, then in key order.
+    """
+    keys = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(
+            content["Key"]
+            for content in page.get("Contents", [])
+            if content["Key"].endswith(".parquet")
         )
-        dim_key = get_latest_parquet_file_key(dim_prefix, bucket=bucket)
-        p_dim_table_data = read_parquet_from_s3(dim_key, bucket=bucket)
-        load_to_data_warehouse(p_dim_table_data, dim_table_name)
+    return sorted(sorted(keys), key=key_timestamp)
+
+
+def get_fact_partition_date(key):
+    """
+    created_date of the partition of a processed fact key, None for a key written
+    before the fact objects were partitioned.
+    """
+    match = FACT_PARTITION_PATTERN.search(key)
+    if not match:
+        return None
+    return date(*(int(part) for part in match.groups()))
+
+
+def list_fact_keys(
+    fact_prefix, bucket=S3_PROCESSED_BUCKET_NAME, start_date=None, end_date=None
+):
+    """
+    every parquet key of a fact table, oldest first.
+    with start_date and/or end_date only the created_date partitions in that range
+    are kept, and with both only the months of the range are listed.
+    """
+    if start_date is None and end_date is None:
+        return list_parquet_keys(fact_prefix, bucket=bucket)
+    partition_prefixes = [f"{fact_prefix}/"]
+    if start_date is not None and end_date is not None:
+        partition_prefixes = []
+        month = date(start_date.year, start_date.month, 1)
+        while month <= end_date:
+            partition_prefixes.append(
+                f"{fact_prefix}/year={month.year:04d}/month={month.month:02d}/"
+            )
+            month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    fact_keys = []
+    for partition_prefix in partition_prefixes:
+        for key in list_parquet_keys(partition_prefix, bucket=bucket):
+            partition_date = get_fact_partition_date(key)
+            if partition_date is None:
+                continue
+            if start_date is not None and partition_date < start_date:
+                continue
+            if end_date is not None and partition_date > end_date:
+                continue
+            fact_keys.append(key)
+    return fact_keys
 
 
-def load_fact_table(bucket=S3_PROCESSED_BUCKET_NAME):
+def read_fact_partitions(
+    start_date,
+    end_date,
+    bucket=S3_PROCESSED_BUCKET_NAME,
+    fact_prefix="fact/sales_order",
+    table_name="fact_sales_order",
+):
+    """
+    pyarrow table of the fact rows created from start_date to end_date,
+    read from only the partitions of those dates, for ad-hoc queries.
+    """
+    fact_keys = list_fact_keys(
+        fact_prefix, bucket=bucket, start_date=start_date, end_date=end_date
+    )
+    if not fact_keys:
+        raise FileNotFoundError(
+            f"No {table_name} partitions from {start_date} to {end_date} in {bucket}"
+        )
+    return pa.concat_tables(
+        read_parquet_from_s3(key, bucket=bucket, table_name=table_name)
+        for key in fact_keys
+    )
+
+
+def get_loaded_keys(conn, table_name, commit=True):
+    """
+    keys of the processed objects already loaded into a table, from the load manifest,
+    which is created if it does not exist yet.
+    - commit: False leaves the transaction open for a load session.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(CREATE_LOAD_MANIFEST_QUERY)
+        cursor.execute(
+            f"SELECT object_key FROM {LOAD_MANIFEST_TABLE} WHERE table_name = %s",
+            (table_name,),
+        )
+        loaded_keys = {row[0] for row in cursor.fetchall()}
+        if commit:
+            conn.commit()
+        return loaded_keys
+    finally:
+        cursor.close()
+
+
+def load_fact_table(
+    bucket=S3_PROCESSED_BUCKET_NAME, conn=None, start_date=None, end_date=None
+):
+    """
+    appends every processed fact object not yet in the load manifest, oldest first.
+    each object is copied and recorded in the manifest in its own transaction,
+    so a retry carries on after the last object loaded and never loads one twice.
+    - conn: connection of a load session from load_star_schema(), every object is
+      loaded in its transaction and left for the session to commit.
+    - start_date, end_date: only the created_date partitions in this range are
+      listed and loaded, e.g. to backfill some days.
+    """
     fact_table_name = "fact_sales_order"
     fact_prefix = "fact/sales_order"  # confirm s3 processing bucket keys
-    fact_key = get_latest_parquet_file_key(fact_prefix, bucket=bucket)
-    p_fact_table_data = read_parquet_from_s3(fact_key, bucket=bucket)
-    load_to_data_warehouse(p_fact_table_data, fact_table_name)
+    own_transaction = conn is None
+    if own_transaction:
+        conn = get_dw_connection()
+    loaded_keys = get_loaded_keys(conn, fact_table_name, commit=own_transaction)
+    new_fact_keys = [
+        key
+        for key in list_fact_keys(
+            fact_prefix, bucket=bucket, start_date=start_date, end_date=end_date
+        )
+        if key not in loaded_keys
+    ]
+    if not new_fact_keys:
+        logger.info(f"No new files to load into {fact_table_name}")
+    for fact_key in new_fact_keys:
+        fact_batches, fact_rows = stream_parquet_from_s3(
+            fact_key, bucket=bucket, table_name=fact_table_name
+        )
+        cursor = conn.cursor()
+        try:
+            copy_to_data_warehouse(cursor, fact_batches, fact_table_name)
+            record_loaded_key(cursor, fact_key, fact_table_name, fact_rows)
+            if own_transaction:
+                conn.commit()
+            logger.info(f"Loaded {fact_key} into {fact_table_name}")
+        except Exception as e:
+            logger.error(f"Error loading {fact_key} into {fact_table_name}: {e}")
+            if own_transaction:
+                conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+def iter_csv_batches(table_data, batch_size=COPY_BATCH_SIZE):
+    """
+    yields the rows of a pyarrow table or RecordBatchReader as CSV bytes,
+    one record batch at a time, so COPY can stream the table without an encoded
+    copy of all of it in memory.
+    nulls are written as unquoted empty fields, which COPY reads as NULL.
+    """
+    write_options = pa_csv.WriteOptions(include_header=False)
+    batches = table_data
+    if isinstance(table_data, pa.Table):
+        batches = table_data.to_batches(max_chunksize=batch_size)
+    for batch in batches:
+        with io.BytesIO() as buffer:
+            pa_csv.write_csv(batch, buffer, write_options)
+            yield buffer.getvalue()
+
+
+def get_copy_query(table_data, table_name):
+    """
+    COPY statement for the columns of the pyarrow table, in the order they are streamed.
+    columns of the warehouse table missing from the data get their defaults.
+    """
+    column_list = ", ".join(f'"{name}"' for name in table_data.schema.names)
+    return f"COPY {table_name} ({column_list}) FROM STDIN WITH (FORMAT csv)"
+
+
+def copy_to_data_warehouse(cursor, table_data, table_name):
+    """
+    streams a pyarrow table to COPY FROM STDIN as CSV with iter_csv_batches(),
+    without committing.
+    """
+    cursor.execute(
+        get_copy_query(table_data, table_name),
+        stream=iter_csv_batches(table_data),
+    )
 
 
 def load_to_data_warehouse(table_data, table_name):
@@ -156,36 +910,131 @@ def load_to_data_warehouse(table_data, table_name):
     loads data into the data warehouse table.
     - table_data: pyarrow table containing the data to load.
     - table_name: name of the target table in the data warehouse.
+    copies the table with copy_to_data_warehouse() and commits.
+    uses the connection kept by the lambda container, which stays open afterwards.
     """
     try:
-        conn = connect_to_dw()
+        conn = get_dw_connection()
         cursor = conn.cursor()
         try:
-            with io.BytesIO() as buffer:
-                pq.write_table(table_data, buffer, version="2.6")
-                buffer.seek(0)
-                sql_copy_query = f"COPY {table_name} FROM STDIN WITH (FORMAT 'parquet')"
-                cursor.execute(sql_copy_query, stream=buffer)
-                sleep(2.0)
-                conn.commit()
-                logger.info(f" Successfully loaded data into {table_name}")
+            copy_to_data_warehouse(cursor, table_data, table_name)
+            conn.commit()
+            logger.info(
+                f" Successfully loaded data into {table_name}: {table_data.num_rows} rows"
+            )
         except Exception as e:
             logger.error(f"Error during loading {table_name}: {e}")
             conn.rollback()
             raise
         finally:
             cursor.close()
-            conn.close()
     except Exception as ex:
-        logger.error(
-            f"Failed to connect to dw and load into {table_name}: {ex}")
+        logger.error(f"Failed to connect to dw and load into {table_name}: {ex}")
+        raise
+
+
+def keep_last_row_per_key(table_data, key_column):
+    """
+    drops all but the last row of every key in a pyarrow table,
+    as INSERT ... ON CONFLICT can only update a row once per statement.
+    """
+    keys = table_data.column(key_column).to_pylist()
+    last_rows = {key: index for index, key in enumerate(keys)}
+    if len(last_rows) == len(keys):
+        return table_data
+    return table_data.take(sorted(last_rows.values()))
+
+
+def get_merge_query(table_data, table_name, key_column, staging_table_name):
+    """
+    INSERT ... ON CONFLICT statement upserting the staged rows on their natural key.
+    """
+    columns = [f'"{name}"' for name in table_data.column_names]
+    updates = ", ".join(
+        f"{column} = EXCLUDED.{column}"
+        for column in columns
+        if column != f'"{key_column}"'
+    )
+    on_conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    column_list = ", ".join(columns)
+    return (
+        f"INSERT INTO {table_name} ({column_list}) "
+        f"SELECT {column_list} FROM {staging_table_name} "
+        f'ON CONFLICT ("{key_column}") {on_conflict}'
+    )
+
+
+def merge_into_data_warehouse(table_data, table_name, key_column, conn):
+    """
+    upserts the rows of a pyarrow table into a data warehouse table on its natural key:
+    COPYs them into a temporary staging table, runs one INSERT ... ON CONFLICT
+    DO UPDATE from it, then drops it.
+    does not commit, so several tables, or several files of one table, can be
+    merged in one transaction.
+    - table_data: pyarrow table containing the changed rows.
+    - table_name: name of the target table in the data warehouse.
+    - key_column: natural key of the table, which must have a unique constraint.
+    - conn: connection to the data warehouse.
+    """
+    staging_table_name = f"staging_{table_name}"
+    table_data = keep_last_row_per_key(table_data, key_column)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {staging_table_name} "
+            f"(LIKE {table_name} INCLUDING DEFAULTS)"
+        )
+        copy_to_data_warehouse(cursor, table_data, staging_table_name)
+        cursor.execute(
+            get_merge_query(table_data, table_name, key_column, staging_table_name)
+        )
+        cursor.execute(f"DROP TABLE {staging_table_name}")
+        logger.info(f"Merged {table_data.num_rows} rows into {table_name}")
+    except Exception as e:
+        logger.error(f"Error during merging {table_name}: {e}")
+        raise
+    finally:
+        cursor.close()
+
+
+def load_star_schema(
+    bucket=S3_PROCESSED_BUCKET_NAME, max_connections=MAX_LOAD_CONNECTIONS
+):
+    """
+    load session: merges the six dimension tables and then appends the new fact
+    files on the one connection kept by the lambda container, in one transaction
+    committed once, so the warehouse never shows a half loaded star schema.
+    everything is rolled back if any table fails.
+    with max_connections above 1 the dimensions are merged at once on extra
+    connections and committed on their own instead, and only the fact table is
+    loaded in the session once every dimension is committed.
+    logs the critical path of the load with log_critical_path().
+    """
+    run_started = perf_counter()
+    conn = get_dw_connection()
+    try:
+        timings = load_dim_tables(
+            bucket=bucket, conn=conn, max_connections=max_connections
+        )
+        _, *fact_times = timed_call(load_fact_table, bucket=bucket, conn=conn)
+        conn.commit()
+        logger.info("Successfully loaded the star schema")
+    except Exception as e:
+        logger.error(f"Error loading the star schema, rolling back: {e}")
+        conn.rollback()
         raise
+    if timings:
+        timings["fact_sales_order"] = {"load": fact_times}
+        log_critical_path(timings, run_started)
 
 
 def lambda_handler(event, context):
     try:
-        load_dim_tables()
-        load_fact_table()
+        load_star_schema()
     except Exception as e:
         logger.error(f"Error in loading lambda execution: {e}")
+        close_dw_connection()
+        close_load_connections()
         raise
+    finally:
+        logger.info(f"Data warehouse connection stats: {connection_stats}")
@@ -1,152 +1,400 @@
 from pprint import pprint
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from datetime import datetime
+from time import perf_counter
 import logging
 import json
+import hashlib
 from pprint import pprint
 import boto3
-from io import BytesIO
+from io import BytesIO, RawIOBase
+from urllib.parse import unquote_plus
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 # from src.ingestion_lambda import get_table_names
 from botocore.exceptions import ClientError
 import re
-import pg8000
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 s3 = boto3.client("s3")
 current_time = datetime.now()
-secret_manager_client = boto3.client("secretsmanager")
 
 INGESTION_S3_BUCKET_NAME = "de-team-orchid-totesys-ingestion"
 PROCESSED_S3_BUCKET_NAME = "de-team-orchid-totesys-processed"
+# objects downloaded at once when fetching the records of a processing run
+MAX_DOWNLOAD_WORKERS = 8
+# objects copied at once by copy_object_keys, the copies are made server side
+MAX_COPY_WORKERS = 16
+# most keys s3 accepts in one delete_objects request
+DELETE_OBJECTS_BATCH_SIZE = 1000
+# table name at the start of an ingestion key, after its prefix
+TABLE_NAME_PATTERN = re.compile(r"^([a-z_]+)(?=[-.])")
+# ingestion tables whose records each updated table's transform reads
+TRANSFORM_SOURCE_TABLES = {
+    "sales_order": ["sales_order"],
+    "counterparty": ["counterparty", "address"],
+    "currency": ["currency"],
+    "design": ["design"],
+    "address": ["address"],
+    "staff": ["staff"],
+}
+# prefix of the pointers to the latest object of each table, kept apart from the data
+LATEST_POINTER_PREFIX = "_latest/"
+# timestamp str(datetime) writes into object keys
+KEY_TIMESTAMP_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(?:\.\d{6})?")
+# bytes buffered before each part of a multipart upload is sent,
+# every part but the last must be at least 5 MiB
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+# size of an ingestion object with no rows in it, "[]"
+EMPTY_OBJECT_SIZE = 2
+# parquet writer options used for tables without a profile of their own
+DEFAULT_PARQUET_WRITER_PROFILE = {
+    # rows per row group, None keeps a small table in one row group
+    "row_group_size": None,
+    "compression": "zstd",
+    "compression_level": 3,
+    # low cardinality columns worth a dictionary, the others are written plain
+    "dictionary_columns": [],
+    "statistics": True,
+    # column the rows are sorted by, recorded as the sorting column of the file
+    "sort_by": None,
+}
+# parquet writer options of each processed table, by the table name in its key
+PARQUET_WRITER_PROFILES = {
+    "address": {
+        "dictionary_columns": ["district", "city", "country"],
+        "sort_by": "address_id",
+    },
+    "sales_order": {
+        "row_group_size": 100000,
+        "compression_level": 1,
+        "dictionary_columns": [
+            "design_id",
+            "counterparty_id",
+            "currency_id",
+            "sales_staff_id",
+            "agreed_delivery_location_id",
+            "agreed_delivery_date",
+            "agreed_payment_date",
+            "created_date",
+            "last_updated_date",
+        ],
+        "sort_by": "sales_order_id",
+    },
+    "counterparty": {
+        "dictionary_columns": [
+            "counterparty_legal_district",
+            "counterparty_legal_city",
+            "counterparty_legal_country",
+        ],
+        "sort_by": "counterparty_id",
+    },
+    "currency": {
+        "dictionary_columns": ["currency_code", "currency_name"],
+        "sort_by": "currency_id",
+    },
+    "date": {
+        "dictionary_columns": [
+            "year",
+            "month",
+            "day",
+            "day_of_week",
+            "day_name",
+            "month_name",
+            "quarter",
+        ],
+        "sort_by": "date_id",
+    },
+    "design": {
+        "dictionary_columns": ["design_name", "file_location"],
+        "sort_by": "design_id",
+    },
+    "location": {
+        "dictionary_columns": ["district", "city", "country"],
+        "sort_by": "location_id",
+    },
+    "staff": {
+        "dictionary_columns": ["department_name", "location"],
+        "sort_by": "staff_id",
+    },
+}
+# prefix of the current state snapshot of each ingestion table, one row per primary key
+STATE_LATEST_PREFIX = "state/latest/"
+# prefix of the rows each run replaced in the state snapshots
+STATE_HISTORY_PREFIX = "state/history/"
+# tables a transform looks rows up in, read from their whole current state
+# instead of only the new records of the run
+TRANSFORM_LOOKUP_TABLES = {"counterparty": ["address"]}
+# column of fact_sales_order whose date partitions the processed fact objects
+FACT_PARTITION_COLUMN = "created_date"
+# parquet types of the processed fact_sales_order columns, the same in every partition
+FACT_SALES_ORDER_SCHEMA = pa.schema(
+    [
+        ("sales_order_id", pa.int64()),
+        ("design_id", pa.int64()),
+        ("counterparty_id", pa.int64()),
+        ("units_sold", pa.int64()),
+        ("unit_price", pa.float64()),
+        ("currency_id", pa.int64()),
+        ("agreed_delivery_date", pa.string()),
+        ("agreed_payment_date", pa.string()),
+        ("agreed_delivery_location_id", pa.int64()),
+        ("sales_staff_id", pa.int64()),
+        ("created_date", pa.date32()),
+        ("created_time", pa.time64("us")),
+        ("last_updated_date", pa.date32()),
+        ("last_updated_time", pa.time64("us")),
+    ]
+)
+# timezone the created_at and last_updated timestamps are split into dates and times in
+PROCESSING_TIMEZONE = "UTC"
+# fact_sales_order columns whose dates make up dim_date
+DIM_DATE_SOURCE_COLUMNS = [
+    "created_date",
+    "last_updated_date",
+    "agreed_payment_date",
+    "agreed_delivery_date",
+]
+# address columns copied onto each counterparty, by their dim_counterparty names
+COUNTERPARTY_LEGAL_ADDRESS_COLUMNS = {
+    "address_line_1": "counterparty_legal_address_line_1",
+    "address_line_2": "counterparty_legal_address_line_2",
+    "district": "counterparty_legal_district",
+    "city": "counterparty_legal_city",
+    "postal_code": "counterparty_legal_postal_code",
+    "country": "counterparty_legal_country",
+    "phone": "counterparty_legal_phone_number",
+}
 
 
-def retrieve_secret_credentials(secret_name="totesys_environment"):
-    """Uses the boto3 module with the AWS secrets manager to store and
-    retrieve AWS credentials securely.
+def get_object_key(
+    table_name: str, prefix: str = None, bucket=INGESTION_S3_BUCKET_NAME
+) -> str:
+    """Retrieves the s3 object key for the specifed prefix table name and bucket,
+    from a listing of every page of the prefix.
+    Parameters:
+        table_name(str): The name of the table to search for inside the s3 bucket.
+        prefix(str): The prefix path to use when listing the objects in the s3 bucket if not specified no prefix is used.
+        bucket(str):The name of the s3 bucket to get the objects from the default value is INGESTION_S3_BUCKET_NAME.
+    Returns:
+        (str): The key of the latest s3 object that matches the table name.
+    Errors:
+        FileNotFoundError: If no objects are found that matches the table name.
+    """
+    table_files = [
+        key
+        for key in list_object_keys(bucket=bucket, prefix=prefix or "")
+        if table_name in key
+    ]
 
-      Parameters:
-              secret_name (str):
-                  keyword argument with the database environment as a default value.
+    if not table_files:
+        logger.error(f"No files found for table {table_name}")
+        raise FileNotFoundError(f"No files found for table {table_name}")
+    return latest_object_key(table_files)
 
-      Returns:
-                      DB_HOST, DB_PASSWORD, DB_NAME, DB_PORT, DB_USER (Tuple): Credentials needed for AWS.
 
+def key_timestamp(key):
+    """Reads the timestamp written into an object key.
+    Parameters:
+        key(str): The object key.
+    Returns:
+        (datetime): The timestamp in the key, datetime.min if it has none.
     """
-    response = secret_manager_client.get_secret_value(
-        SecretId=secret_name,
-    )
-
-    secret_string = json.loads(response["SecretString"])
-    DB_HOST = secret_string["host"]
-    DB_PORT = secret_string["port"]
-    DB_NAME = secret_string["dbname"]
-    DB_USER = secret_string["username"]
-    DB_PASSWORD = secret_string["password"]
-    return DB_HOST, DB_PASSWORD, DB_NAME, DB_PORT, DB_USER
+    match = KEY_TIMESTAMP_PATTERN.search(key)
+    if not match:
+        return datetime.min
+    return datetime.fromisoformat(match.group())
 
 
-def connect_to_db(credentials=retrieve_secret_credentials()):
-    """Retrieves credentials from retrieve_secret_credentials(),
-    stores as new constants with the same variable names as within retrieve_secret_credentials(),
-    connects to the database,
-    logs the outcome of connection to the database when successfully or unsuccessfully connected.
+def latest_object_key(keys):
+    """Picks the key with the latest timestamp, keys with the same timestamp
+    or without one are ordered as they were given.
+    Parameters:
+        keys(list): The object keys.
+    Returns:
+        (str): The latest key.
+    """
+    return sorted(keys, key=key_timestamp)[-1]
 
-        Returns:
-                        conn (Connection): Connection to the database.
 
-        Errors:
-                        DatabaseError: pg8000 specific error which is related to the database itself, such as incorrect SQL or constraint violations. Logs failure in logger.
-                        InterfaceError: pg8000 specific error when connection failure with the database occurs. Logs failure in logger.
+def get_source_keys_stamp(source_keys):
+    """Works out the part of a processed key that names the ingestion objects it
+    was made from: the latest timestamp in their keys and a digest of the sorted
+    keys, so processing the same objects again gives the same key.
+    Parameters:
+        source_keys(list): The keys of the ingestion objects.
+    Returns:
+        (str): The stamp, e.g. 2024-05-24 14:35:22.123456-3f1c9a0b2d4e6f81.
     """
-    DB_HOST = credentials[0]
-    DB_PORT = credentials[3]
-    DB_NAME = credentials[2]
-    DB_USER = credentials[4]
-    DB_PASSWORD = credentials[1]
+    digest = hashlib.sha256("\n".join(sorted(source_keys)).encode("utf-8"))
+    latest = max(key_timestamp(key) for key in source_keys)
+    return f"{latest}-{digest.hexdigest()[:16]}"
 
-    try:
-        logger.info(f"Connecting to the database {DB_NAME}")
-        conn = pg8000.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-        )
-        logger.info("Connected to the database successfully")
 
-        return conn
-    except pg8000.DatabaseError as e:
-        logger.error(f"Error connecting to database: {e}")
-        raise
+def latest_pointer_key(prefix, table_name):
+    """Works out the key of the pointer to the latest object of a table under a prefix.
+    Parameters:
+        prefix(str): The prefix path of the objects of the table, e.g. dimension/.
+        table_name(str): The name of the table.
+    Returns:
+        (str): The pointer key, e.g. _latest/dimension/staff.json.
+    """
+    return f"{LATEST_POINTER_PREFIX}{prefix.strip('/')}/{table_name}.json"
 
-    except pg8000.exceptions.InterfaceError as e:
-        logger.error(f"Error connecting to the database: {e}")
-        raise
 
+def write_latest_pointer(s3, key, bucket=PROCESSED_S3_BUCKET_NAME):
+    """Points the latest pointer of the table of a key at it, with a single put
+    so readers see either the previous or the new pointer.
+    Parameters:
+        s3(boto3.client): The boto3 client to interact with s3.
+        key(str): The key just written, e.g. dimension/staff-2024-05-24 14:35:22.parquet.
+        bucket(str): The name of the s3 bucket, the default value is PROCESSED_S3_BUCKET_NAME.
+    Returns:
+        None.
+    """
+    prefix, _, file_name = key.rpartition("/")
+    table_name = TABLE_NAME_PATTERN.match(file_name).group(1)
+    s3.put_object(
+        Bucket=bucket,
+        Key=latest_pointer_key(prefix, table_name),
+        Body=json.dumps({"key": key}),
+    )
 
-def get_table_names():
-    """Opens a connection to the database and runs an SQL query to get all relevant table names,
-    list them and then sort them alphabetically.
-    Ensures that a connection to the database is closed.
 
+def list_object_summaries(bucket=INGESTION_S3_BUCKET_NAME, prefix=""):
+    """Lists every object under the prefix, following the pages of the listing.
+    Parameters:
+        bucket(str): The name of the s3 bucket, the default value is INGESTION_S3_BUCKET_NAME.
+        prefix(str): The prefix path of the keys, default value is no prefix.
     Returns:
-                    table_names (list): Sorted list of table names from database.
+        (list): The Contents entries of the listing, with the Key, Size and ETag
+        of each object, in the order s3 lists them.
+    """
+    summaries = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        summaries.extend(page.get("Contents", []))
+    return summaries
 
-    Errors:
-                    DatabaseError: pg8000 specific error which is related to the database itself, such as incorrect SQL or constraint violations. Logs failure in logger.
-                    InterfaceError: pg8000 specific error when connection failure with the database occurs. Logs failure in logger.
+
+def list_object_keys(bucket=INGESTION_S3_BUCKET_NAME, prefix=""):
+    """Lists every object key under the prefix, following the pages of the listing.
+    Parameters:
+        bucket(str): The name of the s3 bucket, the default value is INGESTION_S3_BUCKET_NAME.
+        prefix(str): The prefix path of the keys, default value is no prefix.
+    Returns:
+        (list): The keys in the order s3 lists them.
     """
-    db = None
-    try:
-        db = connect_to_db()
-        table_names = db.run(
-            """SELECT table_name
-        FROM INFORMATION_SCHEMA.TABLES
-        WHERE table_type = 'BASE TABLE'
-        AND table_name NOT LIKE 'pg_%'
-        AND table_name NOT LIKE 'sql_%'
-        AND table_name NOT LIKE '_prisma_migrations%';"""
-        )
-        table_names = list(table_names)
-        table_names = sorted(table_names)
-        return table_names
-    except pg8000.exceptions.DatabaseError as e:
-        logger.error(f"Error connecting to database: {e}")
-        raise
-    except pg8000.exceptions.InterfaceError as e:
-        logger.error(f"Error connecting to the database: {e}")
-    finally:
-        if db:
-            db.close()
+    return [obj["Key"] for obj in list_object_summaries(bucket=bucket, prefix=prefix)]
 
 
-def get_object_key(
-    table_name: str, prefix: str = None, bucket=INGESTION_S3_BUCKET_NAME
-) -> str:
-    """Retrieves the s3 object key for the specifed prefix table name and bucket
+def group_keys_by_table(keys, prefix="updated/"):
+    """Groups ingestion keys by the table name at the start of the key after the prefix,
+    keys without a table name are left out.
     Parameters:
-        table_name(str): The name of the table to search for inside the s3 bucket.
-        prefix(str): The prefix path to use when listing the objects in the s3 bucket if not specified no prefix is used.
-        bucket(str):The name of the s3 bucket to get the objects from the default value is INGESTION_S3_BUCKET_NAME.
+        keys(list): The keys from list_object_keys().
+        prefix(str): The prefix path of the keys, the default value is updated/.
     Returns:
-        (str): The key of the latest s3 object that matches the table name.
-    Errors:
-        FileNotFoundError: If no objects are found that matches the table name.
+        (dict): The keys of each table, in the order they were given.
     """
-    response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
-    all_objects = response.get("Contents", [])
-    table_files = []
-    for obj in all_objects:
-        if table_name in obj["Key"]:
-            table_files.append(obj["Key"])
+    keys_by_table = {}
+    for key in keys:
+        match = TABLE_NAME_PATTERN.match(key[len(prefix) :])
+        if match:
+            keys_by_table.setdefault(match.group(1), []).append(key)
+    return keys_by_table
+
+
+def fetch_run_records(
+    keys_by_table, bucket=INGESTION_S3_BUCKET_NAME, max_workers=MAX_DOWNLOAD_WORKERS
+):
+    """Works out from TRANSFORM_SOURCE_TABLES which tables the transforms of a run read,
+    downloads every new object of each of them once, at most max_workers at a time,
+    and joins the records of each table oldest object first without the duplicate
+    records dropped by drop_duplicate_records(), so every transform can share them.
+    Parameters:
+        keys_by_table(dict): The keys of each table from group_keys_by_table().
+        bucket(str): The name of the s3 bucket, the default value is INGESTION_S3_BUCKET_NAME.
+        max_workers(int): The most objects downloaded at once.
+    Returns:
+        (dict): The parsed records of each table read by the run.
+    """
+    source_tables = {
+        source_table
+        for table_name in keys_by_table
+        for source_table in TRANSFORM_SOURCE_TABLES.get(table_name, [])
+        if source_table in keys_by_table
+    }
+    run_keys = [
+        (table_name, key)
+        for table_name in sorted(source_tables)
+        for key in sorted(keys_by_table[table_name], key=key_timestamp)
+    ]
 
-    if not table_files:
-        logger.error(f"No files found for table {table_name}")
-        raise FileNotFoundError(f"No files found for table {table_name}")
-    return table_files[-1]
+    def fetch(run_key):
+        obj = s3.get_object(Bucket=bucket, Key=run_key[1])
+        return json.loads(obj["Body"].read().decode("utf-8"))
+
+    records = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for (table_name, _), object_records in zip(
+            run_keys, executor.map(fetch, run_keys)
+        ):
+            records.setdefault(table_name, []).extend(object_records)
+    return {
+        table_name: drop_duplicate_records(table_name, table_records)
+        for table_name, table_records in records.items()
+    }
+
+
+def drop_duplicate_records(table_name, records):
+    """Drops the records already seen with the same primary key and last_updated,
+    the first of them is kept. Records without either are all kept.
+    Parameters:
+        table_name(str): The name of the table, its primary key is <table_name>_id.
+        records(list): The records of the table.
+    Returns:
+        (list): The records without duplicates, in the order they were given.
+    """
+    primary_key = f"{table_name}_id"
+    seen = set()
+    unique_records = []
+    for record in records:
+        if primary_key in record and "last_updated" in record:
+            record_version = (record[primary_key], record["last_updated"])
+            if record_version in seen:
+                continue
+            seen.add(record_version)
+        unique_records.append(record)
+    return unique_records
+
+
+def read_table_records(
+    table_name, bucket=INGESTION_S3_BUCKET_NAME, prefix=None, records=None
+):
+    """Returns the records of a table from the records of the run if it has them,
+    otherwise downloads the latest object of the table found by get_object_key(),
+    without the duplicate records dropped by drop_duplicate_records().
+    Parameters:
+        table_name(str): The name of the table.
+        bucket(str): The name of the s3 bucket, the default value is INGESTION_S3_BUCKET_NAME.
+        prefix(str): The file path of the s3 bucket, default value is None.
+        records(dict): The records of the run from fetch_run_records(), default value is None.
+    Returns:
+        (list): The records of the table.
+    """
+    if records is not None and table_name in records:
+        return records[table_name]
+    key = get_object_key(table_name=table_name, prefix=prefix, bucket=bucket)
+    obj = s3.get_object(Bucket=bucket, Key=key)
+    return drop_duplicate_records(
+        table_name, json.loads(obj["Body"].read().decode("utf-8"))
+    )
 
 
 def remove_created_at_and_last_updated(df):
@@ -160,46 +408,79 @@ def remove_created_at_and_last_updated(df):
     return df
 
 
-def process_fact_sales_order(bucket=INGESTION_S3_BUCKET_NAME, prefix=None):
+def process_fact_sales_order(
+    bucket=INGESTION_S3_BUCKET_NAME, prefix=None, records=None, source_keys=None
+):
     """This function processes the latest sales_order data from the s3 bucket
-    and split the created_at and last_updated columns into separate date and time columns , renames staff_id to
+    and split the created_at and last_updated columns into separate date and time columns
+    in PROCESSING_TIMEZONE, a whole column at a time, renames staff_id to
     sales_staff_id
     and returns the DataFrame with the created_at and last_updated columns removed.
     Parameters:
         bucket(str): The name of the s3 bucket to retrieve the sales_order table.
         The default value is INGESTION_S3_BUCKET_NAME.
         prefix(str): The file path of the s3 bucket, default value is None.
+        records(dict): The records of the run from fetch_run_records(),
+        read from the s3 bucket if None or missing the table.
+        source_keys(list): The keys of the sales_order objects of the records,
+        named in the key with get_source_keys_stamp() so a retry of the same
+        objects overwrites the fact objects instead of adding a second copy
+        of the rows to load. Default value is None for the time of the run.
     Returns:
         (pandas.DataFrame): The DataFrame for the processed sales_order table.
         (str): The key for the processed data in the s3 bucket.
     """
-    key = get_object_key(table_name="sales_order", prefix=prefix, bucket=bucket)
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    sales_order_json = obj["Body"].read().decode("utf-8")
-    sales_order_list = json.loads(sales_order_json)
-
-    for dictionary in sales_order_list:
-        if "staff_id" in dictionary:
-            dictionary["sales_staff_id"] = dictionary.pop("staff_id")
-
-        unix_ts_s_created_at = (dictionary["created_at"]) / 1000
-        unix_ts_s_last_updated = (dictionary["last_updated"]) / 1000
-
-        formatted_time_c = datetime.fromtimestamp(unix_ts_s_created_at)
-        formatted_time_l = datetime.fromtimestamp(unix_ts_s_last_updated)
-
-        dictionary["created_date"] = formatted_time_c.date()
-        dictionary["created_time"] = formatted_time_c.time()
-        dictionary["last_updated_date"] = formatted_time_l.date()
-        dictionary["last_updated_time"] = formatted_time_l.time()
+    sales_order_list = read_table_records(
+        "sales_order", bucket=bucket, prefix=prefix, records=records
+    )
 
     fact_sales_order_df = pd.DataFrame(sales_order_list)
+    if "staff_id" in fact_sales_order_df:
+        fact_sales_order_df["sales_staff_id"] = fact_sales_order_df.pop("staff_id")
+
+    for column, split_name in [
+        ("created_at", "created"),
+        ("last_updated", "last_updated"),
+    ]:
+        timestamps = pd.to_datetime(
+            fact_sales_order_df[column], unit="ms", utc=True
+        ).dt.tz_convert(PROCESSING_TIMEZONE)
+        fact_sales_order_df[f"{split_name}_date"] = timestamps.dt.date
+        fact_sales_order_df[f"{split_name}_time"] = timestamps.dt.time
+
     fact_sales_order_df = remove_created_at_and_last_updated(fact_sales_order_df)
     key = f"fact/sales_order-{current_time}.parquet"
+    if source_keys:
+        key = f"fact/sales_order-{get_source_keys_stamp(source_keys)}.parquet"
     return fact_sales_order_df, key
 
 
-def process_dim_counterparty(bucket=INGESTION_S3_BUCKET_NAME, prefix=None):
+def join_legal_addresses(counterparty_list, address_list):
+    """Adds the legal address columns to every counterparty
+    by looking its legal_address_id up in an index of the addresses built once,
+    so the join is linear in the number of counterparties and addresses.
+    Counterparties without a matching address are left without the columns.
+    Parameters:
+        counterparty_list(list): The counterparty records, updated in place.
+        address_list(list): The address records.
+    Returns:
+        (list): The counterparty records with the legal address columns.
+    """
+    addresses_by_id = {
+        address_dict["address_id"]: address_dict for address_dict in address_list
+    }
+    for counterparty_dict in counterparty_list:
+        address_dict = addresses_by_id.get(counterparty_dict["legal_address_id"])
+        if address_dict is None:
+            continue
+        for column, legal_column in COUNTERPARTY_LEGAL_ADDRESS_COLUMNS.items():
+            counterparty_dict[legal_column] = address_dict[column]
+    return counterparty_list
+
+
+def process_dim_counterparty(
+    bucket=INGESTION_S3_BUCKET_NAME, prefix=None, records=None
+):
     """
     Process the counterparty data with the address data from an s3 bucket and
     create the required columns for counterparty by renaming existing columns
@@ -211,6 +492,8 @@ def process_dim_counterparty(bucket=INGESTION_S3_BUCKET_NAME, prefix=None):
         bucket(str): The name of the s3 bucket where the address data is stored,
         the default value is INGESTION_S3_BUCKET_NAME.
         prefix(str): The file path of the s3 bucket, default value is None.
+        records(dict): The records of the run from fetch_run_records(),
+        read from the s3 bucket if None or missing the table.
 
     Return:
         (pandas.DataFrame): A DataFrame containing processed counterparty data,
@@ -218,38 +501,15 @@ def process_dim_counterparty(bucket=INGESTION_S3_BUCKET_NAME, prefix=None):
         (str): The key for the processed data in the s3 bucket.
     """
 
-    key = get_object_key(table_name="counterparty", prefix=prefix, bucket=bucket)
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    counterparty_json = obj["Body"].read().decode("utf-8")
-    counterparty_list = json.loads(counterparty_json)
+    counterparty_list = read_table_records(
+        "counterparty", bucket=bucket, prefix=prefix, records=records
+    )
 
-    key = get_object_key(table_name="address", prefix=prefix, bucket=bucket)
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    address_json = obj["Body"].read().decode("utf-8")
-    address_list = json.loads(address_json)
+    address_list = read_table_records(
+        "address", bucket=bucket, prefix=prefix, records=records
+    )
 
-    for counterparty_dict in counterparty_list:
-        for address_dict in address_list:
-            if address_dict["address_id"] == counterparty_dict["legal_address_id"]:
-                counterparty_dict["counterparty_legal_address_line_1"] = address_dict[
-                    "address_line_1"
-                ]
-                counterparty_dict["counterparty_legal_address_line_2"] = address_dict[
-                    "address_line_2"
-                ]
-                counterparty_dict["counterparty_legal_district"] = address_dict[
-                    "district"
-                ]
-                counterparty_dict["counterparty_legal_city"] = address_dict["city"]
-                counterparty_dict["counterparty_legal_postal_code"] = address_dict[
-                    "postal_code"
-                ]
-                counterparty_dict["counterparty_legal_country"] = address_dict[
-                    "country"
-                ]
-                counterparty_dict["counterparty_legal_phone_number"] = address_dict[
-                    "phone"
-                ]
+    join_legal_addresses(counterparty_list, address_list)
 
     dim_counterparty_df = pd.DataFrame(counterparty_list)
     dim_counterparty_df = remove_created_at_and_last_updated(dim_counterparty_df)
@@ -262,21 +522,22 @@ def process_dim_counterparty(bucket=INGESTION_S3_BUCKET_NAME, prefix=None):
     return dim_counterparty_df, key
 
 
-def process_dim_currency(bucket=INGESTION_S3_BUCKET_NAME, prefix=None):
+def process_dim_currency(bucket=INGESTION_S3_BUCKET_NAME, prefix=None, records=None):
     """Process the currency table from the s3 bucket by adding a new column currency_name
     and converting into DataFrame then removing created_at and last_updated columns.
     Parameters:
         bucket(str): The name of the s3 bucket to retrieve the currency table.
         The default value is INGESTION_S3_BUCKET_NAME.
         prefix(str): The file path of the s3 bucket, default value is None.
+        records(dict): The records of the run from fetch_run_records(),
+        read from the s3 bucket if None or missing the table.
     Returns:
         (pandas.DataFrame): The DataFrame for the processed currency data.
         (str): The key for the processed data in the s3 bucket.
     """
-    key = get_object_key(table_name="currency", prefix=prefix, bucket=bucket)
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    currency_json = obj["Body"].read().decode("utf-8")
-    currency_list = json.loads(currency_json)
+    currency_list = read_table_records(
+        "currency", bucket=bucket, prefix=prefix, records=records
+    )
 
     dim_currency_df = pd.DataFrame(currency_list)
 
@@ -291,121 +552,274 @@ def process_dim_currency(bucket=INGESTION_S3_BUCKET_NAME, prefix=None):
     return dim_currency_df, key
 
 
-def process_dim_date(bucket=INGESTION_S3_BUCKET_NAME, prefix=None):
+def process_dim_date(
+    bucket=INGESTION_S3_BUCKET_NAME, prefix=None, fact_sales_order_df=None, records=None
+):
     """
     Process the sales order data to create a dim date DataFrame.
-    It extracts unique dates and creates additional columns for year, month,
-    day, day_of_week, day_name, month_name and quarter.
+    It collects the distinct dates of the DIM_DATE_SOURCE_COLUMNS and creates
+    additional columns for year, month, day, day_of_week, day_name, month_name
+    and quarter for the distinct dates only, a whole column at a time.
     Parameters:
         bucket(str): The name of the bucket to retrieve the sales order data from.
         The default value is INGESTION_S3_BUCKET_NAME.
         prefix(str): The file path of the s3 bucket, default value is None.
+        fact_sales_order_df(pandas.DataFrame): The already processed sales order data
+        from process_fact_sales_order, processed here from the s3 bucket if None.
+        records(dict): The records of the run from fetch_run_records(), default value is None.
     Returns:
         pandas.DataFrame: The DataFrame containing unique dates and the corresponding date-related columns.
         (str): The key for the processed data in the s3 bucket.
     """
-    fso_df, key = process_fact_sales_order(bucket=bucket, prefix=prefix)
-    fso_dicts = fso_df.to_dict(orient="records")
+    if fact_sales_order_df is None:
+        fact_sales_order_df, key = process_fact_sales_order(
+            bucket=bucket, prefix=prefix, records=records
+        )
 
-    dim_date = []
-    date_columns = [
-        "created_date",
-        "last_updated_date",
-        "agreed_payment_date",
-        "agreed_delivery_date",
-    ]
-    for sales_order_dict in fso_dicts:
-        for col in date_columns:
-            date_string = str(sales_order_dict[col])
-
-            date_format = "%Y-%m-%d"
-            dt_obj = datetime.strptime(date_string, date_format)
-
-            dim_date_item = {
-                "date_id": dt_obj.date(),
-                "year": dt_obj.year,
-                "month": dt_obj.month,
-                "day": dt_obj.day,
-                "day_of_week": dt_obj.isoweekday(),
-                "day_name": dt_obj.strftime("%A"),
-                "month_name": dt_obj.strftime("%B"),
-                "quarter": (dt_obj.month - 1) // 3 + 1,
-            }
-            dim_date.append(dim_date_item)
-    dim_date_df = pd.DataFrame(dim_date)
-    dim_date_df = dim_date_df.drop_duplicates(subset=["date_id"])
+    date_strings = set()
+    for col in DIM_DATE_SOURCE_COLUMNS:
+        date_strings.update(str(value) for value in fact_sales_order_df[col].unique())
+    dates = pd.DatetimeIndex(
+        sorted(pd.to_datetime(list(date_strings), format="%Y-%m-%d"))
+    )
+
+    dim_date_df = pd.DataFrame(
+        {
+            "date_id": dates.date,
+            "year": dates.year.astype("int64"),
+            "month": dates.month.astype("int64"),
+            "day": dates.day.astype("int64"),
+            "day_of_week": (dates.dayofweek + 1).astype("int64"),
+            "day_name": dates.day_name(),
+            "month_name": dates.month_name(),
+            "quarter": dates.quarter.astype("int64"),
+        }
+    )
     key = f"dimension/date-{current_time}.parquet"
     return dim_date_df, key
 
 
-def process_dim_design(bucket=INGESTION_S3_BUCKET_NAME, prefix=None):
+def process_dim_design(bucket=INGESTION_S3_BUCKET_NAME, prefix=None, records=None):
     """Process the design table from s3 bucket convert it into a DataFrame ,removes created_at and last_updated columns
     Parameters:
         bucket(str): The name of the s3 bucket to retrieve the design table.
         The default value is INGESTION_S3_BUCKET_NAME.
         prefix(str): The file path of the s3 bucket, default value is None.
+        records(dict): The records of the run from fetch_run_records(),
+        read from the s3 bucket if None or missing the table.
     Returns:
         (pandas.DataFrame): The DataFrame for the processed design data.
         (str): The key for the processed data in the s3 bucket.
     """
-    key = get_object_key(table_name="design", prefix=prefix, bucket=bucket)
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    design_json = obj["Body"].read().decode("utf-8")
-    design_list = json.loads(design_json)
+    design_list = read_table_records(
+        "design", bucket=bucket, prefix=prefix, records=records
+    )
     df = pd.DataFrame(design_list)
     return_df = remove_created_at_and_last_updated(df)
     key = f"dimension/design-{current_time}.parquet"
     return return_df, key
 
 
-def process_dim_location(bucket=INGESTION_S3_BUCKET_NAME, prefix=None):
+def process_dim_location(bucket=INGESTION_S3_BUCKET_NAME, prefix=None, records=None):
     """Process the address table from s3 bucket converts to json ,renames address_id column to
     location_id ,then converts to DataFrame , removes the created_at and last_updated columns.
     Parameters:
         bucket(str): The name of the s3 bucket to retrieve the address table.
         The default value is INGESTION_S3_BUCKET_NAME.
         prefix(str): The file path of the s3 bucket, default value is None.
+        records(dict): The records of the run from fetch_run_records(),
+        read from the s3 bucket if None or missing the table.
     Returns:
         (pandas.DataFrame): The DataFrame for the processed address data as the location data.
         (str): The key for the processed data in the s3 bucket.
     """
 
-    key = get_object_key(table_name="address", prefix=prefix, bucket=bucket)
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    location_json = obj["Body"].read().decode("utf-8")
-    location_list = json.loads(location_json)
-    for location_dict in location_list:
-        location_dict["location_id"] = location_dict["address_id"]
-        del location_dict["address_id"]
+    location_list = read_table_records(
+        "address", bucket=bucket, prefix=prefix, records=records
+    )
     df = pd.DataFrame(location_list)
+    df["location_id"] = df.pop("address_id")
     return_df = remove_created_at_and_last_updated(df)
     key = f"dimension/location-{current_time}.parquet"
     return return_df, key
 
 
-def process_dim_staff(bucket=INGESTION_S3_BUCKET_NAME, prefix=None):
+def process_dim_staff(bucket=INGESTION_S3_BUCKET_NAME, prefix=None, records=None):
     """Process the staff table from s3 bucket convert it into a DataFrame ,removes created_at and last_updated columns
     Parameters:
         bucket(str): The name of the s3 bucket to retrieve the staff table.
         The default value is INGESTION_S3_BUCKET_NAME.
         prefix(str): The file path of the s3 bucket, default value is None.
+        records(dict): The records of the run from fetch_run_records(),
+        read from the s3 bucket if None or missing the table.
     Returns:
         (pandas.DataFrame): The DataFrame for the processed staff data.
         (str): The key for the processed data in the s3 bucket.
     """
 
-    key = get_object_key(table_name="staff", prefix=prefix, bucket=bucket)
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    staff_json = obj["Body"].read().decode("utf-8")
-    staff_list = json.loads(staff_json)
+    staff_list = read_table_records(
+        "staff", bucket=bucket, prefix=prefix, records=records
+    )
     df = pd.DataFrame(staff_list)
     return_df = remove_created_at_and_last_updated(df)
     key = f"dimension/staff-{current_time}.parquet"
     return return_df, key
 
 
+def get_writer_profile(key):
+    """Works out the parquet writer options of the table of a processed key,
+    its PARQUET_WRITER_PROFILES entry over DEFAULT_PARQUET_WRITER_PROFILE.
+    Parameters:
+        key(str): The key of the processed object, e.g. dimension/staff-2024-05-24 14:35:22.parquet.
+    Returns:
+        (dict): The writer options.
+    """
+    match = TABLE_NAME_PATTERN.match(key.rpartition("/")[2])
+    table_profile = PARQUET_WRITER_PROFILES.get(match.group(1), {}) if match else {}
+    return {**DEFAULT_PARQUET_WRITER_PROFILE, **table_profile}
+
+
+def write_parquet(table, sink, profile):
+    """Writes a pyarrow table as parquet with the options of a writer profile,
+    the dictionary and sorting columns missing from the table are left out.
+    Parameters:
+        table(pyarrow.Table): The table to write.
+        sink(file): The writable file the parquet is written to, one row group at a time.
+        profile(dict): The writer options from get_writer_profile().
+    Returns:
+        None.
+    """
+    sorting_columns = None
+    if profile["sort_by"] in table.column_names:
+        table = table.sort_by(profile["sort_by"])
+        sorting_columns = [
+            pq.SortingColumn(table.column_names.index(profile["sort_by"]))
+        ]
+    pq.write_table(
+        table,
+        sink,
+        row_group_size=profile["row_group_size"],
+        compression=profile["compression"],
+        compression_level=profile["compression_level"],
+        use_dictionary=[
+            column
+            for column in profile["dictionary_columns"]
+            if column in table.column_names
+        ],
+        write_statistics=profile["statistics"],
+        sorting_columns=sorting_columns,
+    )
+
+
+class S3MultipartWriter(RawIOBase):
+    """Writable file that uploads what is written to it as the parts of an s3
+    multipart upload, holding at most about part_size bytes in memory.
+    An object smaller than one part is uploaded with a single put_object instead.
+    Used as a context manager the upload is completed on exit,
+    or aborted if an exception was raised, so no incomplete parts are left behind.
+    Parameters:
+        s3(boto3.client): The boto3 client to interact with s3.
+        bucket(str): The name of the s3 bucket to upload to.
+        key(str): The key of the object.
+        part_size(int): The bytes buffered before a part is sent, the default value is MULTIPART_PART_SIZE.
+    """
+
+    def __init__(self, s3, bucket, key, part_size=MULTIPART_PART_SIZE):
+        super().__init__()
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.position = 0
+        self.upload_id = None
+        self.parts = []
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        if len(self.buffer) >= self.part_size:
+            self.upload_part()
+        return len(data)
+
+    def upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key
+            )["UploadId"]
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=self.buffer,
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.buffer = bytearray()
+
+    def complete(self):
+        """Uploads what is left and completes the upload, or puts a small object."""
+        if self.upload_id is None:
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=self.buffer)
+        else:
+            if self.buffer:
+                self.upload_part()
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={"Parts": self.parts},
+            )
+        self.buffer = bytearray()
+        super().close()
+
+    def abort(self):
+        """Aborts the upload, so s3 drops the parts already sent."""
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+            )
+            logger.error(f"Aborted the upload of {self.key}")
+        self.buffer = bytearray()
+        super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+            return False
+        try:
+            self.complete()
+        except Exception:
+            self.abort()
+            raise
+        return False
+
+
+def upload_parquet(s3, table, key, bucket=PROCESSED_S3_BUCKET_NAME):
+    """Streams a pyarrow table as parquet, written with the writer profile of its
+    table, into s3 through an S3MultipartWriter.
+    Parameters:
+        s3(boto3.client): The boto3 client to interact with s3.
+        table(pyarrow.Table): The table to upload.
+        key(str): The s3 path to store the parquet file into s3 bucket.
+        bucket(str): The name of the s3 bucket, the default value is PROCESSED_S3_BUCKET_NAME.
+    Returns:
+        None.
+    """
+    with S3MultipartWriter(s3, bucket, key) as sink:
+        write_parquet(table, sink, get_writer_profile(key))
+
+
 def convert_to_parquet_put_in_s3(s3, df, key, bucket=PROCESSED_S3_BUCKET_NAME):
-    """Converts a DataFrame into parquet and uploads it into s3 bucket by specified key .
+    """Converts a DataFrame into parquet with the writer profile of its table
+    and streams it into s3 bucket by specified key with upload_parquet().
     Parameters:
         s3(boto3.client): The boto3 client to interact with s3.
         df(pandas.DataFrame): The DataFrame  to convert into parquet.
@@ -415,61 +829,455 @@ def convert_to_parquet_put_in_s3(s3, df, key, bucket=PROCESSED_S3_BUCKET_NAME):
     Returns:
         None.
     """
-    out_buffer = BytesIO()
-    df.to_parquet(out_buffer, index=False)
-    s3.put_object(Bucket=bucket, Key=key, Body=out_buffer.getvalue())
+    upload_parquet(
+        s3, pa.Table.from_pandas(df, preserve_index=False), key, bucket=bucket
+    )
+
+
+def put_processed_table(s3, df, key, bucket=PROCESSED_S3_BUCKET_NAME):
+    """Uploads a processed DataFrame with convert_to_parquet_put_in_s3(),
+    then points the latest pointer of its table at it.
+    Parameters:
+        s3(boto3.client): The boto3 client to interact with s3.
+        df(pandas.DataFrame): The DataFrame to convert into parquet.
+        key(str): The s3 path to store the parquet file into s3 bucket.
+        bucket(str): The name of the s3 bucket to upload the parquet file.
+        The default value is PROCESSED_S3_BUCKET_NAME.
+    Returns:
+        None.
+    """
+    convert_to_parquet_put_in_s3(s3, df, key, bucket=bucket)
+    write_latest_pointer(s3, key, bucket=bucket)
 
 
-def delete_duplicates(bucket=INGESTION_S3_BUCKET_NAME):
-    table_names = get_table_names()
-    list_obj_response = s3.list_objects_v2(Bucket=bucket, Prefix="updated/")
-    if not list_obj_response:
+def get_fact_partition_key(key, partition_date):
+    """Works out the key of the Hive style partition of a processed fact object.
+    Parameters:
+        key(str): The key from the transform, e.g. fact/sales_order-2024-05-24 14:35:22.parquet.
+        partition_date(datetime.date): The created_date of the rows of the partition.
+    Returns:
+        (str): The partitioned key,
+        e.g. fact/sales_order/year=2024/month=05/day=24/sales_order-2024-05-24 14:35:22.parquet.
+    """
+    prefix, _, file_name = key.rpartition("/")
+    table_name = TABLE_NAME_PATTERN.match(file_name).group(1)
+    return (
+        f"{prefix}/{table_name}/year={partition_date.year:04d}"
+        f"/month={partition_date.month:02d}/day={partition_date.day:02d}/{file_name}"
+    )
+
+
+def put_partitioned_fact(s3, df, key, bucket=PROCESSED_S3_BUCKET_NAME):
+    """Splits processed fact rows by FACT_PARTITION_COLUMN and uploads one parquet
+    object per date to its partition, written with the writer profile of the table
+    and with the columns of FACT_SALES_ORDER_SCHEMA
+    given their types there, so every partition has the same schema whatever
+    types pandas would infer from its rows.
+    Parameters:
+        s3(boto3.client): The boto3 client to interact with s3.
+        df(pandas.DataFrame): The DataFrame from process_fact_sales_order().
+        key(str): The key from process_fact_sales_order().
+        bucket(str): The name of the s3 bucket to upload the parquet files.
+        The default value is PROCESSED_S3_BUCKET_NAME.
+    Returns:
+        (list): The keys written, in date order.
+    """
+    schema = pa.schema(
+        [
+            (
+                FACT_SALES_ORDER_SCHEMA.field(field.name)
+                if field.name in FACT_SALES_ORDER_SCHEMA.names
+                else field
+            )
+            for field in pa.Schema.from_pandas(df, preserve_index=False)
+        ]
+    )
+    keys = []
+    for partition_date, partition_df in df.groupby(FACT_PARTITION_COLUMN, sort=True):
+        partition_key = get_fact_partition_key(key, partition_date)
+        upload_parquet(
+            s3,
+            pa.Table.from_pandas(partition_df, schema=schema, preserve_index=False),
+            partition_key,
+            bucket=bucket,
+        )
+        keys.append(partition_key)
+    logger.info(f"{len(df)} fact rows written to {len(keys)} partitions")
+    return keys
+
+
+def read_state_object(table_name, bucket=PROCESSED_S3_BUCKET_NAME):
+    """Reads the current state snapshot of an ingestion table with the ETag it was
+    read at, for put_state_snapshot() to only replace that version.
+    Parameters:
+        table_name(str): The name of the ingestion table.
+        bucket(str): The name of the s3 bucket, the default value is PROCESSED_S3_BUCKET_NAME.
+    Returns:
+        (pyarrow.Table): The latest row of every primary key, None if there is no snapshot yet.
+        (str): The ETag of the snapshot, None if there is no snapshot yet.
+    """
+    try:
+        obj = s3.get_object(
+            Bucket=bucket, Key=f"{STATE_LATEST_PREFIX}{table_name}.parquet"
+        )
+    except ClientError as ex:
+        if ex.response["Error"]["Code"] == "NoSuchKey":
+            return None, None
+        raise
+    return pq.read_table(BytesIO(obj["Body"].read())), obj["ETag"]
+
+
+def read_state_snapshot(table_name, bucket=PROCESSED_S3_BUCKET_NAME):
+    """Reads the current state snapshot of an ingestion table.
+    Parameters:
+        table_name(str): The name of the ingestion table.
+        bucket(str): The name of the s3 bucket, the default value is PROCESSED_S3_BUCKET_NAME.
+    Returns:
+        (pyarrow.Table): The latest row of every primary key, None if there is no snapshot yet.
+    """
+    return read_state_object(table_name, bucket=bucket)[0]
+
+
+def read_baseline_state(
+    table_name, bucket=INGESTION_S3_BUCKET_NAME, max_workers=MAX_DOWNLOAD_WORKERS
+):
+    """Reads the whole table as the ingestion baseline wrote it to baseline/, the
+    state a table starts from before it has a snapshot, as its files in updated/
+    only hold the records changed since.
+    Parameters:
+        table_name(str): The name of the ingestion table, its primary key is <table_name>_id.
+        bucket(str): The name of the s3 bucket, the default value is INGESTION_S3_BUCKET_NAME.
+        max_workers(int): The most objects downloaded at once.
+    Returns:
+        (pyarrow.Table): The last row of every primary key in the baseline,
+        None if the table has no baseline records.
+    """
+    baseline_keys = sorted(
+        list_object_keys(bucket=bucket, prefix=f"baseline/{table_name}-"),
+        key=lambda key: (key_timestamp(key), key),
+    )
+
+    def fetch(key):
+        obj = s3.get_object(Bucket=bucket, Key=key)
+        return json.loads(obj["Body"].read().decode("utf-8"))
+
+    records = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for object_records in executor.map(fetch, baseline_keys):
+            records.extend(object_records)
+    if not records:
+        return None
+    baseline = pa.Table.from_pylist(drop_duplicate_records(table_name, records))
+    primary_key = f"{table_name}_id"
+    if primary_key in baseline.column_names:
+        baseline = keep_last_row_per_key(baseline, primary_key)
+    logger.info(f"{table_name} state seeded with {baseline.num_rows} baseline rows")
+    return baseline
+
+
+def keep_last_row_per_key(table, key_column):
+    """Drops all but the last row of every key in a pyarrow table.
+    Parameters:
+        table(pyarrow.Table): The table.
+        key_column(str): The column of the key.
+    Returns:
+        (pyarrow.Table): The last row of every key, in the order they were given.
+    """
+    keys = table.column(key_column).to_pylist()
+    last_rows = {key: index for index, key in enumerate(keys)}
+    if len(last_rows) == len(keys):
+        return table
+    return table.take(sorted(last_rows.values()))
+
+
+def merge_state_deltas(
+    table_name,
+    records,
+    bucket=PROCESSED_S3_BUCKET_NAME,
+    ingestion_bucket=INGESTION_S3_BUCKET_NAME,
+):
+    """Applies the new records of a run to the current state snapshot of their table:
+    the latest record of every primary key replaces the row of the snapshot with
+    that key, a whole column at a time, so the cost follows the number of new records.
+    A table without a snapshot yet starts from its baseline from read_baseline_state().
+    Parameters:
+        table_name(str): The name of the ingestion table, its primary key is <table_name>_id.
+        records(list): The records of the run, oldest first.
+        bucket(str): The name of the s3 bucket, the default value is PROCESSED_S3_BUCKET_NAME.
+        ingestion_bucket(str): The name of the s3 bucket of the baseline,
+        the default value is INGESTION_S3_BUCKET_NAME.
+    Returns:
+        (pyarrow.Table): The new state of the table.
+        (pyarrow.Table): The rows of the snapshot that were replaced.
+        (str): The ETag of the snapshot the state was merged into, None if there was none.
+        None if the records have no primary key.
+    """
+    primary_key = f"{table_name}_id"
+    delta = pa.Table.from_pylist(records)
+    if primary_key not in delta.column_names:
+        logger.info(f"No {primary_key} in the {table_name} records, no state kept")
+        return None
+    delta = keep_last_row_per_key(delta, primary_key)
+    snapshot, etag = read_state_object(table_name, bucket=bucket)
+    if snapshot is None:
+        snapshot = read_baseline_state(table_name, bucket=ingestion_bucket)
+    if snapshot is None or primary_key not in snapshot.column_names:
+        return delta, delta.schema.empty_table(), etag
+    changed = pc.is_in(
+        snapshot[primary_key],
+        value_set=delta[primary_key]
+        .combine_chunks()
+        .cast(snapshot.schema.field(primary_key).type),
+    )
+    state = pa.concat_tables(
+        [snapshot.filter(pc.invert(changed)), delta], promote_options="permissive"
+    )
+    return state, snapshot.filter(changed), etag
+
+
+def check_state_unchanged(s3, table_name, etag, bucket=PROCESSED_S3_BUCKET_NAME):
+    """Checks with a HEAD that the state snapshot of a table is still the version
+    merge_state_deltas() read, as the pinned botocore cannot send IfMatch or
+    IfNoneMatch with a put. Runs are serialised by the reserved concurrency of the
+    processing lambda, this check catches a writer that still got in between,
+    e.g. a manual invocation, leaving a window of only the upload itself.
+    Parameters:
+        s3(boto3.client): The boto3 client to interact with s3.
+        table_name(str): The name of the ingestion table.
+        etag(str): The ETag from merge_state_deltas(), None if there was no snapshot.
+        bucket(str): The name of the s3 bucket, the default value is PROCESSED_S3_BUCKET_NAME.
+    Returns:
+        None.
+    Errors:
+        ClientError: PreconditionFailed if the snapshot changed since it was read.
+    """
+    try:
+        current_etag = s3.head_object(
+            Bucket=bucket, Key=f"{STATE_LATEST_PREFIX}{table_name}.parquet"
+        )["ETag"]
+    except ClientError as ex:
+        if ex.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        current_etag = None
+    if current_etag != etag:
+        message = f"{table_name} state was written by another run since it was read"
+        logger.error(message)
+        raise ClientError(
+            {"Error": {"Code": "PreconditionFailed", "Message": message}},
+            "PutObject",
+        )
+
+
+def put_state_snapshot(
+    s3, table_name, state, replaced, etag=None, bucket=PROCESSED_S3_BUCKET_NAME
+):
+    """Uploads the new state snapshot of a table over the previous one
+    and the rows it replaced to the history of the table.
+    The snapshot is only written if check_state_unchanged() finds it is still
+    the version the state was merged into, so a run does not overwrite the state
+    written by another run meanwhile.
+    Parameters:
+        s3(boto3.client): The boto3 client to interact with s3.
+        table_name(str): The name of the ingestion table.
+        state(pyarrow.Table): The new state from merge_state_deltas().
+        replaced(pyarrow.Table): The replaced rows from merge_state_deltas().
+        etag(str): The ETag from merge_state_deltas(), default value is None
+        for a table that had no snapshot.
+        bucket(str): The name of the s3 bucket, the default value is PROCESSED_S3_BUCKET_NAME.
+    Returns:
+        None.
+    Errors:
+        ClientError: PreconditionFailed if the snapshot changed since it was read,
+        the files of the run are left in updated/ for the next run.
+    """
+    check_state_unchanged(s3, table_name, etag, bucket=bucket)
+    upload_parquet(
+        s3, state, f"{STATE_LATEST_PREFIX}{table_name}.parquet", bucket=bucket
+    )
+    if replaced.num_rows:
+        upload_parquet(
+            s3,
+            replaced,
+            f"{STATE_HISTORY_PREFIX}{table_name}-{current_time}.parquet",
+            bucket=bucket,
+        )
+    logger.info(
+        f"{table_name} state has {state.num_rows} rows, {replaced.num_rows} replaced"
+    )
+
+
+def with_lookup_state(
+    table_name,
+    records,
+    state,
+    bucket=PROCESSED_S3_BUCKET_NAME,
+    ingestion_bucket=INGESTION_S3_BUCKET_NAME,
+):
+    """Gives the transform of a table the records of the run with the tables it
+    looks rows up in replaced by their whole current state, from the state merged
+    by the run, else from their snapshot, else from their baseline.
+    Tables without any keep the records of the run.
+    Parameters:
+        table_name(str): The name of the updated table whose transform runs.
+        records(dict): The records of the run from fetch_run_records().
+        state(dict): The new state and replaced rows of each table from merge_state_deltas().
+        bucket(str): The name of the s3 bucket, the default value is PROCESSED_S3_BUCKET_NAME.
+        ingestion_bucket(str): The name of the s3 bucket of the baseline,
+        the default value is INGESTION_S3_BUCKET_NAME.
+    Returns:
+        (dict): The records for the transform.
+    """
+    transform_records = dict(records)
+    for lookup_table in TRANSFORM_LOOKUP_TABLES.get(table_name, []):
+        if lookup_table in state:
+            snapshot = state[lookup_table][0]
+        else:
+            snapshot = read_state_snapshot(lookup_table, bucket=bucket)
+        if snapshot is None:
+            snapshot = read_baseline_state(lookup_table, bucket=ingestion_bucket)
+        if snapshot is not None:
+            transform_records[lookup_table] = snapshot.to_pylist()
+    return transform_records
+
+
+def object_digest(summary, bucket=INGESTION_S3_BUCKET_NAME):
+    """Works out the digest of the contents of an object from its listing entry.
+    The ETag of a single part upload is the MD5 of its body, a multipart ETag
+    ends in -<parts> and is not, so for those the sha256 ingestion records in the
+    object metadata is read with a HEAD request instead.
+    Parameters:
+        summary(dict): The Contents entry of the object from list_object_summaries().
+        bucket(str): The name of the s3 bucket, the default value is INGESTION_S3_BUCKET_NAME.
+    Returns:
+        (str): The digest, e.g. md5:<etag>, None if the object has no digest to compare.
+    """
+    etag = summary["ETag"].strip('"')
+    if "-" not in etag:
+        return f"md5:{etag}"
+    metadata = s3.head_object(Bucket=bucket, Key=summary["Key"])["Metadata"]
+    if "sha256" in metadata:
+        return f"sha256:{metadata['sha256']}"
+    return None
+
+
+def delete_duplicates(
+    bucket=INGESTION_S3_BUCKET_NAME, prefix="updated/", summaries=None
+):
+    """Deletes the ingestion objects whose contents are the same as a newer object,
+    comparing the digests from object_digest() so no object is downloaded.
+    Objects with no rows are never duplicates.
+    Parameters:
+        bucket(str): The name of the s3 bucket, the default value is INGESTION_S3_BUCKET_NAME.
+        prefix(str): The prefix path of the objects, the default value is updated/.
+        summaries(list): The objects to compare from get_object_summaries(),
+        every object under the prefix is listed if None.
+    Returns:
+        (list): The keys left, in the order they were listed.
+    """
+    if summaries is None:
+        summaries = list_object_summaries(bucket=bucket, prefix=prefix)
+    if not summaries:
         logger.info("no files found")
-    else:
-        dict_list = list_obj_response["Contents"]
-        dict_list_len = len(dict_list)
-        keys_to_be_deleted = []
-        sizes_and_date_dict = {}
-        for table in table_names:
-            sizes_and_date_dict = {}
-            for i in range(dict_list_len - 1, -1, -1):
-                key = dict_list[i]["Key"]
-                response = s3.get_object(Bucket=bucket, Key=key)
-                response_json = response["Body"].read().decode("utf-8")
-                response_list = json.loads(response_json)
-                if response_list:
-                    last_updated_date = response_list[-1]["last_updated"]
-                    if dict_list[i]["Key"][8 : 8 + len(table[0])] == table[0]:
-                        if dict_list[i]["Size"] not in sizes_and_date_dict:
-                            sizes_and_date_dict[dict_list[i]["Size"]] = [
-                                last_updated_date
-                            ]
-                        elif dict_list[i]["Size"] in sizes_and_date_dict:
-                            if (
-                                last_updated_date
-                                not in sizes_and_date_dict[dict_list[i]["Size"]]
-                            ):
-                                sizes_and_date_dict[dict_list[i]["Size"]].append(
-                                    last_updated_date
-                                )
-                            else:
-                                keys_to_be_deleted.append(key)
-        for obj_key in keys_to_be_deleted:
-            s3.delete_object(Bucket=bucket, Key=obj_key)
-
-
-def move_processed_ingestion_data(s3, bucket=INGESTION_S3_BUCKET_NAME):
+        return []
+    seen_digests = set()
+    keys_to_be_deleted = set()
+    for summary in sorted(
+        summaries, key=lambda summary: key_timestamp(summary["Key"]), reverse=True
+    ):
+        if summary["Size"] <= EMPTY_OBJECT_SIZE:
+            continue
+        digest = object_digest(summary, bucket=bucket)
+        if digest is None:
+            continue
+        if digest in seen_digests:
+            keys_to_be_deleted.add(summary["Key"])
+        else:
+            seen_digests.add(digest)
+    if keys_to_be_deleted:
+        delete_object_keys(s3, keys_to_be_deleted, bucket=bucket)
+    logger.info(f"{len(keys_to_be_deleted)} duplicate files deleted")
+    return [
+        summary["Key"]
+        for summary in summaries
+        if summary["Key"] not in keys_to_be_deleted
+    ]
+
+
+def log_throughput(action, count, seconds):
+    """Logs how many objects an s3 bulk operation handled and how fast."""
+    rate = count / seconds if seconds else 0
+    logger.info(f"{action} {count} objects in {seconds:.2f}s ({rate:.0f} objects/s)")
+
+
+def delete_object_keys(s3, keys, bucket=INGESTION_S3_BUCKET_NAME):
+    """Deletes objects with one delete_objects request per DELETE_OBJECTS_BATCH_SIZE
+    keys instead of one request per key, logs any key s3 failed to delete.
+    Parameters:
+        s3(boto3.client): The boto3 client to interact with s3.
+        keys(list): The keys of the objects to delete.
+        bucket(str): The name of the s3 bucket, the default value is INGESTION_S3_BUCKET_NAME.
+    Returns:
+        (int): The number of objects deleted.
+    """
+    keys = list(keys)
+    started = perf_counter()
+    deleted = 0
+    for start in range(0, len(keys), DELETE_OBJECTS_BATCH_SIZE):
+        batch = keys[start : start + DELETE_OBJECTS_BATCH_SIZE]
+        response = s3.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+        )
+        errors = response.get("Errors", [])
+        for error in errors:
+            logger.error(f"Error deleting {error['Key']}: {error['Message']}")
+        deleted += len(batch) - len(errors)
+    log_throughput("Deleted", deleted, perf_counter() - started)
+    return deleted
+
+
+def copy_object_keys(
+    s3, key_pairs, bucket=INGESTION_S3_BUCKET_NAME, max_workers=MAX_COPY_WORKERS
+):
+    """Copies objects within a bucket server side, at most max_workers at a time.
+    Parameters:
+        s3(boto3.client): The boto3 client to interact with s3.
+        key_pairs(list): The (source key, destination key) of each object to copy.
+        bucket(str): The name of the s3 bucket, the default value is INGESTION_S3_BUCKET_NAME.
+        max_workers(int): The most copies made at once.
+    Returns:
+        (int): The number of objects copied.
+    Errors:
+        ClientError: The error of the first failed copy, after the other copies finish.
+    """
+    key_pairs = list(key_pairs)
+    started = perf_counter()
+
+    def copy(key_pair):
+        source_key, new_key = key_pair
+        s3.copy_object(
+            Bucket=bucket,
+            CopySource={"Bucket": bucket, "Key": source_key},
+            Key=new_key,
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(copy, key_pairs))
+    log_throughput("Copied", len(key_pairs), perf_counter() - started)
+    return len(key_pairs)
+
+
+def move_processed_ingestion_data(s3, bucket=INGESTION_S3_BUCKET_NAME, keys=None):
     try:
-        list_of_files = s3.list_objects_v2(Bucket=bucket, Prefix="updated")
-        number_of_files = list_of_files["KeyCount"]
-        if number_of_files > 0:
-            for i in range(number_of_files):
-                file = list_of_files["Contents"][i]["Key"]
-                s3.copy_object(
-                    Bucket=bucket,
-                    CopySource={"Bucket": bucket, "Key": file},
-                    Key=f"processed_updated/{file[8:]}",
-                )
+        files = keys
+        if files is None:
+            files = list_object_keys(bucket=bucket, prefix="updated/")
+        if files:
+            copy_object_keys(
+                s3,
+                [(file, f"processed_updated/{file[8:]}") for file in files],
+                bucket=bucket,
+            )
         else:
             logger.info("No files were found in updated")
 
@@ -479,14 +1287,16 @@ def move_processed_ingestion_data(s3, bucket=INGESTION_S3_BUCKET_NAME):
             raise
 
 
-def delete_files_from_updated_after_handling(s3, bucket_name=INGESTION_S3_BUCKET_NAME):
+def delete_files_from_updated_after_handling(
+    s3, bucket_name=INGESTION_S3_BUCKET_NAME, keys=None
+):
     try:
-        response = s3.list_objects_v2(Bucket=bucket_name, Prefix="updated/")
-        if "Contents" in response:
-            for obj in response["Contents"]:
-                file_path = obj["Key"]
-                s3.delete_object(Bucket=bucket_name, Key=file_path)
-            logger.info(f"moved {response['KeyCount']} files")
+        files = keys
+        if files is None:
+            files = list_object_keys(bucket=bucket_name, prefix="updated/")
+        if files:
+            delete_object_keys(s3, files, bucket=bucket_name)
+            logger.info(f"moved {len(files)} files")
         else:
             logger.info("No files to be moved")
     except ClientError as ex:
@@ -496,105 +1306,202 @@ def delete_files_from_updated_after_handling(s3, bucket_name=INGESTION_S3_BUCKET
 
 
 def archive_processed_data(bucket_name=PROCESSED_S3_BUCKET_NAME):
-    response = s3.list_objects_v2(Bucket=bucket_name)
-    items_to_archive_list = []
-    for item in response["Contents"]:
-        items_to_archive_list.append(item["Key"])
-    for item_key in items_to_archive_list:
-        new_key = f"archived/{item_key}"
-        s3.copy_object(
-            Bucket=bucket_name, CopySource=f"/{bucket_name}/{item_key}", Key=new_key
-        )
-    for item_key in items_to_archive_list:
-        s3.delete_object(Bucket=bucket_name, Key=item_key)
+    items_to_archive_list = list_object_keys(bucket=bucket_name)
+    copy_object_keys(
+        s3,
+        [(item_key, f"archived/{item_key}") for item_key in items_to_archive_list],
+        bucket=bucket_name,
+    )
+    delete_object_keys(s3, items_to_archive_list, bucket=bucket_name)
 
 
-def lambda_handler(event, context, bucket_name=INGESTION_S3_BUCKET_NAME):
-    response = s3.list_objects_v2(Bucket=bucket_name, Prefix="updated/")
+def process_sales_order_run(records, source_keys=None):
+    """Processes the sales_order records of a run into fact_sales_order,
+    puts it in s3 partitioned by date, then processes and puts dim_date from it.
+    Parameters:
+        records(dict): The records of the run from fetch_run_records().
+        source_keys(list): The keys of the new sales_order files of the run.
+    Returns:
+        None.
+    """
+    df, key = process_fact_sales_order(
+        bucket=INGESTION_S3_BUCKET_NAME,
+        prefix="updated/",
+        records=records,
+        source_keys=source_keys,
+    )
+    put_partitioned_fact(s3, df, key, bucket=PROCESSED_S3_BUCKET_NAME)
+    logger.info("sales_order data processed")
+    df, key = process_dim_date(fact_sales_order_df=df)
+    put_processed_table(s3, df, key, bucket=PROCESSED_S3_BUCKET_NAME)
+    logger.info("date data processed")
 
-    if response["KeyCount"] == 0:
 
-        logger.info("No new updated data to process")
-    if response["KeyCount"] >= 1:
+def process_dimension_run(transform, dimension_name, records, source_keys=None):
+    """Processes the records of a run with a dimension transform and puts the result in s3.
+    Dimension files are merged on their natural key, so a retry writing them again
+    under a new key loads nothing twice and they keep the time of the run in their key.
+    Parameters:
+        transform(function): The process_dim_* function of the dimension.
+        dimension_name(str): The name of the dimension logged once it is processed.
+        records(dict): The records of the run from fetch_run_records().
+        source_keys(list): The keys of the new files of the table, unused.
+    Returns:
+        None.
+    """
+    df, key = transform(
+        bucket=INGESTION_S3_BUCKET_NAME, prefix="updated/", records=records
+    )
+    put_processed_table(s3, df, key, bucket=PROCESSED_S3_BUCKET_NAME)
+    logger.info(f"{dimension_name} data processed")
+
+
+# transform run once for each table with new files, by the exact table name in the key
+TABLE_TRANSFORMS = {
+    "sales_order": process_sales_order_run,
+    "counterparty": partial(
+        process_dimension_run, process_dim_counterparty, "counterparty"
+    ),
+    "currency": partial(process_dimension_run, process_dim_currency, "currency"),
+    "design": partial(process_dimension_run, process_dim_design, "design"),
+    "address": partial(process_dimension_run, process_dim_location, "location"),
+    "staff": partial(process_dimension_run, process_dim_staff, "staff"),
+}
+
+
+def get_event_keys(event):
+    """Reads the object keys of an S3 event notification, delivered to the lambda
+    directly or in the bodies of the messages of an SQS event.
+    Parameters:
+        event(dict): The event the lambda was invoked with.
+    Returns:
+        (list): The keys in the order they were notified, without repeats,
+        None if the event is not an S3 or SQS event, e.g. from the schedule.
+    """
+    records = event.get("Records") if isinstance(event, dict) else None
+    if not records:
+        return None
+    keys = []
+    for record in records:
+        if record.get("eventSource") == "aws:sqs":
+            keys.extend(get_event_keys(json.loads(record["body"])) or [])
+        elif record.get("eventSource") == "aws:s3":
+            keys.append(unquote_plus(record["s3"]["object"]["key"]))
+    return list(dict.fromkeys(keys))
+
+
+def get_object_summaries(keys, bucket=INGESTION_S3_BUCKET_NAME):
+    """Reads the Key, Size and ETag of each object with a HEAD request, in the form
+    list_object_summaries() returns them. Objects already moved away by an
+    earlier processing run are left out.
+    Parameters:
+        keys(list): The object keys.
+        bucket(str): The name of the s3 bucket, the default value is INGESTION_S3_BUCKET_NAME.
+    Returns:
+        (list): The summaries of the objects that still exist, in the order of the keys.
+    """
+    summaries = []
+    for key in keys:
         try:
+            response = s3.head_object(Bucket=bucket, Key=key)
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                logger.info(f"{key} was already processed")
+                continue
+            raise
+        summaries.append(
+            {"Key": key, "Size": response["ContentLength"], "ETag": response["ETag"]}
+        )
+    return summaries
+
+
+def process_updated_keys(updated_keys):
+    """Merges the new records of the run into the state snapshot of their tables,
+    runs the TABLE_TRANSFORMS transform of every table with new files once over
+    all of them, then puts the snapshots and moves the files to processed_updated/
+    once every transform ran, so a failed run leaves both for the next one.
+    Parameters:
+        updated_keys(list): The keys of the new files in updated/ of the ingestion bucket.
+    Returns:
+        None.
+    """
+    keys_by_table = group_keys_by_table(updated_keys)
+    records = fetch_run_records(keys_by_table, bucket=INGESTION_S3_BUCKET_NAME)
+    state = {}
+    for table_name, table_records in records.items():
+        if table_records:
+            merged = merge_state_deltas(table_name, table_records)
+            if merged is not None:
+                state[table_name] = merged
+    for table_name in keys_by_table:
+        transform = TABLE_TRANSFORMS.get(table_name)
+        if transform is None:
+            logger.info(f"No transform for {table_name}, its files are skipped")
+            continue
+        transform(
+            with_lookup_state(table_name, records, state), keys_by_table[table_name]
+        )
+    for table_name, (table_state, replaced, etag) in state.items():
+        put_state_snapshot(s3, table_name, table_state, replaced, etag=etag)
+    move_processed_ingestion_data(
+        s3, bucket=INGESTION_S3_BUCKET_NAME, keys=updated_keys
+    )
+    delete_files_from_updated_after_handling(
+        s3, bucket_name=INGESTION_S3_BUCKET_NAME, keys=updated_keys
+    )
 
-            delete_duplicates()
-            logger.info("The delete function ran successfully")
-            list_of_files = s3.list_objects_v2(Bucket=bucket_name, Prefix="updated")
-
-            number_of_files = list_of_files["KeyCount"]
-            for i in range(number_of_files):
-                key_name = list_of_files["Contents"][i]["Key"][8:]
-                pattern = re.compile(r"^[A-Za-z]+")
-                match = pattern.findall(key_name)
-
-                if match == ["sales"]:
-                    df, key = process_fact_sales_order(
-                        bucket=INGESTION_S3_BUCKET_NAME, prefix="updated/"
-                    )
-                    convert_to_parquet_put_in_s3(
-                        s3, df, key, bucket=PROCESSED_S3_BUCKET_NAME
-                    )
-                    logger.info("sales_order data processed")
-                if match == ["counterparty"]:
-                    df, key = process_dim_counterparty(
-                        bucket=INGESTION_S3_BUCKET_NAME, prefix="updated/"
-                    )
-                    convert_to_parquet_put_in_s3(
-                        s3, df, key, bucket=PROCESSED_S3_BUCKET_NAME
-                    )
-                    logger.info("counterparty data processed")
-                if match == ["currency"]:
-
-                    df, key = process_dim_currency(
-                        bucket=INGESTION_S3_BUCKET_NAME, prefix="updated/"
-                    )
-                    convert_to_parquet_put_in_s3(
-                        s3, df, key, bucket=PROCESSED_S3_BUCKET_NAME
-                    )
-                    logger.info("currency data processed")
-                if match == ["date"]:
-                    df, key = process_dim_date(
-                        bucket=INGESTION_S3_BUCKET_NAME, prefix="updated/"
-                    )
-                    convert_to_parquet_put_in_s3(
-                        s3, df, key, bucket=PROCESSED_S3_BUCKET_NAME
-                    )
-                    logger.info("date data processed")
-                if match == ["design"]:
-                    print("a match for design")
-                    df, key = process_dim_design(
-                        bucket=INGESTION_S3_BUCKET_NAME, prefix="updated/"
-                    )
-                    convert_to_parquet_put_in_s3(
-                        s3, df, key, bucket=PROCESSED_S3_BUCKET_NAME
-                    )
-                    logger.info("design data processed")
-                if match == ["location"]:
-                    df, key = process_dim_location(
-                        bucket=INGESTION_S3_BUCKET_NAME, prefix="updated/"
-                    )
-                    convert_to_parquet_put_in_s3(
-                        s3, df, key, bucket=PROCESSED_S3_BUCKET_NAME
-                    )
-                    logger.info("location data processed")
-                if match == ["staff"]:
-                    df, key = process_dim_staff(
-                        bucket=INGESTION_S3_BUCKET_NAME, prefix="updated/"
-                    )
-                    convert_to_parquet_put_in_s3(
-                        s3, df, key, bucket=PROCESSED_S3_BUCKET_NAME
-                    )
-                    logger.info("staff data processed")
-                move_processed_ingestion_data(s3, bucket=INGESTION_S3_BUCKET_NAME)
-                delete_files_from_updated_after_handling(
-                    s3, bucket_name=INGESTION_S3_BUCKET_NAME
-                )
-        except Exception as e:
-
-            logger.error(f"Error in Lambda execution: {e}")
+
+def lambda_handler(event, context, bucket_name=INGESTION_S3_BUCKET_NAME):
+    """Processes new files in updated/ of the ingestion bucket. Invoked with the
+    S3 object created notifications of a micro-batch from the processing queue,
+    exactly the notified files are processed. Invoked by the fallback schedule,
+    every file left in updated/ is. The duplicate files are deleted first, then
+    the files are processed by process_updated_keys().
+    Runs must not overlap: each run expects every earlier run to have finished,
+    so the files of a table are processed oldest first and the state snapshots
+    are replaced in order. The function is deployed with a reserved concurrency
+    of 1 for this.
+    Parameters:
+        event: The trigger of the invocation of the lambda, an SQS event or the schedule.
+        context: Information about the invocation, function and execution environment.
+        bucket_name(str): The name of the ingestion s3 bucket.
+    Returns:
+        None.
+    Errors:
+        An error processing the files of an SQS event is logged and raised again, so
+        the queue redelivers the batch. The files of a scheduled run are left in
+        updated/ for the next run.
+    """
+    global current_time
+    current_time = datetime.now()
+    event_keys = get_event_keys(event)
+    if event_keys is not None:
+        summaries = get_object_summaries(
+            [key for key in event_keys if key.startswith("updated/")],
+            bucket=INGESTION_S3_BUCKET_NAME,
+        )
+        if not summaries:
+            logger.info("No files to be processed")
+            return
+        logger.info(f"Processing {len(summaries)} notified files")
     else:
-        logger.info("No files to be processed")
+        response = s3.list_objects_v2(Bucket=bucket_name, Prefix="updated/")
+        if response["KeyCount"] == 0:
+            logger.info("No new updated data to process")
+            logger.info("No files to be processed")
+            return
+        summaries = None
+    try:
+        updated_keys = delete_duplicates(
+            bucket=INGESTION_S3_BUCKET_NAME, summaries=summaries
+        )
+        logger.info("The delete function ran successfully")
+        process_updated_keys(updated_keys)
+    except Exception as e:
+
+        logger.error(f"Error in Lambda execution: {e}")
+        if event_keys is not None:
+            raise
 
 
 # if __name__ == "__main__":
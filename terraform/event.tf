@@ -5,10 +5,11 @@ resource "aws_cloudwatch_event_rule" "scheduler" {
 }
 
 
+# fallback for files the processing queue did not deliver or a failed run left in updated/
 resource "aws_cloudwatch_event_rule" "processing_scheduler" {
     name = "processing_scheduler"
-    description = "run processing lambda function every 7 minutes"
-    schedule_expression = "rate(7 minutes)"
+    description = "run processing lambda function every 30 minutes on any files left in updated/"
+    schedule_expression = "rate(30 minutes)"
 }
 
 resource "aws_cloudwatch_event_target" "check_every_five_minutes" {
@@ -17,7 +18,7 @@ resource "aws_cloudwatch_event_target" "check_every_five_minutes" {
     arn = aws_lambda_function.ingestion_function.arn
 }
 
-resource "aws_cloudwatch_event_target" "trigger_on_seven" {
+resource "aws_cloudwatch_event_target" "trigger_on_thirty" {
     rule = aws_cloudwatch_event_rule.processing_scheduler.name
     target_id = "${var.processing_function_name}"
     arn = aws_lambda_function.processing_function.arn
@@ -14,6 +14,16 @@ resource "aws_lambda_function" "processing_function" {
 ]
 
     runtime = "python3.11"
+    # the processing_queue visibility timeout is sized from it
+    timeout = var.processing_timeout_seconds
+
+    # one invocation at a time: the queue micro-batches and the fallback schedule would
+    # otherwise process overlapping files at once, and each run assumes it sees the files
+    # of a table oldest first after every earlier run finished, both for the delta files
+    # it writes and the state/latest/ snapshots it reads and replaces.
+    # invocations over the limit are throttled and retried, the queue redelivers its
+    # messages once their visibility timeout passes
+    reserved_concurrent_executions = 1
   }
 
 data "archive_file" "processing_lambda" {
@@ -29,9 +39,4 @@ resource "aws_lambda_permission" "allow_eventbridge_processing" {
   principal = "events.amazonaws.com"
   source_arn = aws_cloudwatch_event_rule.processing_scheduler.arn
   source_account = data.aws_caller_identity.current.account_id
-}
-
-resource "aws_iam_role_policy_attachment" "secret_manager_policy_attachment_processing" {
-  role       = aws_iam_role.processing_function_role.name
-  policy_arn = aws_iam_policy.secret_manager_policy.arn
 }
\ No newline at end of file
@@ -18,7 +18,7 @@ data "aws_iam_policy_document" "trust_policy_processing_lambda" {
 
 data "aws_iam_policy_document" "s3_processed_policy_document" {
     statement {
-        actions = ["s3:GetObject", "s3:ListBucket", "s3:DeleteObject","s3:PutObject","s3:GetObjectTagging","s3:PutObjectTagging","s3:PutObjectAcl"]
+        actions = ["s3:GetObject", "s3:ListBucket", "s3:DeleteObject","s3:PutObject","s3:GetObjectTagging","s3:PutObjectTagging","s3:PutObjectAcl","s3:AbortMultipartUpload"]
         resources = [
             "${aws_s3_bucket.processed_s3_bucket.arn}/*",
             "${aws_s3_bucket.processed_s3_bucket.arn}",
@@ -39,6 +39,25 @@ resource "aws_iam_role_policy_attachment" "attach_s3_processed_policy" {
     policy_arn = aws_iam_policy.s3_processed_policy.arn
 }
 
+# Processing lambda SQS permissions, to receive the S3 notifications of the processing queue
+
+data "aws_iam_policy_document" "sqs_processing_document" {
+    statement {
+        actions = ["sqs:ReceiveMessage", "sqs:DeleteMessage", "sqs:GetQueueAttributes"]
+        resources = [aws_sqs_queue.processing_queue.arn]
+    }
+}
+
+resource "aws_iam_policy" "sqs_processing_policy" {
+    name_prefix = "sqs-policy-${var.processing_function_name}"
+    policy = data.aws_iam_policy_document.sqs_processing_document.json
+}
+
+resource "aws_iam_role_policy_attachment" "attach_sqs_processing_policy" {
+    role = aws_iam_role.processing_function_role.name
+    policy_arn = aws_iam_policy.sqs_processing_policy.arn
+}
+
 # Processing lambda Cloudwatch permissions
 
 data "aws_iam_policy_document" "cw_processing_document" {
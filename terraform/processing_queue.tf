@@ -0,0 +1,54 @@
+# S3 object created notifications of the updated/ ingestion files, queued for the processing lambda
+
+resource "aws_sqs_queue" "processing_queue" {
+    name = "${var.processing_queue_name}"
+    # as long as the processing lambda can run plus the batching window, so a batch is not
+    # redelivered while it is processed, but one throttled by the reserved concurrency comes
+    # back for a retry soon after
+    visibility_timeout_seconds = aws_lambda_function.processing_function.timeout + var.processing_batching_window_seconds
+    message_retention_seconds = 86400
+}
+
+data "aws_iam_policy_document" "processing_queue_policy_document" {
+    statement {
+        effect = "Allow"
+        principals {
+            type = "Service"
+            identifiers = ["s3.amazonaws.com"]
+        }
+        actions = ["sqs:SendMessage"]
+        resources = [aws_sqs_queue.processing_queue.arn]
+        condition {
+            test = "ArnEquals"
+            variable = "aws:SourceArn"
+            values = [aws_s3_bucket.ingestion_s3_bucket.arn]
+        }
+    }
+}
+
+resource "aws_sqs_queue_policy" "processing_queue_policy" {
+    queue_url = aws_sqs_queue.processing_queue.id
+    policy = data.aws_iam_policy_document.processing_queue_policy_document.json
+}
+
+resource "aws_s3_bucket_notification" "ingestion_updated_notification" {
+    bucket = aws_s3_bucket.ingestion_s3_bucket.id
+
+    queue {
+        queue_arn = aws_sqs_queue.processing_queue.arn
+        events = ["s3:ObjectCreated:*"]
+        filter_prefix = "updated/"
+        filter_suffix = ".json"
+    }
+
+    depends_on = [aws_sqs_queue_policy.processing_queue_policy]
+}
+
+# micro-batching: the notifications of an ingestion run are coalesced into one invocation,
+# sent once the batching window passes or the batch is full
+resource "aws_lambda_event_source_mapping" "processing_queue_trigger" {
+    event_source_arn = aws_sqs_queue.processing_queue.arn
+    function_name = aws_lambda_function.processing_function.arn
+    batch_size = 100
+    maximum_batching_window_in_seconds = var.processing_batching_window_seconds
+}
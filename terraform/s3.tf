@@ -40,3 +40,20 @@ resource "aws_lambda_layer_version" "dependancies" {
 resource "aws_s3_bucket" "processed_s3_bucket" {
     bucket = "${var.processed_s3_bucket_name}"
 }
+
+resource "aws_s3_bucket_lifecycle_configuration" "processed-bucket-lifecycle" {
+  bucket = aws_s3_bucket.processed_s3_bucket.bucket
+
+
+  rule {
+    status = "Enabled"
+    id = "abort-incomplete-uploads"
+
+    filter {}
+
+    # parts of multipart uploads the processing lambda could not abort, e.g. on a timeout
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
+}
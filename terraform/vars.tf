@@ -20,6 +20,21 @@ variable "processing_function_name" {
     default = "processing_lambda"
 }
 
+variable "processing_queue_name" {
+    type = string
+    default = "processing_queue"
+}
+
+variable "processing_batching_window_seconds" {
+    type = number
+    default = 30
+}
+
+variable "processing_timeout_seconds" {
+    type = number
+    default = 120
+}
+
 
 
 variable "sns_alert_topic_name" {
@@ -1,25 +1,39 @@
 import unittest
 from unittest import mock
 import pytest
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 from moto import mock_aws
 import os
 import boto3
 from botocore.exceptions import ClientError
 from pg8000 import DatabaseError, InterfaceError
 from datetime import datetime
+import hashlib
 import logging
 import json
+from decimal import Decimal
+import pandas as pd
 from src.ingestion_lambda import (
     connect_to_db,
     get_table_names,
     select_all_tables_for_baseline,
     select_and_write_updated_data,
     delete_empty_s3_files,
+    delete_object_keys,
     retrieve_secret_credentials,
     check_baseline_exists,
     lambda_handler,
-    copy_baseline_to_updated
+    copy_baseline_to_updated,
+    read_watermarks,
+    write_watermarks,
+    WATERMARK_STATE_KEY,
+    stream_table_to_s3,
+    serialise_rows,
+    get_db_connection,
+    close_db_connection,
+    connection_stats,
+    extract_tables_concurrently,
+    close_worker_connections,
 )
 
 LOGGER = logging.getLogger(__name__)
@@ -107,6 +121,51 @@ class TestConnectToDatabase:
         assert "Error connecting to the database: Connection timed out" in caplog.text
 
 
+class TestGetDbConnection:
+    @pytest.fixture(autouse=True)
+    def no_kept_connection(self):
+        close_db_connection()
+        yield
+        close_db_connection()
+
+    @pytest.mark.it("unit test: healthy connection reused without a new handshake")
+    def test_connection_reused(self):
+        with patch("src.ingestion_lambda.connect_to_db") as mock_connect_to_db:
+            handshakes_avoided = connection_stats["handshakes_avoided"]
+            first = get_db_connection()
+            second = get_db_connection()
+        assert first is second
+        mock_connect_to_db.assert_called_once()
+        first.rollback.assert_called_once()
+        assert connection_stats["handshakes_avoided"] == handshakes_avoided + 1
+
+    @pytest.mark.it("unit test: reconnects when the kept connection is broken")
+    def test_reconnects_on_interface_error(self):
+        broken_conn = MagicMock()
+        broken_conn.execute_simple.side_effect = InterfaceError("network error")
+        new_conn = MagicMock()
+        with patch(
+            "src.ingestion_lambda.connect_to_db", side_effect=[broken_conn, new_conn]
+        ):
+            assert get_db_connection() is broken_conn
+            assert get_db_connection() is new_conn
+        broken_conn.close.assert_called_once()
+
+    @pytest.mark.it("unit test: handler keeps the connection open for the next run")
+    def test_handler_keeps_connection(self):
+        with patch("src.ingestion_lambda.connect_to_db") as mock_connect_to_db, patch(
+            "src.ingestion_lambda.check_baseline_exists", return_value=True
+        ), patch("src.ingestion_lambda.get_table_names"), patch(
+            "src.ingestion_lambda.extract_tables_concurrently"
+        ), patch(
+            "src.ingestion_lambda.delete_empty_s3_files"
+        ):
+            lambda_handler({}, DummyContext())
+            lambda_handler({}, DummyContext())
+        mock_connect_to_db.assert_called_once()
+        mock_connect_to_db.return_value.close.assert_not_called()
+
+
 class TestGetTableNames:
     @pytest.mark.it("unit test: check function returns all tables names")
     def test_returns_table_names(self):
@@ -225,6 +284,312 @@ class TestSelectAndWriteUpdatedData:
         assert "No bucket found" in caplog.text
 
 
+def mock_db_with_rows(col_names, rows):
+    """Mock pg8000 connection whose cursor returns the given rows."""
+    cursor = MagicMock()
+    cursor.description = [(col_name,) for col_name in col_names]
+    cursor.fetchall.return_value = rows
+    db = MagicMock()
+    db.cursor.return_value = cursor
+    return db, cursor
+
+
+class TestWatermarks:
+    @pytest.mark.it("unit test: no watermark state gives empty dict")
+    def test_no_state(self, bucket):
+        assert read_watermarks(bucket_name="test_bucket") == {}
+
+    @pytest.mark.it("unit test: watermarks written can be read back")
+    def test_round_trip(self, bucket):
+        watermarks = {"staff": {"last_updated": "2024-05-21T14:40:09.122", "id": 3}}
+        write_watermarks(watermarks, bucket_name="test_bucket")
+        assert read_watermarks(bucket_name="test_bucket") == watermarks
+
+    @pytest.mark.it("unit test: updated data selected after the stored watermark")
+    def test_query_uses_watermark(self, bucket):
+        write_watermarks(
+            {"staff": {"last_updated": "2024-05-21T14:40:09.122000", "id": 3}},
+            bucket_name="test_bucket",
+        )
+        db, cursor = mock_db_with_rows(
+            ["staff_id", "last_updated"],
+            [
+                [5, datetime(2024, 5, 21, 14, 45, 0)],
+                [4, datetime(2024, 5, 21, 14, 45, 0)],
+            ],
+        )
+        select_and_write_updated_data(
+            db=db, name_of_tables=[["staff"]], bucket_name="test_bucket"
+        )
+        query, params = cursor.execute.call_args[0]
+        assert "(last_updated, staff_id)" in query
+        assert params == ("2024-05-21T14:40:09.122000", 3)
+        assert read_watermarks(bucket_name="test_bucket") == {
+            "staff": {"last_updated": "2024-05-21T14:45:00", "id": 5}
+        }
+        response = bucket.list_objects_v2(Bucket="test_bucket", Prefix="updated/")
+        assert response["KeyCount"] == 1
+
+    @pytest.mark.it("unit test: sha256 digest of the file written to its metadata")
+    def test_sha256_metadata_written(self, bucket):
+        db, cursor = mock_db_with_rows(
+            ["staff_id", "last_updated"], [[5, datetime(2024, 5, 21, 14, 45, 0)]]
+        )
+        select_and_write_updated_data(
+            db=db, name_of_tables=[["staff"]], bucket_name="test_bucket"
+        )
+        response = bucket.list_objects_v2(Bucket="test_bucket", Prefix="updated/")
+        obj = bucket.get_object(
+            Bucket="test_bucket", Key=response["Contents"][0]["Key"]
+        )
+        assert (
+            obj["Metadata"]["sha256"] == hashlib.sha256(obj["Body"].read()).hexdigest()
+        )
+
+    @pytest.mark.it("unit test: watermark unchanged when there is no new data")
+    def test_no_new_data(self, bucket):
+        watermarks = {"staff": {"last_updated": "2024-05-21T14:40:09.122000", "id": 3}}
+        write_watermarks(watermarks, bucket_name="test_bucket")
+        db, cursor = mock_db_with_rows(["staff_id", "last_updated"], [])
+        select_and_write_updated_data(
+            db=db, name_of_tables=[["staff"]], bucket_name="test_bucket"
+        )
+        assert read_watermarks(bucket_name="test_bucket") == watermarks
+        response = bucket.list_objects_v2(Bucket="test_bucket", Prefix="updated/")
+        assert response["KeyCount"] == 0
+
+    @pytest.mark.it("unit test: tables without a watermark use the 20 minute window")
+    def test_falls_back_without_watermark(self, bucket):
+        db, cursor = mock_db_with_rows(["staff_id", "last_updated"], [])
+        select_and_write_updated_data(
+            db=db, name_of_tables=[["staff"]], bucket_name="test_bucket"
+        )
+        query = cursor.execute.call_args[0][0]
+        assert "interval '20 minutes'" in query
+
+    @pytest.mark.it("unit test: baseline records a watermark for every table")
+    def test_baseline_sets_watermarks(self, bucket):
+        db, cursor = mock_db_with_rows(
+            ["staff_id", "last_updated"],
+            [
+                [1, datetime(2022, 11, 3, 14, 20, 49)],
+                [2, datetime(2022, 11, 5, 14, 20, 49)],
+            ],
+        )
+        select_all_tables_for_baseline(
+            bucket_name="test_bucket", name_of_tables=[["staff"]], db=db
+        )
+        assert read_watermarks(bucket_name="test_bucket") == {
+            "staff": {"last_updated": "2022-11-05T14:20:49", "id": 2}
+        }
+        state = bucket.get_object(Bucket="test_bucket", Key=WATERMARK_STATE_KEY)
+        assert state["ContentLength"] > 0
+
+
+def connect_to_fake_db():
+    """Mock pg8000 connection returning one row of whichever table is queried."""
+    cursor = MagicMock()
+
+    def execute(query, *args):
+        table_name = query.split()[3]
+        cursor.description = [(f"{table_name}_id",), ("last_updated",)]
+        cursor.fetchall.return_value = [[7, datetime(2024, 5, 21, 14, 45, 0)]]
+
+    cursor.execute.side_effect = execute
+    db = MagicMock()
+    db.cursor.return_value = cursor
+    return db
+
+
+class TestExtractTablesConcurrently:
+    @pytest.fixture(autouse=True)
+    def no_kept_connections(self):
+        close_worker_connections()
+        yield
+        close_worker_connections()
+
+    @pytest.mark.it("unit test: every table written with its own watermark")
+    def test_extracts_every_table(self, bucket):
+        tables = [["staff"], ["design"], ["currency"]]
+        with patch(
+            "src.ingestion_lambda.connect_to_db", side_effect=connect_to_fake_db
+        ):
+            table_seconds = extract_tables_concurrently(
+                tables, bucket_name="test_bucket", max_workers=2
+            )
+        assert set(table_seconds) == {"staff", "design", "currency"}
+        assert read_watermarks(bucket_name="test_bucket") == {
+            table[0]: {"last_updated": "2024-05-21T14:45:00", "id": 7}
+            for table in tables
+        }
+        response = bucket.list_objects_v2(Bucket="test_bucket", Prefix="updated/")
+        assert response["KeyCount"] == 3
+
+    @pytest.mark.it("unit test: connections bounded by max_workers and reused")
+    def test_connections_reused(self, bucket):
+        tables = [[name] for name in ["staff", "design", "currency", "address"]]
+        with patch(
+            "src.ingestion_lambda.connect_to_db", side_effect=connect_to_fake_db
+        ) as mock_connect_to_db:
+            extract_tables_concurrently(
+                tables, bucket_name="test_bucket", max_workers=2
+            )
+            opened = mock_connect_to_db.call_count
+            extract_tables_concurrently(
+                tables, bucket_name="test_bucket", max_workers=2
+            )
+        assert opened <= 2
+        assert mock_connect_to_db.call_count == opened
+
+    @pytest.mark.it("unit test: failed table keeps its watermark, others move on")
+    def test_failed_table(self, bucket):
+        failing_db = connect_to_fake_db()
+        failing_db.cursor.return_value.execute.side_effect = DatabaseError("boom")
+        with patch(
+            "src.ingestion_lambda.connect_to_db",
+            side_effect=[failing_db, connect_to_fake_db()],
+        ):
+            with pytest.raises(DatabaseError):
+                extract_tables_concurrently(
+                    [["staff"], ["design"]], bucket_name="test_bucket", max_workers=1
+                )
+        assert read_watermarks(bucket_name="test_bucket") == {
+            "design": {"last_updated": "2024-05-21T14:45:00", "id": 7}
+        }
+        failing_db.close.assert_called_once()
+
+    @pytest.mark.it(
+        "unit test: warm invocations write their deltas to keys of their own"
+    )
+    def test_warm_invocations_keep_every_delta(self, s3):
+        s3.create_bucket(
+            Bucket="de-team-orchid-totesys-ingestion",
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        with patch(
+            "src.ingestion_lambda.connect_to_db", side_effect=connect_to_fake_db
+        ), patch(
+            "src.ingestion_lambda.get_db_connection", return_value=MagicMock()
+        ), patch(
+            "src.ingestion_lambda.get_table_names", return_value=[["staff"]]
+        ), patch(
+            "src.ingestion_lambda.check_baseline_exists", return_value=True
+        ):
+            lambda_handler({}, DummyContext())
+            lambda_handler({}, DummyContext())
+        response = s3.list_objects_v2(
+            Bucket="de-team-orchid-totesys-ingestion", Prefix="updated/staff-"
+        )
+        assert response["KeyCount"] == 2
+
+
+class TestStreamTableToS3:
+    @pytest.mark.it("unit test: table uploaded in parts of batch_size rows")
+    def test_uploads_parts(self, bucket):
+        db, cursor = mock_db_with_rows(["staff_id", "last_updated"], [])
+        cursor.fetchall.side_effect = [
+            [
+                [1, datetime(2022, 11, 5, 14, 20, 49)],
+                [2, datetime(2022, 11, 3, 14, 20, 49)],
+            ],
+            [[3, datetime(2022, 11, 4, 14, 20, 49)]],
+        ]
+        watermark = stream_table_to_s3(cursor, "staff", "test_bucket", 2)
+        response = bucket.list_objects_v2(Bucket="test_bucket", Prefix="baseline/")
+        keys = [obj["Key"] for obj in response["Contents"]]
+        assert len(keys) == 2
+        assert keys[0].endswith("-part-00000.json")
+        assert keys[1].endswith("-part-00001.json")
+        part = bucket.get_object(Bucket="test_bucket", Key=keys[1])
+        assert [row["staff_id"] for row in json.loads(part["Body"].read())] == [3]
+        assert watermark == {"last_updated": "2022-11-05T14:20:49", "id": 1}
+
+    @pytest.mark.it("unit test: pages after the last primary key of the previous page")
+    def test_keyset_pagination(self, bucket):
+        db, cursor = mock_db_with_rows(["staff_id", "last_updated"], [])
+        cursor.fetchall.side_effect = [
+            [
+                [1, datetime(2022, 11, 3, 14, 20, 49)],
+                [2, datetime(2022, 11, 3, 14, 20, 49)],
+            ],
+            [],
+        ]
+        stream_table_to_s3(cursor, "staff", "test_bucket", 2)
+        first_call, second_call = cursor.execute.call_args_list
+        assert first_call[0][1] == (2,)
+        assert "WHERE staff_id > %s" in second_call[0][0]
+        assert second_call[0][1] == (2, 2)
+        response = bucket.list_objects_v2(Bucket="test_bucket", Prefix="baseline/")
+        assert response["KeyCount"] == 1
+
+    @pytest.mark.it("unit test: empty table uploaded as one empty part")
+    def test_empty_table(self, bucket):
+        db, cursor = mock_db_with_rows(["staff_id", "last_updated"], [])
+        watermark = stream_table_to_s3(cursor, "staff", "test_bucket", 2)
+        response = bucket.list_objects_v2(Bucket="test_bucket", Prefix="baseline/")
+        assert response["KeyCount"] == 1
+        assert watermark is None
+
+    @pytest.mark.it("unit test: baseline paged through in one repeatable read snapshot")
+    def test_baseline_in_one_snapshot(self, bucket):
+        db, cursor = mock_db_with_rows(["staff_id", "last_updated"], [])
+        select_all_tables_for_baseline(
+            bucket_name="test_bucket",
+            name_of_tables=[["staff"], ["design"]],
+            db=db,
+            batch_size=2,
+        )
+        calls = [
+            (name, args[0] if args else None)
+            for name, args, _ in db.mock_calls
+            if name in ("commit", "cursor().execute")
+        ]
+        assert calls[:2] == [
+            ("commit", None),
+            (
+                "cursor().execute",
+                "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY;",
+            ),
+        ]
+        assert [name for name, _ in calls[2:]] == [
+            "cursor().execute",
+            "cursor().execute",
+            "commit",
+        ]
+
+
+class TestSerialiseRows:
+    @pytest.mark.it("unit test: rows serialised to a json array of objects")
+    def test_json_records(self):
+        result = serialise_rows([[1, "Joe"], [2, None]], ["staff_id", "first_name"])
+        assert json.loads(result) == [
+            {"staff_id": 1, "first_name": "Joe"},
+            {"staff_id": 2, "first_name": None},
+        ]
+
+    @pytest.mark.it("unit test: timestamps and dates serialised as epoch millis")
+    def test_epoch_millis(self):
+        result = serialise_rows(
+            [[datetime(2022, 11, 3, 14, 20, 49, 962000), datetime(2024, 1, 2).date()]],
+            ["created_at", "agreed_date"],
+        )
+        assert json.loads(result) == [
+            {"created_at": 1667485249962, "agreed_date": 1704153600000}
+        ]
+
+    @pytest.mark.it("unit test: output matches the previous DataFrame to_json output")
+    def test_matches_dataframe_output(self):
+        col_names = ["sales_order_id", "created_at", "unit_price", "design_id"]
+        rows = [
+            [1, datetime(2022, 11, 3, 14, 20, 49, 962000), Decimal("2.98"), 3],
+            [2, datetime(2023, 1, 1, 0, 0, 0, 1000), Decimal("10.50"), 4],
+        ]
+        expected = json.loads(
+            pd.DataFrame(rows, columns=col_names).to_json(orient="records")
+        )
+        assert json.loads(serialise_rows(rows, col_names)) == expected
+
+
 class TestDeleteEmptyS3Files:
     @pytest.mark.it("unit test: Empty files in s3 deleted")
     def test_deleted_files_in_s3(self, s3):
@@ -244,6 +609,31 @@ class TestDeleteEmptyS3Files:
         response = s3.list_objects_v2(Bucket=test_bucket_name)
         assert response["KeyCount"] == 1
 
+    @pytest.mark.it("unit test: empty files deleted 1000 keys per request")
+    def test_deleted_in_batches(self, bucket):
+        for i in range(1500):
+            bucket.put_object(Bucket="test_bucket", Key=f"updated/staff-{i:04}.json")
+        bucket.put_object(Bucket="test_bucket", Key="updated/staff.json", Body="[{}]")
+        with patch(
+            "src.ingestion_lambda.s3.delete_objects", wraps=bucket.delete_objects
+        ) as mock_delete_objects:
+            delete_empty_s3_files(bucket_name="test_bucket")
+        assert mock_delete_objects.call_count == 2
+        response = bucket.list_objects_v2(Bucket="test_bucket", Prefix="updated/")
+        assert [obj["Key"] for obj in response["Contents"]] == ["updated/staff.json"]
+
+    @pytest.mark.it("unit test: keys s3 fails to delete are logged")
+    def test_delete_errors_logged(self, caplog):
+        errors = [{"Key": "updated/staff.json", "Message": "Access Denied"}]
+        with patch(
+            "src.ingestion_lambda.s3.delete_objects", return_value={"Errors": errors}
+        ):
+            deleted = delete_object_keys(
+                ["updated/staff.json", "updated/design.json"], bucket_name="test_bucket"
+            )
+        assert deleted == 1
+        assert "Error deleting updated/staff.json: Access Denied" in caplog.text
+
     @pytest.mark.it("unit test: NoSuchBucket exception")
     def test_no_bucket_exceptions(self, caplog):
         with pytest.raises(ClientError):
@@ -7,7 +7,7 @@ import os
 import boto3
 from botocore.exceptions import ClientError
 from pg8000 import DatabaseError, InterfaceError
-from datetime import datetime
+from datetime import date, datetime
 import logging
 import json
 import pandas as pd
@@ -19,10 +19,24 @@ from src.loading_lambda import (
     retrieve_secret_credentials,
     get_latest_parquet_file_key,
     read_parquet_from_s3,
+    stream_parquet_from_s3,
+    S3ObjectReader,
     load_dim_tables,
     load_fact_table,
+    list_fact_keys,
+    read_fact_partitions,
     load_to_data_warehouse,
+    iter_csv_batches,
+    merge_into_data_warehouse,
+    merge_dimension_files,
+    keep_last_row_per_key,
+    load_star_schema,
+    close_load_connections,
+    DIMENSION_KEYS,
     lambda_handler,
+    get_dw_connection,
+    close_dw_connection,
+    connection_stats,
 )
 
 
@@ -55,6 +69,14 @@ def secrets_manager_client(aws_credentials):
         yield boto3.client("secretsmanager")
 
 
+@pytest.fixture(autouse=True)
+def no_kept_dw_connection():
+    """Stops the connection kept by get_dw_connection leaking between tests."""
+    close_dw_connection()
+    yield
+    close_dw_connection()
+
+
 # adding mock parquet file to put into a mock test bucket in mock aws/s3
 test_bucket = "test_bucket"
 
@@ -126,6 +148,40 @@ class TestConnectToDatabase:
         assert "Error connecting to the database: Connection timed out" in caplog.text
 
 
+class TestGetDwConnection:
+    @pytest.mark.it("unit test: healthy connection reused without a new handshake")
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_connection_reused(self, mock_connect_to_dw):
+        handshakes_avoided = connection_stats["handshakes_avoided"]
+        first = get_dw_connection()
+        second = get_dw_connection()
+        assert first is second
+        mock_connect_to_dw.assert_called_once()
+        first.execute_simple.assert_called_with("SELECT 1")
+        assert connection_stats["handshakes_avoided"] == handshakes_avoided + 1
+
+    @pytest.mark.it("unit test: reconnects when the kept connection is broken")
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_reconnects_on_interface_error(self, mock_connect_to_dw):
+        broken_conn = MagicMock()
+        broken_conn.execute_simple.side_effect = InterfaceError("network error")
+        new_conn = MagicMock()
+        mock_connect_to_dw.side_effect = [broken_conn, new_conn]
+        reconnects = connection_stats["reconnects"]
+        assert get_dw_connection() is broken_conn
+        assert get_dw_connection() is new_conn
+        broken_conn.close.assert_called_once()
+        assert connection_stats["reconnects"] == reconnects + 1
+
+    @pytest.mark.it("unit test: loads share one connection")
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_loads_share_connection(self, mock_connect_to_dw):
+        table_data = pa.table({"col1": [1, 2, 3]})
+        load_to_data_warehouse(table_data, "dim_staff")
+        load_to_data_warehouse(table_data, "dim_design")
+        mock_connect_to_dw.assert_called_once()
+
+
 class TestGetLatestParquetFileKeyWithPatch:
     # using decorator patch on boto3 client
     @patch("src.loading_lambda.boto3.client")
@@ -171,6 +227,30 @@ class TestGetLatestParquetFileKeyWithPatch:
                 in caplog.text
             )
 
+    @patch("src.loading_lambda.boto3.client")
+    def test_every_page_listed(self, mock_boto_3_client):
+        prefix = "dimension/staff"
+        mock_boto_3_client.return_value.list_objects_v2.side_effect = [
+            {
+                "IsTruncated": True,
+                "NextContinuationToken": "page-2",
+                "Contents": [{"Key": "dimension/staff-2024-05-25 16:35:22.parquet"}],
+            },
+            {
+                "IsTruncated": False,
+                "Contents": [{"Key": "dimension/staff-2024-05-24 14:35:22.parquet"}],
+            },
+        ]
+        mock_boto_3_client.return_value.get_object.side_effect = ClientError(
+            {"Error": {"Code": "NoSuchKey"}}, "GetObject"
+        )
+
+        result = get_latest_parquet_file_key(prefix, bucket=test_bucket)
+
+        assert result == "dimension/staff-2024-05-25 16:35:22.parquet"
+        second_call = mock_boto_3_client.return_value.list_objects_v2.call_args_list[1]
+        assert second_call[1]["ContinuationToken"] == "page-2"
+
 
 class TestGetLatestParquetFileKeyWithMockAws:
     # using mock aws environment
@@ -211,6 +291,29 @@ class TestGetLatestParquetFileKeyWithMockAws:
         expected = "dimension/date-2024-05-24 20:05:22.parquet"
         assert result == expected
 
+    def test_latest_pointer_followed_without_listing(self, mock_s3, mock_s3_bucket):
+        mock_s3.put_object(
+            Bucket=test_bucket,
+            Key="dimension/date-2024-05-25 20:05:22.parquet",
+            Body="{}",
+        )
+        mock_s3.put_object(
+            Bucket=test_bucket,
+            Key="_latest/dimension/date.json",
+            Body=json.dumps({"key": "dimension/date-2024-05-24 14:35:22.parquet"}),
+        )
+        result = get_latest_parquet_file_key("dimension/date", bucket=test_bucket)
+        assert result == "dimension/date-2024-05-24 14:35:22.parquet"
+
+    def test_latest_by_timestamp_with_microseconds(self, mock_s3, mock_s3_bucket):
+        mock_s3.put_object(
+            Bucket=test_bucket,
+            Key="dimension/date-2024-05-24 14:35:22.500000.parquet",
+            Body="{}",
+        )
+        result = get_latest_parquet_file_key("dimension/date", bucket=test_bucket)
+        assert result == "dimension/date-2024-05-24 14:35:22.500000.parquet"
+
 
 class TestReadParquetFromS3:
     @pytest.mark.it("unit test: check type of file in s3 is parquet")
@@ -247,51 +350,310 @@ class TestReadParquetFromS3:
                 in caplog.text
             )
 
+    @pytest.mark.it("unit test: only the warehouse columns of the table are read")
+    def test_reads_projected_columns(self, mock_s3_bucket):
+        data = pd.DataFrame(
+            {
+                "currency_name": ["Pound sterling"],
+                "created_at": [1],
+                "currency_id": [1],
+                "currency_code": ["GBP"],
+            }
+        ).to_parquet(index=False)
+        key = "dimension/dim_currency-2024-05-24 14:35:22.parquet"
+        mock_s3_bucket.put_object(Bucket=test_bucket, Key=key, Body=data)
+
+        result = read_parquet_from_s3(
+            key, bucket=test_bucket, table_name="dim_currency"
+        )
+
+        assert result.column_names == ["currency_id", "currency_code", "currency_name"]
+        assert result.to_pylist() == [
+            {
+                "currency_id": 1,
+                "currency_code": "GBP",
+                "currency_name": "Pound sterling",
+            }
+        ]
+
+    @pytest.mark.it("unit test: footer read from the tail and column chunks by range")
+    def test_ranged_reads(self, mock_s3_bucket):
+        key = "fact/sales_order-2024-05-24 14:35:22.parquet"
+        size = mock_s3_bucket.head_object(Bucket=test_bucket, Key=key)["ContentLength"]
+
+        whole = S3ObjectReader(key, bucket=test_bucket)
+        assert whole.size == size
+        assert pq.ParquetFile(whole).read().to_pylist()[0] == {"col1": 1, "col2": 3}
+        assert whole.ranged_gets == 1
+
+        tail_only = S3ObjectReader(key, bucket=test_bucket, tail_size=size // 2)
+        assert pq.ParquetFile(tail_only).read().num_rows == 2
+        assert tail_only.ranged_gets > 1
+
+    @pytest.mark.it("unit test: fact file streamed as batches with its row count")
+    def test_stream_parquet_from_s3(self, mock_s3_bucket):
+        data = pd.DataFrame(
+            {"units_sold": range(5), "sales_order_id": range(5), "extra": range(5)}
+        ).to_parquet(index=False)
+        key = "fact/sales_order-2024-05-25 14:35:22.parquet"
+        mock_s3_bucket.put_object(Bucket=test_bucket, Key=key, Body=data)
+
+        batches, num_rows = stream_parquet_from_s3(
+            key, bucket=test_bucket, table_name="fact_sales_order", batch_size=2
+        )
+
+        assert num_rows == 5
+        assert batches.schema.names == ["sales_order_id", "units_sold"]
+        assert [batch.num_rows for batch in batches] == [2, 2, 1]
+
+
+def list_dimension_keys(prefix, bucket):
+    """One processed file for every dimension listed by load_dim_tables."""
+    return [f"{prefix}2024-05-24 14:35:22.parquet"]
+
 
 class TestLoadDimTables:
     @pytest.mark.it("use patches/mocking to check func is loading six dim tables")
-    @patch("src.loading_lambda.load_to_data_warehouse")
+    @patch("src.loading_lambda.merge_dimension_files")
     @patch("src.loading_lambda.read_parquet_from_s3")
-    @patch(
-        "src.loading_lambda.get_latest_parquet_file_key",
-        return_value="dimension/dim_date-2024-05-24 14:35:22.parquet",
-    )
+    @patch("src.loading_lambda.list_parquet_keys", side_effect=list_dimension_keys)
+    @patch("src.loading_lambda.connect_to_dw")
     def test_load_dim_tables(
         self,
-        mock_get_latest_parquet_file_key,
+        mock_connect_to_dw,
+        mock_list_parquet_keys,
         mock_read_parquet_from_s3,
-        mock_load_to_data_warehouse,
+        mock_merge_dimension_files,
     ):
 
         load_dim_tables(bucket=test_bucket)
 
         # checking funcs called the expected no of times
-        assert mock_get_latest_parquet_file_key.call_count == 6
+        assert mock_list_parquet_keys.call_count == 6
         assert mock_read_parquet_from_s3.call_count == 6
-        assert mock_load_to_data_warehouse.call_count == 6
+        assert mock_merge_dimension_files.call_count == 6
 
 
-class TestLoadFactTable:
-    @pytest.mark.it("use patches/mocking to check func is loading one fact tables")
-    @patch("src.loading_lambda.load_to_data_warehouse")
+class TestMergeDimTables:
+    @pytest.mark.it("test changed rows staged and upserted on the natural key")
+    def test_merge_into_data_warehouse(self):
+        mock_conn = MagicMock()
+        mock_cursor = mock_conn.cursor.return_value
+        table_data = pa.table({"staff_id": [1, 2], "first_name": ["a", "b"]})
+
+        merge_into_data_warehouse(table_data, "dim_staff", "staff_id", mock_conn)
+
+        queries = [call[0][0] for call in mock_cursor.execute.call_args_list]
+        assert queries == [
+            "CREATE TEMPORARY TABLE staging_dim_staff "
+            "(LIKE dim_staff INCLUDING DEFAULTS)",
+            'COPY staging_dim_staff ("staff_id", "first_name") '
+            "FROM STDIN WITH (FORMAT csv)",
+            'INSERT INTO dim_staff ("staff_id", "first_name") '
+            'SELECT "staff_id", "first_name" FROM staging_dim_staff '
+            'ON CONFLICT ("staff_id") DO UPDATE SET "first_name" = EXCLUDED."first_name"',
+            "DROP TABLE staging_dim_staff",
+        ]
+        mock_conn.commit.assert_not_called()
+        mock_cursor.close.assert_called_once()
+
+    @pytest.mark.it("test only the last row of a repeated key is kept")
+    def test_keep_last_row_per_key(self):
+        table_data = pa.table({"staff_id": [1, 2, 1], "first_name": ["a", "b", "c"]})
+        result = keep_last_row_per_key(table_data, "staff_id")
+        assert result.to_pydict() == {"staff_id": [2, 1], "first_name": ["b", "c"]}
+
+    @pytest.mark.it("test all six dimensions merged in one transaction")
+    @patch("src.loading_lambda.merge_into_data_warehouse")
     @patch("src.loading_lambda.read_parquet_from_s3")
+    @patch("src.loading_lambda.list_parquet_keys", side_effect=list_dimension_keys)
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_one_transaction(
+        self,
+        mock_connect_to_dw,
+        mock_list_parquet_keys,
+        mock_read_parquet_from_s3,
+        mock_merge_into_data_warehouse,
+    ):
+        load_dim_tables(bucket=test_bucket)
+
+        assert mock_merge_into_data_warehouse.call_count == 6
+        mock_connect_to_dw.return_value.commit.assert_called_once()
+
+    @pytest.mark.it("test every dimension file not in the manifest merged in order")
+    @patch("src.loading_lambda.merge_into_data_warehouse")
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_every_new_file_merged_in_order(
+        self, mock_connect_to_dw, mock_merge_into_data_warehouse, mock_s3_bucket
+    ):
+        data = pd.DataFrame({"staff_id": [1, 2]}).to_parquet()
+        for key in [
+            "dimension/staff-2024-05-24 14:45:22.parquet",
+            "dimension/staff-2024-05-24 14:40:22.parquet",
+            "dimension/staff-2024-05-24 14:35:22.parquet",
+        ]:
+            mock_s3_bucket.put_object(Bucket=test_bucket, Key=key, Body=data)
+        mock_conn = mock_connect_to_dw.return_value
+        mock_cursor = mock_conn.cursor.return_value
+        mock_cursor.fetchall.return_value = [
+            ("dimension/date-2024-05-24 14:35:22.parquet",),
+            ("dimension/staff-2024-05-24 14:35:22.parquet",),
+        ]
+
+        load_dim_tables(bucket=test_bucket)
+
+        manifest_inserts = [
+            call[0][1]
+            for call in mock_cursor.execute.call_args_list
+            if call[0][0].startswith("INSERT INTO load_manifest")
+        ]
+        assert manifest_inserts == [
+            ("dimension/staff-2024-05-24 14:40:22.parquet", "dim_staff", 2),
+            ("dimension/staff-2024-05-24 14:45:22.parquet", "dim_staff", 2),
+        ]
+        assert mock_merge_into_data_warehouse.call_count == 2
+        mock_conn.commit.assert_called_once()
+
+    @pytest.mark.it("test staging table dropped before the next file is merged")
+    def test_files_merged_in_one_transaction(self):
+        mock_conn = MagicMock()
+        mock_cursor = mock_conn.cursor.return_value
+        dim_files = [
+            (
+                "dimension/staff-2024-05-24 14:40:22.parquet",
+                pa.table({"staff_id": [1, 2]}),
+            ),
+            (
+                "dimension/staff-2024-05-24 14:45:22.parquet",
+                pa.table({"staff_id": [2]}),
+            ),
+        ]
+
+        merge_dimension_files(dim_files, "dim_staff", mock_conn)
+
+        statements = [
+            call[0][0].split(" (")[0].split(" FROM")[0]
+            for call in mock_cursor.execute.call_args_list
+        ]
+        file_statements = [
+            "CREATE TEMPORARY TABLE staging_dim_staff",
+            "COPY staging_dim_staff",
+            "INSERT INTO dim_staff",
+            "DROP TABLE staging_dim_staff",
+            "INSERT INTO load_manifest",
+        ]
+        assert statements == file_statements + file_statements
+        mock_conn.commit.assert_not_called()
+
+    @pytest.mark.it("test failed merge rolls back every dimension")
     @patch(
-        "src.loading_lambda.get_latest_parquet_file_key",
-        return_value="dimension/dim_design-2025-05-24 14:35:22.parquet",
+        "src.loading_lambda.merge_into_data_warehouse",
+        side_effect=[None, DatabaseError("boom")],
     )
-    def test_load_fact_table(
+    @patch("src.loading_lambda.read_parquet_from_s3")
+    @patch("src.loading_lambda.list_parquet_keys", side_effect=list_dimension_keys)
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_rollback(
         self,
-        mock_get_latest_parquet_file_key,
+        mock_connect_to_dw,
+        mock_list_parquet_keys,
         mock_read_parquet_from_s3,
-        mock_load_to_data_warehouse,
+        mock_merge_into_data_warehouse,
     ):
+        with pytest.raises(DatabaseError):
+            load_dim_tables(bucket=test_bucket)
+
+        mock_connect_to_dw.return_value.commit.assert_not_called()
+        mock_connect_to_dw.return_value.rollback.assert_called()
+
+
+class TestLoadFactTable:
+    @pytest.mark.it("test every fact file not in the manifest loaded in order")
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_load_fact_table(self, mock_connect_to_dw, mock_s3_bucket):
+        data = pd.DataFrame({"col1": [1, 2], "col2": [3, 4]}).to_parquet()
+        for key in [
+            "fact/sales_order-2024-05-24 14:45:22.parquet",
+            "fact/sales_order-2024-05-24 14:40:22.parquet",
+        ]:
+            mock_s3_bucket.put_object(Bucket=test_bucket, Key=key, Body=data)
+        mock_conn = mock_connect_to_dw.return_value
+        mock_cursor = mock_conn.cursor.return_value
+        mock_cursor.fetchall.return_value = [
+            ("fact/sales_order-2024-05-24 14:35:22.parquet",)
+        ]
 
         load_fact_table(bucket=test_bucket)
 
-        # checking funcs called the expected no of times
-        assert mock_get_latest_parquet_file_key.call_count == 1
-        assert mock_read_parquet_from_s3.call_count == 1
-        assert mock_load_to_data_warehouse.call_count == 1
+        manifest_inserts = [
+            call[0][1]
+            for call in mock_cursor.execute.call_args_list
+            if call[0][0].startswith("INSERT INTO load_manifest")
+        ]
+        assert manifest_inserts == [
+            ("fact/sales_order-2024-05-24 14:40:22.parquet", "fact_sales_order", 2),
+            ("fact/sales_order-2024-05-24 14:45:22.parquet", "fact_sales_order", 2),
+        ]
+        # one commit for the manifest set up, then one per file
+        assert mock_conn.commit.call_count == 3
+
+    @pytest.mark.it(
+        "test fact files loaded in the order of the timestamps in their keys"
+    )
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_load_fact_table_timestamp_order(self, mock_connect_to_dw, mock_s3_bucket):
+        data = pd.DataFrame({"col1": [1, 2], "col2": [3, 4]}).to_parquet()
+        mock_s3_bucket.put_object(
+            Bucket=test_bucket,
+            Key="fact/sales_order-2024-05-24 14:35:22.500000.parquet",
+            Body=data,
+        )
+        mock_cursor = mock_connect_to_dw.return_value.cursor.return_value
+        mock_cursor.fetchall.return_value = []
+
+        load_fact_table(bucket=test_bucket)
+
+        manifest_keys = [
+            call[0][1][0]
+            for call in mock_cursor.execute.call_args_list
+            if call[0][0].startswith("INSERT INTO load_manifest")
+        ]
+        assert manifest_keys == [
+            "fact/sales_order-2024-05-24 14:35:22.parquet",
+            "fact/sales_order-2024-05-24 14:35:22.500000.parquet",
+        ]
+
+    @pytest.mark.it("test nothing loaded when every fact file is in the manifest")
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_nothing_new(self, mock_connect_to_dw, mock_s3_bucket, caplog):
+        mock_cursor = mock_connect_to_dw.return_value.cursor.return_value
+        mock_cursor.fetchall.return_value = [
+            ("fact/sales_order-2024-05-24 14:35:22.parquet",)
+        ]
+
+        load_fact_table(bucket=test_bucket)
+
+        assert "No new files to load into fact_sales_order" in caplog.text
+        assert mock_connect_to_dw.return_value.commit.call_count == 1
+
+    @pytest.mark.it("test failed file rolled back without recording it")
+    @patch("src.loading_lambda.copy_to_data_warehouse")
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_failed_file(
+        self, mock_connect_to_dw, mock_copy_to_data_warehouse, mock_s3_bucket
+    ):
+        mock_cursor = mock_connect_to_dw.return_value.cursor.return_value
+        mock_cursor.fetchall.return_value = []
+        mock_copy_to_data_warehouse.side_effect = DatabaseError("boom")
+
+        with pytest.raises(DatabaseError):
+            load_fact_table(bucket=test_bucket)
+
+        mock_connect_to_dw.return_value.rollback.assert_called_once()
+        assert not any(
+            call[0][0].startswith("INSERT INTO load_manifest")
+            for call in mock_cursor.execute.call_args_list
+        )
 
 
 class TestLoadToDataWarehouse:
@@ -313,7 +675,7 @@ class TestLoadToDataWarehouse:
 
         mock_conn.commit.assert_called_once()
         mock_cursor.close.assert_called_once()
-        mock_conn.close.assert_called_once()
+        mock_conn.close.assert_not_called()
 
     @pytest.mark.it("test correct logger info message received")
     @patch("src.loading_lambda.connect_to_dw")
@@ -355,12 +717,233 @@ class TestLoadToDataWarehouse:
             err_msg = "Error during loading test_table_name"
             assert err_msg in caplog.text
 
+    @pytest.mark.it("test table streamed to COPY as csv with its column list")
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_load_to_dw_streams_csv(self, mock_connect_to_dw):
+        mock_cursor = mock_connect_to_dw.return_value.cursor.return_value
+        streamed = []
+        mock_cursor.execute.side_effect = lambda query, stream: streamed.extend(stream)
+        table_data = pa.table({"col1": [1, None, 3], "col2": ["a", "", None]})
+
+        load_to_data_warehouse(table_data, "test_table_name")
+
+        query = mock_cursor.execute.call_args[0][0]
+        assert query == (
+            'COPY test_table_name ("col1", "col2") FROM STDIN WITH (FORMAT csv)'
+        )
+        assert b"".join(streamed) == b'1,"a"\n,""\n3,\n'
+
+
+@pytest.fixture(scope="function")
+def mock_fact_partitions(mock_s3_bucket):
+    for created_date, sales_order_ids in [
+        (date(2024, 4, 30), [1]),
+        (date(2024, 5, 1), [2, 3]),
+        (date(2024, 5, 24), [4]),
+        (date(2024, 6, 2), [5]),
+    ]:
+        data = pd.DataFrame(
+            {
+                "sales_order_id": sales_order_ids,
+                "created_date": [created_date] * len(sales_order_ids),
+            }
+        ).to_parquet(index=False)
+        mock_s3_bucket.put_object(
+            Bucket=test_bucket,
+            Key=(
+                f"fact/sales_order/year={created_date.year}"
+                f"/month={created_date.month:02d}/day={created_date.day:02d}"
+                "/sales_order-2024-06-02 14:35:22.parquet"
+            ),
+            Body=data,
+        )
+    yield mock_s3_bucket
+
+
+class TestFactPartitions:
+    @pytest.mark.it("unit test: only partitions in the date range listed")
+    def test_list_fact_keys_in_range(self, mock_fact_partitions):
+        keys = list_fact_keys(
+            "fact/sales_order",
+            bucket=test_bucket,
+            start_date=date(2024, 5, 1),
+            end_date=date(2024, 5, 31),
+        )
+        assert keys == [
+            "fact/sales_order/year=2024/month=05/day=01"
+            "/sales_order-2024-06-02 14:35:22.parquet",
+            "fact/sales_order/year=2024/month=05/day=24"
+            "/sales_order-2024-06-02 14:35:22.parquet",
+        ]
+
+    @pytest.mark.it("unit test: open ended range skips unpartitioned objects")
+    def test_list_fact_keys_from_start_date(self, mock_fact_partitions):
+        keys = list_fact_keys(
+            "fact/sales_order", bucket=test_bucket, start_date=date(2024, 5, 24)
+        )
+        assert [key.split("/")[4] for key in keys] == ["day=24", "day=02"]
+        everything = list_fact_keys("fact/sales_order", bucket=test_bucket)
+        assert everything[0] == "fact/sales_order-2024-05-24 14:35:22.parquet"
+        assert len(everything) == 5
+
+    @pytest.mark.it("unit test: ad-hoc read of the partitions in the date range")
+    def test_read_fact_partitions(self, mock_fact_partitions):
+        result = read_fact_partitions(
+            date(2024, 4, 30), date(2024, 5, 1), bucket=test_bucket
+        )
+        assert result.column_names == ["sales_order_id", "created_date"]
+        assert result["sales_order_id"].to_pylist() == [1, 2, 3]
+
+    @pytest.mark.it("unit test: load_fact_table loads only the date range")
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_load_fact_table_in_range(self, mock_connect_to_dw, mock_fact_partitions):
+        mock_cursor = mock_connect_to_dw.return_value.cursor.return_value
+        mock_cursor.fetchall.return_value = []
+
+        load_fact_table(
+            bucket=test_bucket, start_date=date(2024, 6, 1), end_date=date(2024, 6, 30)
+        )
+
+        manifest_inserts = [
+            call[0][1][0]
+            for call in mock_cursor.execute.call_args_list
+            if call[0][0].startswith("INSERT INTO load_manifest")
+        ]
+        assert manifest_inserts == [
+            "fact/sales_order/year=2024/month=06/day=02"
+            "/sales_order-2024-06-02 14:35:22.parquet"
+        ]
+
+
+class TestIterCsvBatches:
+    @pytest.mark.it("test csv encoded one record batch at a time")
+    def test_batches(self):
+        table_data = pa.table({"col1": list(range(5))})
+        batches = list(iter_csv_batches(table_data, batch_size=2))
+        assert batches == [b"0\n1\n", b"2\n3\n", b"4\n"]
+
+
+class TestLoadStarSchema:
+    @pytest.mark.it("test dims then fact loaded on one connection, committed once")
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_one_transaction(self, mock_connect_to_dw):
+        mock_conn = mock_connect_to_dw.return_value
+        calls = Mock()
+        calls.dims.return_value = {}
+        with patch("src.loading_lambda.load_dim_tables", side_effect=calls.dims), patch(
+            "src.loading_lambda.load_fact_table", side_effect=calls.fact
+        ):
+            load_star_schema(bucket=test_bucket)
+
+        assert calls.mock_calls == [
+            mock.call.dims(bucket=test_bucket, conn=mock_conn, max_connections=1),
+            mock.call.fact(bucket=test_bucket, conn=mock_conn),
+        ]
+        mock_connect_to_dw.assert_called_once()
+        mock_conn.commit.assert_called_once()
+
+    @pytest.mark.it("test loaders leave the session transaction uncommitted")
+    @patch("src.loading_lambda.merge_into_data_warehouse")
+    @patch("src.loading_lambda.read_parquet_from_s3")
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_loaders_do_not_commit(
+        self,
+        mock_connect_to_dw,
+        mock_read_parquet_from_s3,
+        mock_merge_into_data_warehouse,
+        mock_s3_bucket,
+    ):
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.fetchall.return_value = []
+        load_dim_tables(bucket=test_bucket, conn=mock_conn)
+        load_fact_table(bucket=test_bucket, conn=mock_conn)
+
+        mock_conn.commit.assert_not_called()
+        mock_connect_to_dw.assert_not_called()
+
+    @pytest.mark.it("test failed fact load rolls the dimensions back too")
+    @patch("src.loading_lambda.load_fact_table", side_effect=DatabaseError("boom"))
+    @patch("src.loading_lambda.load_dim_tables")
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_rollback(self, mock_connect_to_dw, mock_dim_tables, mock_fact_table):
+        with pytest.raises(DatabaseError):
+            load_star_schema(bucket=test_bucket)
+
+        mock_connect_to_dw.return_value.commit.assert_not_called()
+        mock_connect_to_dw.return_value.rollback.assert_called_once()
+
+
+class TestScheduleDimensionLoads:
+    @pytest.fixture(autouse=True)
+    def no_kept_load_connections(self):
+        close_load_connections()
+        yield
+        close_load_connections()
+
+    @pytest.mark.it("test dims merged at once on a pool, each committed on its own")
+    @patch("src.loading_lambda.merge_into_data_warehouse")
+    @patch("src.loading_lambda.read_parquet_from_s3")
+    @patch("src.loading_lambda.list_parquet_keys", side_effect=list_dimension_keys)
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_concurrent_merge(
+        self,
+        mock_connect_to_dw,
+        mock_list_parquet_keys,
+        mock_read_parquet_from_s3,
+        mock_merge_into_data_warehouse,
+    ):
+        mock_connect_to_dw.side_effect = lambda: MagicMock()
+        session_conn = MagicMock()
+
+        timings = load_dim_tables(
+            bucket=test_bucket, conn=session_conn, max_connections=2
+        )
+
+        assert mock_merge_into_data_warehouse.call_count == 6
+        assert mock_connect_to_dw.call_count <= 2
+        merge_conns = {
+            call[0][3] for call in mock_merge_into_data_warehouse.call_args_list
+        }
+        assert session_conn not in merge_conns
+        # one commit reading the load manifest, then one per dimension
+        assert sum(conn.commit.call_count for conn in merge_conns) == 7
+        assert set(timings) == set(DIMENSION_KEYS)
+        assert all(
+            set(table_timings) == {"download", "load"}
+            for table_timings in timings.values()
+        )
+
+    @pytest.mark.it("test critical path logged after the star schema load")
+    @patch("src.loading_lambda.load_fact_table")
+    @patch("src.loading_lambda.merge_into_data_warehouse")
+    @patch("src.loading_lambda.read_parquet_from_s3")
+    @patch("src.loading_lambda.list_parquet_keys", side_effect=list_dimension_keys)
+    @patch("src.loading_lambda.connect_to_dw")
+    def test_critical_path_logged(
+        self,
+        mock_connect_to_dw,
+        mock_list_parquet_keys,
+        mock_read_parquet_from_s3,
+        mock_merge_into_data_warehouse,
+        mock_load_fact_table,
+        caplog,
+    ):
+        with caplog.at_level(logging.INFO):
+            load_star_schema(bucket=test_bucket)
+
+        assert "Load timing dim_staff: download" in caplog.text
+        assert "Load critical path: dim_" in caplog.text
+        assert "-> fact_sales_order load" in caplog.text
+
 
 class TestLambdaHandler:
     @pytest.mark.it("use patch to verify function calling")
+    @patch("src.loading_lambda.connect_to_dw")
     @patch("src.loading_lambda.load_fact_table")
     @patch("src.loading_lambda.load_dim_tables")
-    def test_lambda_handler_func_calls(self, mock_dim_tables, mock_fact_table):
+    def test_lambda_handler_func_calls(
+        self, mock_dim_tables, mock_fact_table, mock_connect_to_dw
+    ):
         event = {}
         context = DummyContext()
         lambda_handler(event, context)
@@ -4,28 +4,45 @@ import os
 import boto3
 from unittest import mock
 from unittest.mock import patch
-from pg8000 import DatabaseError, InterfaceError
 from botocore.exceptions import ClientError
 from pprint import pprint
-from datetime import datetime
+from datetime import datetime, date, time
 import logging
 import json
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from io import BytesIO
 from src.processing_lambda import (
     get_object_key,
+    list_object_keys,
+    group_keys_by_table,
+    fetch_run_records,
+    drop_duplicate_records,
     remove_created_at_and_last_updated,
     process_fact_sales_order,
     process_dim_counterparty,
+    join_legal_addresses,
     process_dim_currency,
     process_dim_date,
     process_dim_design,
     process_dim_location,
     process_dim_staff,
     convert_to_parquet_put_in_s3,
+    put_processed_table,
+    put_partitioned_fact,
+    read_state_snapshot,
+    merge_state_deltas,
+    put_state_snapshot,
+    with_lookup_state,
+    S3MultipartWriter,
     delete_duplicates,
+    delete_object_keys,
+    copy_object_keys,
     move_processed_ingestion_data,
     delete_files_from_updated_after_handling,
     archive_processed_data,
+    get_event_keys,
     lambda_handler,
 )
 
@@ -112,6 +129,116 @@ class TestGetObjectKey:
                 table_name="wrong_table_name", prefix="updated/", bucket="test_bucket"
             )
 
+    @pytest.mark.it("Unit test: latest key picked by the timestamp in the key")
+    def test_latest_key_timestamp(self, s3, bucket):
+        for key in [
+            "updated/counterparty-2024-05-21 14:40:09.json",
+            "updated/counterparty-2024-05-21 14:40:09.122625.json",
+        ]:
+            bucket.put_object(Bucket="test_bucket", Key=key, Body="[]")
+        key = get_object_key(
+            table_name="counterparty", prefix="updated/", bucket="test_bucket"
+        )
+        assert key == "updated/counterparty-2024-05-21 14:40:09.122625.json"
+
+
+class TestRunRecords:
+    @pytest.mark.it("Unit test: keys grouped by the exact table name")
+    def test_group_keys_by_table(self):
+        keys = [
+            "updated/sales_order-2024-05-21 14:40:09.122625.json",
+            "updated/address-2024-05-21 14:40:09.122625.json",
+            "updated/sales_order-2024-05-21 14:50:09.122625.json",
+            "updated/",
+        ]
+        assert group_keys_by_table(keys) == {
+            "sales_order": [keys[0], keys[2]],
+            "address": [keys[1]],
+        }
+
+    @pytest.mark.it("Unit test: listing follows every page")
+    def test_list_object_keys_pages(self, s3, bucket):
+        for i in range(1001):
+            bucket.put_object(Bucket="test_bucket", Key=f"updated/staff-{i:04}.json")
+        keys = list_object_keys(bucket="test_bucket", prefix="updated/")
+        assert len(keys) == 1001
+
+    @pytest.mark.it("Unit test: every new object of the tables read downloaded once")
+    def test_fetch_run_records(self, s3, bucket):
+        keys = [
+            "updated/counterparty-2024-05-21 14:40:09.122625.json",
+            "updated/address-2024-05-21 14:40:09.122625.json",
+            "updated/address-2024-05-21 14:50:09.122625.json",
+            "updated/payment-2024-05-21 14:40:09.122625.json",
+        ]
+        for key in keys:
+            bucket.put_object(
+                Bucket="test_bucket", Key=key, Body=json.dumps([{"key": key}])
+            )
+
+        with patch(
+            "src.processing_lambda.s3.get_object", wraps=bucket.get_object
+        ) as mock_get_object:
+            records = fetch_run_records(group_keys_by_table(keys), bucket="test_bucket")
+
+        assert records == {
+            "address": [{"key": keys[1]}, {"key": keys[2]}],
+            "counterparty": [{"key": keys[0]}],
+        }
+        assert mock_get_object.call_count == 3
+
+    @pytest.mark.it("Unit test: records in several objects of a table kept once")
+    def test_fetch_run_records_duplicates(self, s3, bucket):
+        first = {"address_id": 1, "last_updated": 1667485249962, "city": "Leeds"}
+        second = {"address_id": 1, "last_updated": 1667485250000, "city": "York"}
+        keys = [
+            "updated/address-2024-05-21 14:50:09.122625.json",
+            "updated/address-2024-05-21 14:40:09.122625.json",
+        ]
+        bucket.put_object(
+            Bucket="test_bucket", Key=keys[0], Body=json.dumps([first, second])
+        )
+        bucket.put_object(Bucket="test_bucket", Key=keys[1], Body=json.dumps([first]))
+
+        records = fetch_run_records(group_keys_by_table(keys), bucket="test_bucket")
+
+        assert records == {"address": [first, second]}
+
+    @pytest.mark.it("Unit test: transforms use the records of the run")
+    def test_transform_uses_records(self):
+        records = {
+            "staff": [
+                {
+                    "staff_id": 1,
+                    "first_name": "Jeremie",
+                    "created_at": 1667485249962,
+                    "last_updated": 1667485249962,
+                }
+            ]
+        }
+        result, key = process_dim_staff(bucket="no_such_bucket", records=records)
+        assert list(result.columns) == ["staff_id", "first_name"]
+
+    @pytest.mark.it(
+        "Unit test: records with a primary key and last_updated seen kept once"
+    )
+    def test_drop_duplicate_records(self):
+        records = [
+            {"staff_id": 1, "last_updated": 1667485249962, "first_name": "Jeremie"},
+            {"staff_id": 1, "last_updated": 1667485249962, "first_name": "Jeremie"},
+            {"staff_id": 1, "last_updated": 1667485250000, "first_name": "Jeremy"},
+            {"staff_id": 2, "last_updated": 1667485249962, "first_name": "Deron"},
+            {"first_name": "No id"},
+            {"first_name": "No id"},
+        ]
+        assert drop_duplicate_records("staff", records) == [
+            records[0],
+            records[2],
+            records[3],
+            records[4],
+            records[5],
+        ]
+
 
 class TestRemoveCreatedAtAndLastUpdated:
     @pytest.mark.it("Unit test: created_at and last_updated keys removed")
@@ -187,6 +314,32 @@ class TestProcessFactSalesOrder:
         assert "created_at" not in result
         assert "last_updated" not in result
 
+    @pytest.mark.it("Unit test: timestamps split in UTC and staff_id renamed")
+    def test_split_values(self, s3, bucket):
+        sales_order = [
+            {
+                "sales_order_id": 1,
+                "created_at": 1667485249962,
+                "last_updated": 1667520000000,
+                "staff_id": 3,
+            }
+        ]
+        bucket.put_object(
+            Bucket="test_bucket",
+            Key="baseline/sales_order.json",
+            Body=json.dumps(sales_order),
+        )
+
+        result, key = process_fact_sales_order(bucket="test_bucket", prefix="baseline/")
+
+        row = result.to_dict(orient="records")[0]
+        assert row["created_date"] == date(2022, 11, 3)
+        assert row["created_time"] == time(14, 20, 49, 962000)
+        assert row["last_updated_date"] == date(2022, 11, 4)
+        assert row["last_updated_time"] == time(0, 0)
+        assert row["sales_staff_id"] == 3
+        assert "staff_id" not in result
+
 
 class TestProcessDimCounterparty:
     @pytest.mark.it("Unit test: check correct column names")
@@ -274,6 +427,35 @@ class TestProcessDimCounterparty:
         assert "last_updated" not in result
 
 
+class TestJoinLegalAddresses:
+    @pytest.mark.it("Unit test: legal address columns taken from matching address")
+    def test_matching_address(self):
+        counterparties = [{"counterparty_id": 1, "legal_address_id": 2}]
+        addresses = [
+            {
+                "address_id": address_id,
+                "address_line_1": f"{address_id} Road",
+                "address_line_2": None,
+                "district": "District",
+                "city": "City",
+                "postal_code": "AB1 2CD",
+                "country": "Country",
+                "phone": "0123",
+            }
+            for address_id in [1, 2, 3]
+        ]
+        result = join_legal_addresses(counterparties, addresses)
+        assert result[0]["counterparty_legal_address_line_1"] == "2 Road"
+        assert result[0]["counterparty_legal_address_line_2"] is None
+        assert result[0]["counterparty_legal_phone_number"] == "0123"
+
+    @pytest.mark.it("Unit test: counterparty without matching address left unchanged")
+    def test_no_matching_address(self):
+        counterparties = [{"counterparty_id": 1, "legal_address_id": 9}]
+        result = join_legal_addresses(counterparties, [{"address_id": 1}])
+        assert result == [{"counterparty_id": 1, "legal_address_id": 9}]
+
+
 class TestProcessDimCurrency:
     @pytest.mark.it("Unit test: create currency_name column ")
     def test_currency_name_created(self, s3, bucket):
@@ -400,6 +582,55 @@ class TestProcessDimDate:
         for col, expected_dtype in expected_column_dtypes.items():
             assert result[col].dtype == expected_dtype
 
+    @pytest.mark.it("Unit test: one row per distinct date from the given fact frame")
+    def test_distinct_dates_from_fact_frame(self):
+        fact_sales_order_df = pd.DataFrame(
+            {
+                "created_date": [date(2022, 11, 3), date(2022, 11, 3)],
+                "last_updated_date": [date(2022, 11, 3), date(2022, 11, 4)],
+                "agreed_payment_date": ["2022-11-04", "2022-11-04"],
+                "agreed_delivery_date": ["2023-01-01", "2022-11-04"],
+            }
+        )
+
+        result, key = process_dim_date(
+            bucket="no_such_bucket", fact_sales_order_df=fact_sales_order_df
+        )
+
+        assert result.to_dict(orient="records") == [
+            {
+                "date_id": date(2022, 11, 3),
+                "year": 2022,
+                "month": 11,
+                "day": 3,
+                "day_of_week": 4,
+                "day_name": "Thursday",
+                "month_name": "November",
+                "quarter": 4,
+            },
+            {
+                "date_id": date(2022, 11, 4),
+                "year": 2022,
+                "month": 11,
+                "day": 4,
+                "day_of_week": 5,
+                "day_name": "Friday",
+                "month_name": "November",
+                "quarter": 4,
+            },
+            {
+                "date_id": date(2023, 1, 1),
+                "year": 2023,
+                "month": 1,
+                "day": 1,
+                "day_of_week": 7,
+                "day_name": "Sunday",
+                "month_name": "January",
+                "quarter": 1,
+            },
+        ]
+        assert key.startswith("dimension/date-")
+
 
 class TestProcessDimDesign:
     @pytest.mark.it("Unit test: created_at and last_updated keys removed")
@@ -485,6 +716,296 @@ class TestConvertDateframeToParquet:
         response = s3.list_objects_v2(Bucket="process_bucket")
         assert response["KeyCount"] == 1
 
+    @pytest.mark.it("Unit test: latest pointer of the table written after the upload")
+    def test_put_processed_table(self, s3, process_bucket):
+        key = "dimension/staff-2024-05-24 14:35:22.parquet"
+        put_processed_table(
+            s3, pd.DataFrame({"staff_id": [1]}), key, bucket="process_bucket"
+        )
+        pointer = s3.get_object(
+            Bucket="process_bucket", Key="_latest/dimension/staff.json"
+        )
+        assert json.loads(pointer["Body"].read()) == {"key": key}
+
+    @pytest.mark.it("Unit test: file written with the writer profile of its table")
+    def test_writer_profile(self, s3, process_bucket):
+        df = pd.DataFrame(
+            {
+                "currency_id": [3, 1, 2],
+                "currency_code": ["USD", "GBP", "EUR"],
+                "currency_name": ["US dollar", "Pound sterling", "Euro"],
+            }
+        )
+        key = "dimension/currency-2024-05-24 14:35:22.parquet"
+        convert_to_parquet_put_in_s3(s3, df, key, bucket="process_bucket")
+
+        parquet_file = pq.ParquetFile(
+            BytesIO(s3.get_object(Bucket="process_bucket", Key=key)["Body"].read())
+        )
+        row_group = parquet_file.metadata.row_group(0)
+        assert row_group.sorting_columns == (pq.SortingColumn(0),)
+        assert parquet_file.read()["currency_id"].to_pylist() == [1, 2, 3]
+        encodings = {
+            row_group.column(i).path_in_schema: row_group.column(i).encodings
+            for i in range(row_group.num_columns)
+        }
+        assert "RLE_DICTIONARY" in encodings["currency_code"]
+        assert "RLE_DICTIONARY" not in encodings["currency_id"]
+        assert row_group.column(0).compression == "ZSTD"
+        assert row_group.column(0).statistics.has_min_max
+
+
+class TestS3MultipartWriter:
+    @pytest.mark.it("Unit test: object smaller than a part uploaded with one put")
+    def test_small_object(self, s3, process_bucket):
+        with S3MultipartWriter(s3, "process_bucket", "dimension/small.parquet") as sink:
+            sink.write(b"PAR1")
+            sink.write(b"PAR1")
+        assert sink.upload_id is None
+        obj = s3.get_object(Bucket="process_bucket", Key="dimension/small.parquet")
+        assert obj["Body"].read() == b"PAR1PAR1"
+
+    @pytest.mark.it("Unit test: large object uploaded in parts as it is written")
+    def test_parts_uploaded(self, s3, process_bucket):
+        part_size = 5 * 1024 * 1024
+        chunks = [os.urandom(1024 * 1024) for _ in range(12)]
+        with S3MultipartWriter(
+            s3, "process_bucket", "fact/large.parquet", part_size=part_size
+        ) as sink:
+            for chunk in chunks:
+                sink.write(chunk)
+                assert len(sink.buffer) < part_size
+        assert [part["PartNumber"] for part in sink.parts] == [1, 2, 3]
+        obj = s3.get_object(Bucket="process_bucket", Key="fact/large.parquet")
+        assert obj["Body"].read() == b"".join(chunks)
+
+    @pytest.mark.it("Unit test: upload aborted and no object written on failure")
+    def test_aborted_on_failure(self, s3, process_bucket):
+        with pytest.raises(ValueError):
+            with S3MultipartWriter(
+                s3, "process_bucket", "fact/failed.parquet", part_size=5 * 1024 * 1024
+            ) as sink:
+                sink.write(os.urandom(6 * 1024 * 1024))
+                raise ValueError("writer failed")
+        assert sink.upload_id is not None
+        uploads = s3.list_multipart_uploads(Bucket="process_bucket")
+        assert "Uploads" not in uploads
+        response = s3.list_objects_v2(Bucket="process_bucket")
+        assert response["KeyCount"] == 0
+
+
+class TestPutPartitionedFact:
+    @pytest.mark.it("Unit test: one object per created_date with the same schema")
+    def test_partitions_by_created_date(self, s3, process_bucket):
+        df = pd.DataFrame(
+            {
+                "sales_order_id": [1, 2, 3],
+                "unit_price": [2, 3.5, 4],
+                "agreed_payment_date": [None, None, "2022-11-08"],
+                "created_date": [
+                    date(2022, 11, 3),
+                    date(2022, 12, 1),
+                    date(2022, 11, 3),
+                ],
+            }
+        )
+        keys = put_partitioned_fact(
+            s3,
+            df,
+            "fact/sales_order-2024-05-24 14:35:22.parquet",
+            bucket="process_bucket",
+        )
+        assert keys == [
+            "fact/sales_order/year=2022/month=11/day=03/"
+            "sales_order-2024-05-24 14:35:22.parquet",
+            "fact/sales_order/year=2022/month=12/day=01/"
+            "sales_order-2024-05-24 14:35:22.parquet",
+        ]
+        tables = [
+            pq.read_table(
+                BytesIO(s3.get_object(Bucket="process_bucket", Key=key)["Body"].read())
+            )
+            for key in keys
+        ]
+        assert [table["sales_order_id"].to_pylist() for table in tables] == [
+            [1, 3],
+            [2],
+        ]
+        assert tables[0].schema.remove_metadata() == tables[1].schema.remove_metadata()
+        assert tables[1].schema.field("agreed_payment_date").type == pa.string()
+
+
+class TestStateSnapshots:
+    @pytest.mark.it(
+        "Unit test: new records of a run replace the state rows of their keys"
+    )
+    def test_merge_state_deltas(self, s3, bucket):
+        first_run = [
+            {"address_id": 1, "city": "Leeds", "last_updated": 1},
+            {"address_id": 2, "city": "York", "last_updated": 1},
+        ]
+        state, replaced, etag = merge_state_deltas(
+            "address", first_run, bucket="test_bucket", ingestion_bucket="test_bucket"
+        )
+        put_state_snapshot(s3, "address", state, replaced, etag, bucket="test_bucket")
+        assert read_state_snapshot("address", bucket="test_bucket").to_pylist() == (
+            first_run
+        )
+
+        second_run = [
+            {"address_id": 2, "city": "Hull", "last_updated": 2},
+            {"address_id": 3, "city": "Bath", "last_updated": 2},
+            {"address_id": 2, "city": "Ely", "last_updated": 3},
+        ]
+        state, replaced, etag = merge_state_deltas(
+            "address", second_run, bucket="test_bucket", ingestion_bucket="test_bucket"
+        )
+        put_state_snapshot(s3, "address", state, replaced, etag, bucket="test_bucket")
+
+        assert read_state_snapshot("address", bucket="test_bucket").to_pylist() == [
+            first_run[0],
+            second_run[2],
+            second_run[1],
+        ]
+        history = list_object_keys(bucket="test_bucket", prefix="state/history/")
+        assert len(history) == 1
+        obj = bucket.get_object(Bucket="test_bucket", Key=history[0])
+        assert pq.read_table(BytesIO(obj["Body"].read())).to_pylist() == [first_run[1]]
+
+    @pytest.mark.it("Unit test: no state kept for records without a primary key")
+    def test_merge_state_deltas_no_primary_key(self, s3, bucket):
+        assert merge_state_deltas("staff", [{"key": 1}], bucket="test_bucket") is None
+
+    @pytest.mark.it("Unit test: lookup tables read from their whole current state")
+    def test_with_lookup_state(self, s3, bucket):
+        addresses = [
+            {"address_id": 1, "city": "Leeds"},
+            {"address_id": 2, "city": "York"},
+        ]
+        state, replaced, etag = merge_state_deltas(
+            "address", addresses, bucket="test_bucket", ingestion_bucket="test_bucket"
+        )
+        put_state_snapshot(s3, "address", state, replaced, etag, bucket="test_bucket")
+        records = {
+            "counterparty": [{"counterparty_id": 1, "legal_address_id": 2}],
+            "address": [addresses[0]],
+        }
+
+        transform_records = with_lookup_state(
+            "counterparty", records, {}, bucket="test_bucket"
+        )
+        assert transform_records["address"] == addresses
+        assert transform_records["counterparty"] == records["counterparty"]
+        assert with_lookup_state("address", records, {}, bucket="test_bucket") == (
+            records
+        )
+
+    @pytest.mark.it("Unit test: a table without a snapshot starts from its baseline")
+    def test_state_seeded_from_baseline(self, s3, bucket):
+        baseline = [
+            {"address_id": 1, "city": "Leeds", "last_updated": 1},
+            {"address_id": 2, "city": "York", "last_updated": 1},
+        ]
+        bucket.put_object(
+            Bucket="test_bucket",
+            Key="baseline/address-2024-05-20 10:00:00.000000-part-00000.json",
+            Body=json.dumps(baseline),
+        )
+        delta = [{"address_id": 2, "city": "Hull", "last_updated": 2}]
+
+        state, replaced, etag = merge_state_deltas(
+            "address", delta, bucket="test_bucket", ingestion_bucket="test_bucket"
+        )
+
+        assert state.to_pylist() == [baseline[0], delta[0]]
+        assert replaced.to_pylist() == [baseline[1]]
+        assert etag is None
+
+    @pytest.mark.it("Unit test: counterparty joins an address only in the baseline")
+    def test_lookup_seeded_from_baseline(self, s3, bucket):
+        address = {
+            "address_id": 2,
+            "address_line_1": "1 Main St",
+            "address_line_2": None,
+            "district": None,
+            "city": "York",
+            "postal_code": "YO1",
+            "country": "UK",
+            "phone": "0123",
+        }
+        bucket.put_object(
+            Bucket="test_bucket",
+            Key="baseline/address-2024-05-20 10:00:00.000000-part-00000.json",
+            Body=json.dumps([address]),
+        )
+        records = {"counterparty": [{"counterparty_id": 1, "legal_address_id": 2}]}
+
+        transform_records = with_lookup_state(
+            "counterparty",
+            records,
+            {},
+            bucket="test_bucket",
+            ingestion_bucket="test_bucket",
+        )
+
+        assert transform_records["address"] == [address]
+        counterparty = join_legal_addresses(
+            transform_records["counterparty"], transform_records["address"]
+        )
+        assert counterparty[0]["counterparty_legal_city"] == "York"
+
+    @pytest.mark.it(
+        "Unit test: state not written over a snapshot another run wrote meanwhile"
+    )
+    def test_concurrent_state_write_rejected(self, s3, bucket):
+        records = [{"address_id": 1, "city": "Leeds"}]
+        first = merge_state_deltas(
+            "address", records, bucket="test_bucket", ingestion_bucket="test_bucket"
+        )
+        second = merge_state_deltas(
+            "address", records, bucket="test_bucket", ingestion_bucket="test_bucket"
+        )
+        put_state_snapshot(s3, "address", *first, bucket="test_bucket")
+
+        with pytest.raises(ClientError):
+            put_state_snapshot(s3, "address", *second, bucket="test_bucket")
+
+    @pytest.mark.it("Unit test: state only written over the snapshot it was read at")
+    def test_state_written_if_unchanged(self, s3, bucket):
+        put_state_snapshot(
+            s3,
+            "address",
+            *merge_state_deltas(
+                "address",
+                [{"address_id": 1, "city": "Leeds"}],
+                bucket="test_bucket",
+                ingestion_bucket="test_bucket",
+            ),
+            bucket="test_bucket",
+        )
+        first = merge_state_deltas(
+            "address",
+            [{"address_id": 2, "city": "York"}],
+            bucket="test_bucket",
+            ingestion_bucket="test_bucket",
+        )
+        second = merge_state_deltas(
+            "address",
+            [{"address_id": 3, "city": "Hull"}],
+            bucket="test_bucket",
+            ingestion_bucket="test_bucket",
+        )
+        put_state_snapshot(s3, "address", *first, bucket="test_bucket")
+
+        with pytest.raises(ClientError) as error:
+            put_state_snapshot(s3, "address", *second, bucket="test_bucket")
+
+        assert error.value.response["Error"]["Code"] == "PreconditionFailed"
+        assert [
+            row["address_id"]
+            for row in read_state_snapshot("address", bucket="test_bucket").to_pylist()
+        ] == [1, 2]
+
 
 class TestDeleteDuplicates:
     @pytest.mark.it(
@@ -588,6 +1109,102 @@ class TestDeleteDuplicates:
 
         assert response["KeyCount"] == 2
 
+    @pytest.mark.it("Unit test: duplicates found from the ETags without downloading")
+    def test_duplicates_from_etags(self, s3, bucket):
+        body = json.dumps([{"staff_id": 1, "last_updated": 1667485249962}])
+        keys = [
+            "updated/staff-2024-05-21 14:40:09.122625.json",
+            "updated/staff-2024-05-21 14:50:09.122625.json",
+            "updated/currency-2024-05-21 14:40:09.122625.json",
+            "updated/design-2024-05-21 14:40:09.122625.json",
+        ]
+        for key in keys[:2]:
+            bucket.put_object(Bucket="test_bucket", Key=key, Body=body)
+        bucket.put_object(Bucket="test_bucket", Key=keys[2], Body="[]")
+        bucket.put_object(Bucket="test_bucket", Key=keys[3], Body="[]")
+
+        with patch(
+            "src.processing_lambda.s3.get_object", wraps=bucket.get_object
+        ) as mock_get_object:
+            kept_keys = delete_duplicates(bucket="test_bucket")
+
+        assert mock_get_object.call_count == 0
+        assert kept_keys == [keys[2], keys[3], keys[1]]
+        assert list_object_keys(bucket="test_bucket", prefix="updated/") == kept_keys
+
+    @pytest.mark.it(
+        "Unit test: multipart ETags fall back to the sha256 in the metadata"
+    )
+    def test_duplicates_from_metadata(self, s3, bucket):
+        keys = [
+            "updated/staff-2024-05-21 14:40:09.122625.json",
+            "updated/staff-2024-05-21 14:50:09.122625.json",
+        ]
+        for key in keys:
+            bucket.put_object(
+                Bucket="test_bucket", Key=key, Body="[{}]", Metadata={"sha256": "abc"}
+            )
+        summaries = [
+            {"Key": key, "Size": 4, "ETag": f'"{i}abc-2"'} for i, key in enumerate(keys)
+        ]
+
+        with patch(
+            "src.processing_lambda.list_object_summaries", return_value=summaries
+        ):
+            kept_keys = delete_duplicates(bucket="test_bucket")
+
+        assert kept_keys == [keys[1]]
+        assert list_object_keys(bucket="test_bucket", prefix="updated/") == [keys[1]]
+
+
+class TestBulkObjectOperations:
+    @pytest.mark.it("Unit test: objects deleted 1000 keys per request")
+    def test_delete_object_keys_batches(self, s3, bucket):
+        keys = [f"updated/staff-{i:04}.json" for i in range(2001)]
+        for key in keys:
+            bucket.put_object(Bucket="test_bucket", Key=key, Body="[{}]")
+
+        with patch.object(
+            s3, "delete_objects", wraps=s3.delete_objects
+        ) as mock_delete_objects:
+            deleted = delete_object_keys(s3, keys, bucket="test_bucket")
+
+        assert deleted == 2001
+        assert mock_delete_objects.call_count == 3
+        assert list_object_keys(bucket="test_bucket") == []
+
+    @pytest.mark.it("Unit test: objects copied concurrently and throughput logged")
+    def test_copy_object_keys(self, s3, bucket, caplog):
+        caplog.set_level(logging.INFO)
+        keys = [f"updated/staff-{i:02}.json" for i in range(40)]
+        for key in keys:
+            bucket.put_object(Bucket="test_bucket", Key=key, Body="[{}]")
+
+        copied = copy_object_keys(
+            s3,
+            [(key, f"processed_updated/{key[8:]}") for key in keys],
+            bucket="test_bucket",
+            max_workers=4,
+        )
+
+        assert copied == 40
+        assert len(list_object_keys(bucket="test_bucket", prefix="processed_")) == 40
+        assert "Copied 40 objects in" in caplog.text
+
+    @pytest.mark.it("Unit test: housekeeping moves more than one page of files")
+    def test_move_and_delete_every_page(self, s3, bucket):
+        for i in range(1001):
+            bucket.put_object(
+                Bucket="test_bucket", Key=f"updated/staff-{i:04}.json", Body="[{}]"
+            )
+
+        move_processed_ingestion_data(s3, bucket="test_bucket")
+        delete_files_from_updated_after_handling(s3, bucket_name="test_bucket")
+
+        assert list_object_keys(bucket="test_bucket", prefix="updated/") == []
+        moved = list_object_keys(bucket="test_bucket", prefix="processed_updated/")
+        assert len(moved) == 1001
+
 
 class TestMoveProcessedIngestionData:
     @pytest.mark.it("Unit test: Updated files moved to new location")
@@ -734,6 +1351,80 @@ class TestArchiveProcessedData:
         assert response["KeyCount"] == 0
 
 
+def sqs_event_from_notifications(s3, bucket_name, keys):
+    """Puts the keys in a bucket notifying a moto SQS queue and returns the
+    received notifications as the SQS event the lambda is invoked with."""
+    sqs = boto3.client("sqs", region_name="eu-west-2")
+    queue_url = sqs.create_queue(QueueName="processing_queue")["QueueUrl"]
+    queue_arn = sqs.get_queue_attributes(
+        QueueUrl=queue_url, AttributeNames=["QueueArn"]
+    )["Attributes"]["QueueArn"]
+    s3.put_bucket_notification_configuration(
+        Bucket=bucket_name,
+        NotificationConfiguration={
+            "QueueConfigurations": [
+                {
+                    "QueueArn": queue_arn,
+                    "Events": ["s3:ObjectCreated:*"],
+                    "Filter": {
+                        "Key": {
+                            "FilterRules": [{"Name": "prefix", "Value": "updated/"}]
+                        }
+                    },
+                }
+            ]
+        },
+    )
+    for key, body in keys.items():
+        s3.put_object(Bucket=bucket_name, Key=key, Body=body)
+    messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10)
+    return {
+        "Records": [
+            {
+                "messageId": message["MessageId"],
+                "body": message["Body"],
+                "eventSource": "aws:sqs",
+                "eventSourceARN": queue_arn,
+            }
+            for message in messages["Messages"]
+        ]
+    }
+
+
+class TestGetEventKeys:
+    @pytest.mark.it("Unit test: keys of an S3 notification decoded")
+    def test_s3_event(self):
+        event = {
+            "Records": [
+                {
+                    "eventSource": "aws:s3",
+                    "s3": {
+                        "object": {
+                            "key": "updated/staff-2024-05-21+14%3A40%3A09.122625.json"
+                        }
+                    },
+                }
+            ]
+        }
+        assert get_event_keys(event) == [
+            "updated/staff-2024-05-21 14:40:09.122625.json"
+        ]
+
+    @pytest.mark.it("Unit test: S3 test events and the schedule have no keys")
+    def test_no_keys(self):
+        sqs_event = {
+            "Records": [
+                {
+                    "eventSource": "aws:sqs",
+                    "body": json.dumps({"Event": "s3:TestEvent", "Bucket": "bucket"}),
+                }
+            ]
+        }
+        assert get_event_keys(sqs_event) == []
+        assert get_event_keys({}) is None
+        assert get_event_keys({"source": "aws.events", "detail": {}}) is None
+
+
 class TestProcessingLambdaHandler:
 
     @pytest.mark.it("unit test: test that no updates gives correct log message")
@@ -766,6 +1457,113 @@ class TestProcessingLambdaHandler:
     #     lambda_handler(event, context)
     #     assert 'The delete function ran successfully' in caplog.text
 
+    @pytest.mark.it("unit test: exactly the files notified in an SQS event processed")
+    def test_sqs_event_processes_notified_files(self, s3, caplog):
+        caplog.set_level(logging.INFO)
+        for bucket_name in [
+            "de-team-orchid-totesys-ingestion",
+            "de-team-orchid-totesys-processed",
+        ]:
+            s3.create_bucket(
+                Bucket=bucket_name,
+                CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+            )
+        with open("data/test_data/staff.json", "r", encoding="utf-8") as json_file:
+            staff_body = json.dumps(json.load(json_file))
+        s3.put_object(
+            Bucket="de-team-orchid-totesys-ingestion",
+            Key="updated/staff-2024-05-21 14:30:09.122625.json",
+            Body=staff_body,
+        )
+        with open("data/test_data/currency.json", "r", encoding="utf-8") as json_file:
+            currency_body = json.dumps(json.load(json_file))
+        currency_key = "updated/currency-2024-05-21 14:40:09.122625.json"
+        event = sqs_event_from_notifications(
+            s3, "de-team-orchid-totesys-ingestion", {currency_key: currency_body}
+        )
+
+        lambda_handler(event, DummyContext())
+
+        assert "currency data processed" in caplog.text
+        assert "staff data processed" not in caplog.text
+        assert list_object_keys(
+            bucket="de-team-orchid-totesys-ingestion", prefix="updated/"
+        ) == ["updated/staff-2024-05-21 14:30:09.122625.json"]
+        assert list_object_keys(
+            bucket="de-team-orchid-totesys-ingestion", prefix="processed_updated/"
+        ) == [f"processed_{currency_key}"]
+
+        lambda_handler(event, DummyContext())
+        assert "was already processed" in caplog.text
+        assert "No files to be processed" in caplog.text
+
+    @pytest.mark.it(
+        "unit test: error on an SQS event raised so the batch is redelivered"
+    )
+    def test_sqs_event_error_raised(self, s3, caplog):
+        s3.create_bucket(
+            Bucket="de-team-orchid-totesys-ingestion",
+            CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+        )
+        currency_key = "updated/currency-2024-05-21 14:40:09.122625.json"
+        event = sqs_event_from_notifications(
+            s3, "de-team-orchid-totesys-ingestion", {currency_key: "[]"}
+        )
+
+        with patch(
+            "src.processing_lambda.process_updated_keys",
+            side_effect=ClientError({"Error": {"Code": "SlowDown"}}, "PutObject"),
+        ):
+            with pytest.raises(ClientError):
+                lambda_handler(event, DummyContext())
+
+        assert "Error in Lambda execution" in caplog.text
+        assert list_object_keys(
+            bucket="de-team-orchid-totesys-ingestion", prefix="updated/"
+        ) == [currency_key]
+
+    @pytest.mark.it(
+        "unit test: each table transformed once over all its files, housekeeping once"
+    )
+    def test_transform_once_per_table(self, s3, caplog):
+        caplog.set_level(logging.INFO)
+        for bucket_name in [
+            "de-team-orchid-totesys-ingestion",
+            "de-team-orchid-totesys-processed",
+        ]:
+            s3.create_bucket(
+                Bucket=bucket_name,
+                CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+            )
+        keys = [
+            "updated/staff-2024-05-21 14:40:09.122625.json",
+            "updated/staff-2024-05-21 14:50:09.122625.json",
+            "updated/purchase_order-2024-05-21 14:40:09.122625.json",
+        ]
+        for i, key in enumerate(keys):
+            s3.put_object(
+                Bucket="de-team-orchid-totesys-ingestion",
+                Key=key,
+                Body=json.dumps([{"staff_id": i, "last_updated": 1667485249962}]),
+            )
+        staff_transform = mock.Mock()
+
+        with patch.dict(
+            "src.processing_lambda.TABLE_TRANSFORMS", {"staff": staff_transform}
+        ), patch(
+            "src.processing_lambda.move_processed_ingestion_data"
+        ) as mock_move, patch(
+            "src.processing_lambda.delete_files_from_updated_after_handling"
+        ) as mock_delete:
+            lambda_handler({}, DummyContext())
+
+        staff_transform.assert_called_once()
+        records = staff_transform.call_args[0][0]
+        assert [record["staff_id"] for record in records["staff"]] == [0, 1]
+        assert "No transform for purchase_order" in caplog.text
+        mock_move.assert_called_once()
+        mock_delete.assert_called_once()
+
     @pytest.mark.it(
         "unit test: test that correct function runs when there is updated data"
     )
@@ -803,3 +1601,42 @@ class TestProcessingLambdaHandler:
         )
 
         assert contents["Contents"][0]["Key"][0:18] == "dimension/currency"
+
+    @pytest.mark.it(
+        "unit test: a retried run overwrites its fact objects instead of adding more"
+    )
+    def test_retry_overwrites_fact_keys(self, s3, caplog):
+        for bucket_name in [
+            "de-team-orchid-totesys-ingestion",
+            "de-team-orchid-totesys-processed",
+        ]:
+            s3.create_bucket(
+                Bucket=bucket_name,
+                CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+            )
+        with open(
+            "data/test_data_unix_ts/sales_order_unix.json", "r", encoding="utf-8"
+        ) as json_file:
+            s3.put_object(
+                Bucket="de-team-orchid-totesys-ingestion",
+                Key="updated/sales_order-2024-05-21 14:40:09.122625.json",
+                Body=json_file.read(),
+            )
+
+        with patch(
+            "src.processing_lambda.move_processed_ingestion_data",
+            side_effect=ClientError({"Error": {"Code": "SlowDown"}}, "CopyObject"),
+        ):
+            lambda_handler({}, DummyContext())
+        first_keys = list_object_keys(
+            bucket="de-team-orchid-totesys-processed", prefix="fact/"
+        )
+        lambda_handler({}, DummyContext())
+
+        assert "Error in Lambda execution" in caplog.text
+        assert first_keys
+        assert all("2024-05-21 14:40:09.122625-" in key for key in first_keys)
+        assert (
+            list_object_keys(bucket="de-team-orchid-totesys-processed", prefix="fact/")
+            == first_keys
+        )